@@ -0,0 +1,256 @@
+"""
+从外部社团 API 并发抓取社团列表与详情。
+
+update_club_information() 过去先分页获取 /api/club/list，再逐个同步请求
+/api/club/{id}/info（在 async 函数里调用 requests.get），几百个社团要几分钟，
+期间整个服务器的事件循环被阻塞。
+
+这里：
+- 共享一个 httpx.AsyncClient；列表分页依次获取，每页的社团详情立即并发请求，
+  同时进行的详情请求数由信号量限制（club_crawler.concurrency）；
+- 连接失败、超时、429 和 5xx 按指数退避（加随机抖动）重试，429 优先按 Retry-After 等待；
+- 条件请求：带上次响应的 ETag / Last-Modified（If-None-Match / If-Modified-Since），
+  返回 304 的社团记为未变化，由调用方沿用已有数据；
+- 记录进度与指标（请求数、重试、未变化/失败数、延迟分位数），通过 stats() 查看。
+本地测试可以用 mock_club_api.py 模拟外部 API。
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Collection, Dict, List, MutableMapping, Optional
+
+import httpx
+
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+_RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CrawlMetrics:
+    """一次抓取的进度与指标"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.pages = 0
+        self.listed = 0
+        self.fetched = 0  # 返回了新内容的社团
+        self.unchanged = 0  # 返回 304 的社团
+        self.failed = 0
+        self.requests = 0
+        self.retries = 0
+        self.latencies: deque = deque(maxlen=1000)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = list(self.latencies)
+        done = self.fetched + self.unchanged + self.failed
+        elapsed = (self.finished or time.monotonic()) - self.started
+
+        def ms(q):
+            value = _percentile(latencies, q)
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            "running": self.finished is None,
+            "elapsed_s": round(elapsed, 2),
+            "pages": self.pages,
+            "listed": self.listed,
+            "done": done,
+            "fetched": self.fetched,
+            "unchanged": self.unchanged,
+            "failed": self.failed,
+            "requests": self.requests,
+            "retries": self.retries,
+            "latency_p50_ms": ms(0.5),
+            "latency_p95_ms": ms(0.95),
+            "clubs_per_second": round(done / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+class CrawlResult:
+    """
+    一次抓取的结果。
+    - details: 返回了新内容的社团详情（club_id -> 接口返回的 JSON）
+    - unchanged: 内容未变化（304）的社团 id
+    - failed: 重试后仍然失败的社团 id -> 错误信息
+    - listed: 列表接口返回的全部社团 id（按列表顺序）
+    """
+
+    def __init__(self, metrics: CrawlMetrics):
+        self.details: Dict[int, Dict[str, Any]] = {}
+        self.unchanged: List[int] = []
+        self.failed: Dict[int, str] = {}
+        self.listed: List[int] = []
+        self.metrics = metrics
+
+
+# 各社团详情上次响应的 ETag / Last-Modified（club_id -> {"etag": ..., "last_modified": ...}）
+cached_validators: Dict[int, Dict[str, str]] = {}
+
+current: Optional[CrawlMetrics] = None  # 正在进行的抓取
+last: Optional[CrawlMetrics] = None  # 最近一次完成的抓取
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """获取（必要时创建）访问外部 API 的共享异步 HTTP 客户端"""
+    global _client
+    if _client is None or _client.is_closed:
+        max_connections = config.club_crawler_concurrency
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.club_crawler_timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+    return _client
+
+
+async def close_client():
+    """关闭共享客户端（服务器关闭时调用）"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _backoff(attempt: int, response: Optional[httpx.Response]) -> float:
+    if response is not None and response.status_code == 429:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after)
+    return config.club_crawler_backoff * (2 ** attempt) * (0.5 + random.random())
+
+
+async def get_with_retry(url: str, metrics: CrawlMetrics, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """GET 请求，可重试的错误按指数退避重试；返回 2xx 或 304 响应，其他情况抛出异常"""
+    retries = config.club_crawler_retries
+    for attempt in range(retries + 1):
+        response = None
+        start = time.perf_counter()
+        try:
+            metrics.requests += 1
+            response = await get_client().get(url, headers=headers)
+            metrics.latencies.append(time.perf_counter() - start)
+            if response.status_code == 304:
+                return response
+            response.raise_for_status()
+            return response
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in _RETRYABLE_STATUS or attempt == retries:
+                raise
+            error = f"HTTP {e.response.status_code}"
+        except httpx.TransportError as e:  # 连接失败、超时
+            if attempt == retries:
+                raise
+            error = str(e) or type(e).__name__
+        metrics.retries += 1
+        delay = _backoff(attempt, response)
+        logger.warning(f"请求 {url} 失败（{error}），{delay:.1f} 秒后第 {attempt + 1} 次重试")
+        await asyncio.sleep(delay)
+
+
+def _conditional_headers(club_id: int, validators: MutableMapping[int, Dict[str, str]]) -> Dict[str, str]:
+    cached = validators.get(club_id) or {}
+    headers = {}
+    if cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    return headers
+
+
+async def _fetch_detail(club_id: int, result: CrawlResult, semaphore: asyncio.Semaphore,
+                        known: Collection[int], validators: MutableMapping[int, Dict[str, str]], post_num: int):
+    metrics = result.metrics
+    url = f"{config.external_api_base_url}/api/club/{club_id}/info?post_num={post_num}"
+    # 只有调用方保留了该社团的数据时才发条件请求，否则 304 之后没有可沿用的内容
+    headers = _conditional_headers(club_id, validators) if club_id in known else None
+    async with semaphore:
+        try:
+            response = await get_with_retry(url, metrics, headers)
+            if response.status_code == 304:
+                result.unchanged.append(club_id)
+                metrics.unchanged += 1
+                return
+            result.details[club_id] = response.json()
+            metrics.fetched += 1
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+            if etag or last_modified:
+                validators[club_id] = {key: value for key, value in
+                                       (("etag", etag), ("last_modified", last_modified)) if value}
+            else:
+                validators.pop(club_id, None)
+        except Exception as e:
+            result.failed[club_id] = str(e) or type(e).__name__
+            metrics.failed += 1
+            logger.error(f"获取社团 (ID: {club_id}) 详情失败: {e}")
+
+
+async def crawl(known: Collection[int] = (), validators: Optional[MutableMapping[int, Dict[str, str]]] = None,
+                post_num: Optional[int] = None) -> CrawlResult:
+    """
+    抓取全部社团：分页获取列表，并发获取详情。
+    known 为调用方已有数据的社团 id，这些社团使用条件请求，未变化时计入 result.unchanged。
+    validators 为各社团的 ETag / Last-Modified（默认使用模块内的 cached_validators），抓取时就地更新。
+    列表接口重试后仍失败时抛出异常（无法判断有哪些社团）。
+    """
+    global current, last
+    validators = validators if validators is not None else cached_validators
+    post_num = post_num if post_num is not None else config.club_crawler_post_num
+    page_size = config.club_crawler_page_size
+    metrics = current = CrawlMetrics()
+    result = CrawlResult(metrics)
+    semaphore = asyncio.Semaphore(config.club_crawler_concurrency)
+    known = set(known)
+    seen = set()
+    tasks: List[asyncio.Task] = []
+    try:
+        offset = 0
+        while True:
+            url = f"{config.external_api_base_url}/api/club/list?offset={offset}&num={page_size}"
+            page = (await get_with_retry(url, metrics)).json()
+            metrics.pages += 1
+            for item in page:
+                club_id = int(item["club_id"])
+                if club_id in seen:  # 分页期间列表变化可能导致重复
+                    continue
+                seen.add(club_id)
+                result.listed.append(club_id)
+                metrics.listed += 1
+                tasks.append(asyncio.create_task(
+                    _fetch_detail(club_id, result, semaphore, known, validators, post_num)
+                ))
+            offset += page_size
+            if len(page) < page_size:  # 返回数量小于请求数量，已经到末尾
+                break
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        metrics.finished = time.monotonic()
+        current = None
+        last = metrics
+    logger.info(f"社团信息抓取完成: {metrics.snapshot()}")
+    return result
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "base_url": config.external_api_base_url,
+        "concurrency": config.club_crawler_concurrency,
+        "current": current.snapshot() if current is not None else None,
+        "last": last.snapshot() if last is not None else None,
+    }
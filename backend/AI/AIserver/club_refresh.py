@@ -0,0 +1,242 @@
+"""
+在后台定时刷新社团信息，并把变化的社团增量同步给推荐服务。
+
+过去社团信息只在调用 POST /update_club_data 时刷新，整个抓取期间该请求一直阻塞，
+推荐服务（recommend_system）则只在启动或 /reload_data 时读取 CSV，并且每次推荐都
+重新拟合全部社团的特征。这里：
+- ClubRefresher 每隔 club_refresh.interval_seconds 调用一次刷新函数（抓取并增量写入
+  club_store，见 update_club_information()），0 表示不定时刷新；同一时间只运行一次刷新，
+  手动触发时立即返回，刷新在后台进行；
+- 每次刷新后，把 club_store 中上次同步之后的变更推送给推荐服务（POST /clubs/sync）：
+  首次同步、变更记录已被清理或推荐服务的序号与这里不一致（推荐服务重启、重新加载过 CSV）时
+  推送全部社团（replace），否则只推送新增/修改的社团和被删除的 id（delta），推荐服务只重新
+  计算这些社团的特征；推送失败时保留序号，下次刷新时重试。
+其他下游可以通过 GET /club_changes 按序号拉取变更流。
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+import club_store
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+REPLACE = "replace"
+DELTA = "delta"
+
+_PAGE = 1000  # 每次从 club_store 读取的变更条数
+
+
+def recommender_record(club_id: int, club: Dict[str, Any]) -> Dict[str, Any]:
+    """把社团信息转换为推荐服务使用的格式（与 extract_club_data.py 生成的 CSV 列相同）"""
+    tags = club.get("tags") or []
+    posts = club.get("posts") or []
+    return {
+        "club_id": int(club_id),
+        "club_name": club.get("club_name", ""),
+        "tags": "|".join(str(tag) for tag in tags) if isinstance(tags, list) else str(tags),
+        "desc": club.get("desc") or "",
+        "posts": len(posts) if isinstance(posts, list) else int(posts),
+        "member_count": club.get("member_count", 0),
+    }
+
+
+def _error(e: Exception) -> str:
+    return str(getattr(e, "detail", None) or e) or type(e).__name__
+
+
+class RecommenderSync:
+    """记录已同步给推荐服务的变更序号，并推送之后的变更"""
+
+    def __init__(self):
+        self.synced_seq: Optional[int] = None  # None 表示还没有同步过，下次推送全部社团
+        self.pushes = 0
+        self.failures = 0
+        self.last: Optional[Dict[str, Any]] = None
+
+    def _pending(self) -> Tuple[bool, List[Dict[str, Any]], int]:
+        """synced_seq 之后的全部变更，返回 (是否需要全量同步, 变更列表, 最新序号)"""
+        store = club_store.store
+        if self.synced_seq is None:
+            return True, [], store.latest_seq()
+        seq, changes = self.synced_seq, []
+        while True:
+            feed = store.changes_since(seq, _PAGE)
+            if feed["reset"]:
+                return True, [], feed["latest_seq"]
+            changes.extend(feed["changes"])
+            if len(feed["changes"]) < _PAGE:
+                return False, changes, max(seq, feed["latest_seq"])
+            seq = feed["changes"][-1]["seq"]
+
+    def _payload(self, mode: str, changes: List[Dict[str, Any]], seq: int) -> Dict[str, Any]:
+        store = club_store.store
+        if mode == REPLACE:
+            clubs = store.all()
+            return {"mode": REPLACE, "seq": seq, "deletes": [],
+                    "upserts": [recommender_record(club_id, club) for club_id, club in clubs.items()]}
+        # 同一社团的多条变更以最后一条为准
+        latest = {}
+        for change in changes:
+            latest[change["club_id"]] = change["kind"]
+        upsert_ids = [club_id for club_id, kind in latest.items() if kind == club_store.UPSERT]
+        clubs = store.get_many(upsert_ids)
+        return {
+            "mode": DELTA,
+            "from_seq": self.synced_seq,
+            "seq": seq,
+            "upserts": [recommender_record(club_id, clubs[club_id]) for club_id in upsert_ids if club_id in clubs],
+            # 读取期间又被删除的社团同样按删除处理
+            "deletes": [club_id for club_id, kind in latest.items()
+                        if kind == club_store.DELETE or (kind == club_store.UPSERT and club_id not in clubs)],
+        }
+
+    async def push(self) -> Optional[Dict[str, Any]]:
+        """把未同步的变更推送给推荐服务，没有需要推送的内容时返回 None"""
+        full, changes, seq = self._pending()
+        if full and not club_store.store.count():
+            return None  # 存储为空（还没有抓取过），不能用空列表替换推荐服务从 CSV 加载的数据
+        if not full and not changes:
+            self.synced_seq = seq
+            return None
+        payload = self._payload(REPLACE if full else DELTA, changes, seq)
+        url = f"{config.recommendation_service_url}/clubs/sync"
+        start = time.perf_counter()
+        try:
+            async with httpx.AsyncClient(timeout=config.recommendation_service_timeout) as client:
+                response = await client.post(url, json=payload)
+                if response.status_code == 409 and payload["mode"] == DELTA:
+                    # 推荐服务的序号与这里不一致，改为全量同步
+                    logger.info(f"推荐服务的社团数据序号不一致，改为全量同步: {response.text[:200]}")
+                    payload = self._payload(REPLACE, [], seq)
+                    response = await client.post(url, json=payload)
+                response.raise_for_status()
+                body = response.json()
+        except Exception as e:
+            self.failures += 1
+            self.last = {"at": time.time(), "mode": payload["mode"], "status": "failed", "error": _error(e)}
+            logger.warning(f"同步社团数据到推荐服务失败，下次刷新时重试: {_error(e)}")
+            raise
+        self.pushes += 1
+        self.synced_seq = seq
+        self.last = {
+            "at": time.time(),
+            "mode": payload["mode"],
+            "status": "success",
+            "seq": seq,
+            "upserts": len(payload["upserts"]),
+            "deletes": len(payload["deletes"]),
+            "duration_s": round(time.perf_counter() - start, 3),
+            "recommender": body,
+        }
+        logger.info(f"已同步社团数据到推荐服务（{payload['mode']}，{len(payload['upserts'])} 个更新，"
+                    f"{len(payload['deletes'])} 个删除，序号 {seq}）")
+        return self.last
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": config.club_refresh_sync_recommender,
+            "url": config.recommendation_service_url,
+            "synced_seq": self.synced_seq,
+            "pushes": self.pushes,
+            "failures": self.failures,
+            "last": self.last,
+        }
+
+
+class ClubRefresher:
+    """定时或手动在后台刷新社团信息，同一时间只运行一次刷新"""
+
+    def __init__(self, refresh: Callable[[], Awaitable[Dict[str, Any]]]):
+        self._refresh = refresh
+        self.sync = RecommenderSync()
+        self._task: Optional[asyncio.Task] = None  # 正在进行的刷新
+        self._loop_task: Optional[asyncio.Task] = None
+        self.current: Optional[Dict[str, Any]] = None
+        self.last: Optional[Dict[str, Any]] = None
+        self.next_run_at: Optional[float] = None
+        self.runs = 0
+        self.failures = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        for task in (self._loop_task, self._task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._loop_task = None
+        self._task = None
+
+    async def _loop(self):
+        if config.club_refresh_sync_recommender:
+            # 启动时先把存储中的社团同步给推荐服务（推荐服务可能还在启动，失败时下次刷新重试）
+            try:
+                await self.sync.push()
+            except Exception:
+                pass
+        while True:
+            interval = config.club_refresh_interval
+            if not interval or interval <= 0:
+                # 未启用定时刷新，定期检查配置（配置可以在运行时重载）
+                self.next_run_at = None
+                await asyncio.sleep(60)
+                continue
+            self.next_run_at = time.time() + interval
+            await asyncio.sleep(interval)
+            task, _ = self.trigger("scheduled")
+            await task
+
+    def trigger(self, reason: str = "manual") -> Tuple[asyncio.Task, bool]:
+        """开始一次后台刷新，返回 (刷新任务, 是否新开始)；已有刷新在进行时返回该任务"""
+        if self.running:
+            return self._task, False
+        self.current = {"reason": reason, "started_at": time.time()}
+        self._task = asyncio.create_task(self._run(self.current))
+        return self._task, True
+
+    async def _run(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        """执行一次刷新；失败时不抛出异常（后台任务可能没有调用方等待），结果记录在 run 中"""
+        start = time.perf_counter()
+        try:
+            run.update(status="success", result=await self._refresh())
+        except Exception as e:
+            self.failures += 1
+            run.update(status="failed", error=_error(e))
+            logger.error(f"后台刷新社团信息失败（{run['reason']}）: {_error(e)}")
+        if run["status"] == "success" and config.club_refresh_sync_recommender:
+            try:
+                run["sync"] = await self.sync.push()
+            except Exception as e:
+                run["sync_error"] = _error(e)
+        self.runs += 1
+        run.update(finished_at=time.time(), duration_s=round(time.perf_counter() - start, 3))
+        self.last = run
+        self.current = None
+        return run
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": config.club_refresh_interval,
+            "running": self.running,
+            "current": self.current,
+            "next_run_at": self.next_run_at,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last": self.last,
+            "latest_seq": club_store.store.latest_seq(),
+            "recommender_sync": self.sync.stats(),
+        }
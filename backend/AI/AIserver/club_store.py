@@ -0,0 +1,275 @@
+"""
+社团信息的持久化存储（SQLite），按社团 id 增量更新并记录变更。
+
+过去每次抓取完成后用 indent=2 重写整个 Club_information.json，读取时也要解析整个文件，
+也无法知道哪些社团发生了变化。这里：
+- clubs 表以 club_id 为主键保存每个社团的 JSON、内容哈希和上次响应的 ETag / Last-Modified，
+  可以按 id 读取单个社团；
+- upsert 时比较内容哈希，只有内容变化的社团才写入并在 changes 表中追加一条变更
+  （序号递增），删除同样记录为变更；
+- 下游（推荐服务、prompt 中的社团列表等）可以用 changes_since(seq) 拉取某个序号之后的变更，
+  或用 subscribe() 注册回调，在每次提交后收到本次的变更列表，只刷新变化的社团；
+- changes 表只保留最近 club_store.max_changes 条，拉取的序号早于保留范围时返回
+  reset=True，调用方应全量重建。
+首次打开且存储为空时，从旧的 Club_information.json 导入。
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clubs (
+    club_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    club_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    content_hash TEXT,
+    changed_at REAL NOT NULL
+);
+"""
+
+
+def content_hash(data: Dict[str, Any]) -> str:
+    body = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _change(row: Tuple) -> Dict[str, Any]:
+    seq, club_id, kind, changed_at = row
+    return {"seq": seq, "club_id": club_id, "kind": kind, "changed_at": changed_at}
+
+
+class ClubStore:
+    def __init__(self):
+        self.path: Optional[str] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._subscribers: List[Callable[[List[Dict[str, Any]]], None]] = []
+
+    def open(self, path: Optional[str] = None):
+        """打开（必要时创建）数据库；默认路径为 club_store.path（相对于本文件所在目录）"""
+        if self._conn is not None:
+            return
+        path = path or config.club_store_path
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        conn = sqlite3.connect(path, check_same_thread=False)  # 读写由 self._lock 串行化
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        self.path = path
+        self._conn = conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.open()
+        return self._conn
+
+    # ---- 读取 ----
+
+    def get(self, club_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM clubs WHERE club_id = ?", (int(club_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, club_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        ids = [int(club_id) for club_id in club_ids]
+        result: Dict[int, Dict[str, Any]] = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):  # SQLite 单条语句的参数数量有上限
+                chunk = ids[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT club_id, data FROM clubs WHERE club_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                result.update((club_id, json.loads(data)) for club_id, data in rows)
+        return result
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        """全部社团（club_id 字符串 -> 社团信息），与旧的 Club_information.json 格式相同"""
+        with self._lock:
+            rows = self.conn.execute("SELECT club_id, data FROM clubs ORDER BY club_id").fetchall()
+        return {str(club_id): json.loads(data) for club_id, data in rows}
+
+    def ids(self) -> List[int]:
+        with self._lock:
+            return [row[0] for row in self.conn.execute("SELECT club_id FROM clubs ORDER BY club_id")]
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM clubs").fetchone()[0]
+
+    def validators(self) -> Dict[int, Dict[str, str]]:
+        """各社团上次响应的 ETag / Last-Modified，供 club_crawler 发条件请求"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT club_id, etag, last_modified FROM clubs WHERE etag IS NOT NULL OR last_modified IS NOT NULL"
+            ).fetchall()
+        return {club_id: {key: value for key, value in (("etag", etag), ("last_modified", last_modified)) if value}
+                for club_id, etag, last_modified in rows}
+
+    # ---- 写入 ----
+
+    def upsert_many(self, clubs: Dict[int, Dict[str, Any]],
+                    validators: Optional[Dict[int, Dict[str, str]]] = None) -> List[Dict[str, Any]]:
+        """写入多个社团，返回内容发生变化（新增或修改）的变更记录"""
+        validators = validators or {}
+        now = time.time()
+        with self._lock:
+            conn = self.conn
+            existing = {}
+            ids = [int(club_id) for club_id in clubs]
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                existing.update(conn.execute(
+                    f"SELECT club_id, content_hash FROM clubs WHERE club_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+            changes = []
+            with conn:
+                for club_id, data in clubs.items():
+                    club_id = int(club_id)
+                    digest = content_hash(data)
+                    cached = validators.get(club_id) or {}
+                    if existing.get(club_id) == digest:
+                        # 内容未变化，只更新 ETag / Last-Modified
+                        conn.execute("UPDATE clubs SET etag = ?, last_modified = ? WHERE club_id = ?",
+                                     (cached.get("etag"), cached.get("last_modified"), club_id))
+                        continue
+                    conn.execute(
+                        "INSERT OR REPLACE INTO clubs (club_id, data, content_hash, etag, last_modified, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (club_id, json.dumps(data, ensure_ascii=False), digest,
+                         cached.get("etag"), cached.get("last_modified"), now)
+                    )
+                    changes.append(self._record(club_id, UPSERT, digest, now))
+                self._prune()
+        self._publish(changes)
+        return changes
+
+    def upsert(self, club_id: int, data: Dict[str, Any], etag: Optional[str] = None,
+               last_modified: Optional[str] = None) -> bool:
+        """写入单个社团，内容发生变化时返回 True"""
+        validators = {int(club_id): {"etag": etag, "last_modified": last_modified}}
+        return bool(self.upsert_many({club_id: data}, validators))
+
+    def delete_many(self, club_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            conn = self.conn
+            changes = []
+            with conn:
+                for club_id in club_ids:
+                    if conn.execute("DELETE FROM clubs WHERE club_id = ?", (int(club_id),)).rowcount:
+                        changes.append(self._record(int(club_id), DELETE, None, now))
+                self._prune()
+        self._publish(changes)
+        return changes
+
+    def delete_missing(self, keep_ids: Iterable[int]) -> List[Dict[str, Any]]:
+        """删除不在 keep_ids 中的社团（外部 API 列表中已不存在的社团）"""
+        keep = {int(club_id) for club_id in keep_ids}
+        return self.delete_many([club_id for club_id in self.ids() if club_id not in keep])
+
+    def _record(self, club_id: int, kind: str, digest: Optional[str], now: float) -> Dict[str, Any]:
+        cursor = self._conn.execute(
+            "INSERT INTO changes (club_id, kind, content_hash, changed_at) VALUES (?, ?, ?, ?)",
+            (club_id, kind, digest, now)
+        )
+        return {"seq": cursor.lastrowid, "club_id": club_id, "kind": kind, "changed_at": now}
+
+    def _prune(self):
+        self._conn.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?",
+                           (config.club_store_max_changes,))
+
+    # ---- 变更 ----
+
+    def latest_seq(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def changes_since(self, seq: int = 0, limit: int = 1000) -> Dict[str, Any]:
+        """
+        序号大于 seq 的变更（按序号升序，最多 limit 条）。
+        返回 {"changes": [...], "latest_seq": ..., "reset": bool}；
+        reset 为 True 表示 seq 之后的部分变更已被清理，调用方应全量重建。
+        """
+        with self._lock:
+            conn = self.conn
+            oldest = conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+            latest = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            rows = conn.execute(
+                "SELECT seq, club_id, kind, changed_at FROM changes WHERE seq > ? ORDER BY seq LIMIT ?",
+                (seq, limit)
+            ).fetchall()
+        return {
+            "changes": [_change(row) for row in rows],
+            "latest_seq": latest,
+            # 序号早于保留范围，或大于最新序号（数据库被重建过）
+            "reset": seq > latest or (oldest is not None and seq < oldest - 1),
+        }
+
+    def subscribe(self, callback: Callable[[List[Dict[str, Any]]], None]):
+        """注册回调，每次写入提交后以本次的变更列表调用（没有变更时不调用）"""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[List[Dict[str, Any]]], None]):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def _publish(self, changes: List[Dict[str, Any]]):
+        if not changes:
+            return
+        for callback in list(self._subscribers):
+            try:
+                callback(changes)
+            except Exception as e:
+                logger.error(f"社团信息变更回调出错: {e}")
+
+    # ---- 迁移 ----
+
+    def import_json(self, path: str) -> int:
+        """存储为空时从旧的 Club_information.json 导入，返回导入的社团数"""
+        if self.count() or not os.path.exists(path) or not os.path.getsize(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"读取旧的社团信息文件失败，跳过导入: {path}, 错误: {e}")
+            return 0
+        if not isinstance(data, dict):
+            logger.error(f"旧的社团信息文件格式错误，应为字典，跳过导入: {path}")
+            return 0
+        changes = self.upsert_many({int(club_id): club for club_id, club in data.items()})
+        logger.info(f"已从 {path} 导入 {len(changes)} 个社团到 {self.path}")
+        return len(changes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"path": self.path, "clubs": self.count(), "latest_seq": self.latest_seq()}
+
+
+store = ClubStore()
@@ -0,0 +1,194 @@
+"""
+相同并发请求的合并（single-flight）。
+
+社团公告发出后，很多用户会在几秒内用完全相同的内容请求 /summarize_tongyi 或
+/club_atmosphere，每个请求各自触发一次生成。这里把同时进行的相同请求（归一化后的
+输入和生成参数相同）合并为一次上游生成：
+- call(): 非流式请求，所有等待者得到同一个结果（或同一个异常）；
+- stream(): 流式请求，上游输出的每段文本分发给所有订阅者，中途加入的订阅者先补发
+  已生成的部分，因此每个客户端都收到完整的输出。
+上游生成在独立的任务中运行，不依附于第一个请求：某个客户端断开不影响其他客户端；
+所有订阅者都离开时取消上游生成（关闭上游连接）。
+生成结束后即从表中移除，之后的相同请求重新生成（这里只合并并发请求，不做结果缓存）。
+coalescing.enabled 为 false 时不合并。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import unicodedata
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return unicodedata.normalize("NFKC", value).replace("\r\n", "\n").strip()
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def request_key(endpoint: str, **fields: Any) -> str:
+    """请求的合并键：接口名加归一化后的输入和生成参数（字符串统一 Unicode 形式、换行符并去掉首尾空白）"""
+    body = json.dumps(_normalize(fields), ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.blake2b(f"{endpoint}\x00{body}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class CoalescingStats:
+    """单个接口的请求数、实际生成次数和被合并（节省）的请求数"""
+
+    def __init__(self):
+        self.requests = 0
+        self.generations = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "generations": self.generations,
+            "coalesced": self.coalesced,
+            "cancelled_generations": self.cancelled,
+            "saved_ratio": round(self.coalesced / self.requests, 4) if self.requests else None,
+        }
+
+
+class _Flight:
+    """一次进行中的上游生成及其订阅者"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.chunks: List[Any] = []  # 流式请求已产出的文本
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        # 唤醒所有等待中的订阅者，之后的等待使用新的事件
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+_flights: Dict[str, _Flight] = {}
+_stats: Dict[str, CoalescingStats] = {}
+
+
+def stats_for(endpoint: str) -> CoalescingStats:
+    stats = _stats.get(endpoint)
+    if stats is None:
+        stats = _stats[endpoint] = CoalescingStats()
+    return stats
+
+
+def _join(endpoint: str, key: str, start: Callable[[_Flight], Awaitable[None]]) -> _Flight:
+    """加入进行中的相同请求；没有时创建一个并启动上游生成"""
+    stats = stats_for(endpoint)
+    stats.requests += 1
+    flight = _flights.get(key)
+    if flight is not None:
+        stats.coalesced += 1
+    else:
+        stats.generations += 1
+        flight = _flights[key] = _Flight(endpoint)
+
+        async def run():
+            try:
+                await start(flight)
+            except asyncio.CancelledError:
+                flight.error = asyncio.CancelledError()
+                raise
+            except Exception as e:
+                flight.error = e
+            finally:
+                flight.done = True
+                if _flights.get(key) is flight:
+                    del _flights[key]
+                flight.notify()
+
+        flight.task = asyncio.create_task(run())
+    flight.subscribers += 1
+    return flight
+
+
+def _leave(key: str, flight: _Flight):
+    """订阅者离开；最后一个订阅者离开且生成尚未结束时取消上游生成"""
+    flight.subscribers -= 1
+    if flight.subscribers == 0 and not flight.done:
+        stats_for(flight.endpoint).cancelled += 1
+        if _flights.get(key) is flight:
+            del _flights[key]  # 之后到达的相同请求重新生成
+        flight.task.cancel()
+
+
+async def call(endpoint: str, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+    """非流式请求：相同 key 的并发调用只执行一次 factory()，共享结果或异常"""
+    if not config.coalescing_enabled:
+        return await factory()
+
+    async def start(flight: _Flight):
+        flight.result = await factory()
+
+    flight = _join(endpoint, key, start)
+    try:
+        while not flight.done:
+            await flight.changed.wait()
+    finally:
+        _leave(key, flight)
+    if flight.error is not None:
+        raise flight.error
+    return flight.result
+
+
+async def stream(endpoint: str, key: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+    """流式请求：相同 key 的并发调用共享 factory() 产出的一次流式生成，每个订阅者都收到完整输出"""
+    if not config.coalescing_enabled:
+        deltas = factory()
+        try:
+            async for chunk in deltas:
+                yield chunk
+        finally:
+            await deltas.aclose()
+        return
+
+    async def start(flight: _Flight):
+        deltas = factory()
+        try:
+            async for chunk in deltas:
+                flight.chunks.append(chunk)
+                flight.notify()
+        finally:
+            await deltas.aclose()
+
+    flight = _join(endpoint, key, start)
+    index = 0
+    try:
+        while True:
+            while index < len(flight.chunks):
+                yield flight.chunks[index]
+                index += 1
+            if flight.done:
+                break
+            await flight.changed.wait()
+    finally:
+        _leave(key, flight)
+    if flight.error is not None:
+        raise flight.error
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "enabled": config.coalescing_enabled,
+        "in_flight": len(_flights),
+        "endpoints": {name: _stats[name].snapshot() for name in sorted(_stats)}
+    }
@@ -70,6 +70,31 @@ class ConfigManager:
     def vllm_api_url(self) -> str:
         return self.get('vllm.api_url', 'http://localhost:8000/v1/chat/completions')
     
+    @property
+    def vllm_api_urls(self) -> list:
+        # 多个 vLLM 副本；未配置时只使用 api_url
+        return self.get('vllm.api_urls') or [self.vllm_api_url]
+    
+    @property
+    def balancing_policy(self) -> str:
+        return self.get('vllm.balancing.policy', 'queue_aware')
+    
+    @property
+    def balancing_sticky(self) -> bool:
+        return self.get('vllm.balancing.sticky', True)
+    
+    @property
+    def balancing_max_imbalance(self) -> int:
+        return self.get('vllm.balancing.sticky_max_imbalance', 4)
+    
+    @property
+    def health_check_interval(self) -> float:
+        return self.get('vllm.balancing.health_check_interval', 5)
+    
+    @property
+    def health_check_timeout(self) -> float:
+        return self.get('vllm.balancing.health_check_timeout', 2)
+    
     @property
     def default_model(self) -> str:
         return self.get('vllm.default_model', 'Qwen/Qwen3-8B-AWQ')
@@ -86,6 +111,54 @@ class ConfigManager:
     def default_top_p(self) -> float:
         return self.get('request.default_top_p', 0.8)
     
+    @property
+    def vllm_max_connections(self) -> int:
+        return self.get('vllm.max_connections', 32)
+    
+    @property
+    def generation_parallelism(self) -> int:
+        return self.get('vllm.generation_parallelism', 4)
+    
+    @property
+    def structured_output_mode(self) -> str:
+        return self.get('vllm.structured_output.mode', 'guided_json')
+    
+    @property
+    def structured_output_max_retries(self) -> int:
+        return self.get('vllm.structured_output.max_retries', 1)
+    
+    @property
+    def tokenizer_path(self) -> str:
+        return self.get('vllm.tokenizer.path', None)
+    
+    @property
+    def tokenizer_local_files_only(self) -> bool:
+        return self.get('vllm.tokenizer.local_files_only', False)
+    
+    @property
+    def context_window(self) -> int:
+        return self.get('vllm.context_window', 32768)
+    
+    @property
+    def token_budget_percentile(self) -> float:
+        return self.get('vllm.token_budget.percentile', 0.95)
+    
+    @property
+    def token_budget_headroom(self) -> float:
+        return self.get('vllm.token_budget.headroom', 1.2)
+    
+    @property
+    def token_budget_min_samples(self) -> int:
+        return self.get('vllm.token_budget.min_samples', 20)
+    
+    @property
+    def token_budget_min_tokens(self) -> int:
+        return self.get('vllm.token_budget.min_tokens', 256)
+    
+    @property
+    def token_budget_window(self) -> int:
+        return self.get('vllm.token_budget.window', 500)
+    
     @property
     def request_timeout(self) -> int:
         return self.get('request.timeout', 120)
@@ -118,6 +191,188 @@ class ConfigManager:
     def rate_limit_window(self) -> int:
         return self.get('rate_limit.window_seconds', 60)
 
+    @property
+    def ml_dedup_threshold(self) -> float:
+        return self.get('ml_generation.dedup_threshold', 0.8)
+    
+    @property
+    def ml_prompt_sample_size(self) -> int:
+        return self.get('ml_generation.prompt_sample_size', 10)
+    
+    @property
+    def ml_interaction_min_entities(self) -> int:
+        return self.get('ml_generation.interaction_min_entities', 10)
+    
+    @property
+    def job_state_dir(self) -> str:
+        return self.get('jobs.state_dir', 'jobs')
+    
+    @property
+    def job_workers(self) -> int:
+        return self.get('jobs.workers', 2)
+    
+    @property
+    def prompt_dir(self) -> str:
+        return self.get('prompts.dir', 'prompts')
+    
+    @property
+    def tongyi_base_url(self) -> str:
+        return self.get('tongyi.base_url', 'https://dashscope.aliyuncs.com/compatible-mode/v1')
+    
+    @property
+    def tongyi_api_key(self) -> str:
+        # 环境变量优先，便于部署时不把密钥写进配置文件
+        return os.environ.get('DASHSCOPE_API_KEY') or self.get('tongyi.api_key', '')
+    
+    @property
+    def tongyi_model(self) -> str:
+        return self.get('tongyi.model', 'qwen-plus')
+    
+    @property
+    def tongyi_timeout(self) -> int:
+        return self.get('tongyi.timeout', 60)
+    
+    @property
+    def tongyi_max_connections(self) -> int:
+        return self.get('tongyi.max_connections', 16)
+    
+    @property
+    def llm_backends(self) -> list:
+        return self.get('llm_router.backends', [{"name": "local", "kind": "http"}])
+    
+    @property
+    def llm_routes(self) -> dict:
+        return self.get('llm_router.routes', {"default": ["local"]})
+    
+    @property
+    def llm_router_failure_threshold(self) -> int:
+        return self.get('llm_router.failure_threshold', 3)
+    
+    @property
+    def llm_router_cooldown(self) -> float:
+        return self.get('llm_router.cooldown_seconds', 30)
+    
+    @property
+    def llm_router_min_samples(self) -> int:
+        return self.get('llm_router.min_samples', 3)
+    
+    @property
+    def llm_router_window(self) -> int:
+        return self.get('llm_router.window', 100)
+    
+    @property
+    def coalescing_enabled(self) -> bool:
+        return self.get('coalescing.enabled', True)
+    
+    @property
+    def semantic_cache_enabled(self) -> bool:
+        return self.get('semantic_cache.enabled', False)
+    
+    @property
+    def semantic_cache_model(self) -> str:
+        # sentence-transformers 模型名或本地路径；为空时使用稀疏向量
+        return self.get('semantic_cache.model', '')
+    
+    @property
+    def semantic_cache_threshold(self) -> float:
+        return self.get('semantic_cache.threshold', 0.9)
+    
+    @property
+    def semantic_cache_thresholds(self) -> dict:
+        # 按接口覆盖 threshold
+        return self.get('semantic_cache.thresholds', {})
+    
+    @property
+    def semantic_cache_ttl(self) -> float:
+        return self.get('semantic_cache.ttl_seconds', 3600)
+    
+    @property
+    def semantic_cache_max_entries(self) -> int:
+        return self.get('semantic_cache.max_entries', 2000)
+    
+    @property
+    def external_api_base_url(self) -> str:
+        return self.get('external_api.base_url', 'http://127.0.0.1:8000').rstrip('/')
+    
+    @property
+    def club_crawler_concurrency(self) -> int:
+        return self.get('club_crawler.concurrency', 8)
+    
+    @property
+    def club_crawler_retries(self) -> int:
+        return self.get('club_crawler.retries', 3)
+    
+    @property
+    def club_crawler_backoff(self) -> float:
+        return self.get('club_crawler.backoff_seconds', 0.5)
+    
+    @property
+    def club_crawler_timeout(self) -> float:
+        return self.get('club_crawler.timeout', 10)
+    
+    @property
+    def club_crawler_page_size(self) -> int:
+        return self.get('club_crawler.page_size', 100)
+    
+    @property
+    def club_crawler_post_num(self) -> int:
+        return self.get('club_crawler.post_num', 5)
+    
+    @property
+    def club_store_path(self) -> str:
+        return self.get('club_store.path', 'club_store.db')
+    
+    @property
+    def club_store_max_changes(self) -> int:
+        return self.get('club_store.max_changes', 10000)
+    
+    @property
+    def club_refresh_interval(self) -> float:
+        """定时刷新社团信息的间隔（秒），0 表示只在手动触发时刷新"""
+        return self.get('club_refresh.interval_seconds', 3600)
+    
+    @property
+    def club_refresh_sync_recommender(self) -> bool:
+        return self.get('club_refresh.sync_recommender', True)
+    
+    @property
+    def recommendation_service_url(self) -> str:
+        return self.get('recommendation_service.url', 'http://localhost:8001').rstrip('/')
+    
+    @property
+    def recommendation_service_timeout(self) -> float:
+        return self.get('recommendation_service.sync_timeout', 30)
+    
+    @property
+    def sessions_max_sessions(self) -> int:
+        return self.get('sessions.max_sessions', 1000)
+    
+    @property
+    def sessions_spill_dir(self) -> str:
+        """被淘汰的会话写入的目录，为空时淘汰即丢弃"""
+        return self.get('sessions.spill_dir', 'sessions')
+    
+    @property
+    def sessions_idle_ttl(self) -> float:
+        return self.get('sessions.idle_ttl_seconds', 86400)
+    
+    @property
+    def sessions_max_history_tokens(self) -> int:
+        return self.get('sessions.max_history_tokens', 4096)
+    
+    @property
+    def sessions_keep_recent_messages(self) -> int:
+        return self.get('sessions.keep_recent_messages', 6)
+    
+    @property
+    def sessions_compaction(self) -> str:
+        """历史过长时的压缩方式: summary（早期对话合并为摘要）或 window（直接丢弃）"""
+        return self.get('sessions.compaction', 'summary')
+    
+    @property
+    def sessions_summary_max_tokens(self) -> int:
+        return self.get('sessions.summary_max_tokens', 512)
+    
     @property
     def financial_data_file(self) -> str:
         return self.get('financial_assistant.data_file', 'financial_data.json')
@@ -0,0 +1,95 @@
+"""
+比较 generate_ml_data 两种"已有数据"提示方式在不同生成规模下每条有效数据的 token 消耗：
+- full: 旧方式，每轮把所有已生成条目拼进 prompt
+- bounded: 新方式，只放数量和少量样例（见 dedup_index.py）
+
+默认离线模拟（用合成数据估算 prompt token 数，不需要 vLLM）；
+--live 时实际调用代理服务器的 /generate_ml_data，读取返回的 stats。
+
+用法:
+    python dedup_benchmark.py
+    python dedup_benchmark.py --sizes 50 200 1000
+    python dedup_benchmark.py --live --url http://127.0.0.1:8080 --sizes 20 50
+"""
+import argparse
+import random
+import time
+
+from dedup_index import DedupIndex
+from text_utils import estimate_tokens
+
+BATCH_SIZE = 10  # 与 generate_ml_data 中的 LLM_BATCH_SIZE 一致
+DISCARDED_EXAMPLES = 2  # 每批前两条示例数据会被丢弃
+BASE_PROMPT_TOKENS = 450  # 社团 prompt 模板本身（不含已有数据）的大致 token 数
+COMPLETION_TOKENS_PER_ITEM = 30  # 每条社团数据的大致输出 token 数
+SAMPLE_SIZE = 10
+
+_WORDS = ["摄影", "篮球", "编程", "动漫", "书法", "话剧", "街舞", "围棋", "吉他", "辩论",
+          "天文", "机器人", "志愿", "徒步", "烘焙", "模联", "电竞", "合唱", "国画", "羽毛球"]
+
+
+def synthetic_community(community_id: int, rng: random.Random):
+    words = rng.sample(_WORDS, 3)
+    return community_id, f"{words[0]}{rng.choice(['社', '协会', '俱乐部'])}{community_id}", "|".join(words)
+
+
+def simulate(total: int, bounded: bool, seed: int = 0):
+    """模拟一次生成 total 条社团数据，返回 (prompt token 数, 输出 token 数, 调用次数, 最长单次 prompt)"""
+    rng = random.Random(seed)
+    index = DedupIndex()
+    lines = []
+    prompt_tokens = completion_tokens = calls = max_prompt = 0
+    next_id = 1
+    while len(lines) < total:
+        if bounded:
+            existing = index.prompt_hint(SAMPLE_SIZE)
+        else:
+            existing = "\n".join(lines) if lines else "无"
+        current_prompt = BASE_PROMPT_TOKENS + estimate_tokens(existing)
+        prompt_tokens += current_prompt
+        max_prompt = max(max_prompt, current_prompt)
+        to_request = min(BATCH_SIZE, total - len(lines)) + DISCARDED_EXAMPLES
+        completion_tokens += to_request * COMPLETION_TOKENS_PER_ITEM
+        calls += 1
+        for _ in range(to_request - DISCARDED_EXAMPLES):
+            community_id, name, tags = synthetic_community(next_id, rng)
+            index.add(community_id, f"{name}|{tags}", f"- Name: {name}, Tags: {tags}")
+            lines.append(f"- ID: {community_id}, Name: {name}, Tags: {tags}")
+            next_id += 1
+    return prompt_tokens, completion_tokens, calls, max_prompt
+
+
+def run_offline(sizes):
+    print(f"{'规模':>8} {'方式':>8} {'调用次数':>8} {'prompt tokens':>14} {'最大单次 prompt':>14} {'tokens/条':>10}")
+    for size in sizes:
+        for mode in ("full", "bounded"):
+            prompt_tokens, completion_tokens, calls, max_prompt = simulate(size, bounded=(mode == "bounded"))
+            per_item = (prompt_tokens + completion_tokens) / size
+            print(f"{size:>8} {mode:>8} {calls:>8} {prompt_tokens:>14} {max_prompt:>14} {per_item:>10.1f}")
+
+
+def run_live(url, sizes):
+    import requests
+
+    print(f"{'规模':>8} {'耗时(s)':>8} {'prompt tokens':>14} {'completion tokens':>18} {'tokens/条':>10} {'浪费比例':>8}")
+    for size in sizes:
+        payload = {"num_communities": size, "num_users": 0, "num_interactions": 0, "save_file": None}
+        start = time.time()
+        response = requests.post(f"{url}/generate_ml_data", json=payload, timeout=3600)
+        response.raise_for_status()
+        stats = response.json().get("stats") or {}
+        print(f"{size:>8} {time.time() - start:>8.1f} {stats.get('prompt_tokens', 0):>14} "
+              f"{stats.get('completion_tokens', 0):>18} {stats.get('tokens_per_accepted_item')!s:>10} "
+              f"{stats.get('wasted_ratio')!s:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="已有数据提示方式的 token 消耗对比")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200, 1000, 5000])
+    parser.add_argument("--live", action="store_true", help="实际调用代理服务器而不是离线模拟")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    args = parser.parse_args()
+    if args.live:
+        run_live(args.url, args.sizes)
+    else:
+        run_offline(args.sizes)
@@ -0,0 +1,155 @@
+"""
+生成数据的去重索引：精确哈希 + MinHash/LSH 近似去重。
+
+数据生成接口过去把所有已生成的条目拼进下一轮 prompt，让模型自己避免重复，
+prompt 长度随生成数量线性增长（总 prefill 开销平方增长），最终超出上下文。
+现在已生成的条目保存在本地索引中：prompt 里只放数量和少量随机样例，
+模型生成后再由索引拒绝完全重复或高度相似（估计 Jaccard 相似度超过阈值）的条目。
+"""
+import hashlib
+import random
+import zlib
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from text_utils import normalize_text
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def shingles(text: str, n: int = 3) -> Set[str]:
+    """字符 n-gram 集合（中文没有天然分词边界，按字符切分即可）"""
+    normalized = normalize_text(text)
+    if len(normalized) <= n:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + n] for i in range(len(normalized) - n + 1)}
+
+
+class MinHasher:
+    """用 num_perm 个随机线性哈希函数计算 MinHash 签名（种子固定，结果可复现）"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.params = [(rng.randint(1, _MERSENNE_PRIME - 1), rng.randint(0, _MERSENNE_PRIME - 1))
+                       for _ in range(num_perm)]
+
+    def signature(self, shingle_set: Iterable[str]) -> Tuple[int, ...]:
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in shingle_set]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self.params
+        )
+
+
+class DedupIndex:
+    """
+    去重索引。
+    - threshold: 估计 Jaccard 相似度达到该值即视为重复；为 None 时只拒绝（规范化后）完全相同的文本，
+      用于相似本身合理的数据（例如兴趣标签相近的用户）
+    - num_perm / bands: MinHash 签名长度与 LSH 分带数，num_perm 必须能被 bands 整除
+    """
+
+    def __init__(self, threshold: Optional[float] = 0.8, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm, seed)
+        self._exact: Dict[str, Hashable] = {}
+        self._signatures: Dict[Hashable, Tuple[int, ...]] = {}
+        self._buckets: List[Dict[Tuple[int, ...], List[Hashable]]] = [{} for _ in range(bands)]
+        self._summaries: List[str] = []
+        self._rng = random.Random(seed)
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    @staticmethod
+    def _exact_key(text: str) -> str:
+        return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+    def _bands_of(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def find_duplicate(self, text: str) -> Optional[Hashable]:
+        """返回与 text 重复（或高度相似）的已有条目 key，没有则返回 None"""
+        exact = self._exact.get(self._exact_key(text))
+        if exact is not None or self.threshold is None:
+            return exact
+        signature = self.hasher.signature(shingles(text))
+        checked = set()
+        for band, band_key in self._bands_of(signature):
+            for candidate in self._buckets[band].get(band_key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                other = self._signatures[candidate]
+                similarity = sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+                if similarity >= self.threshold:
+                    return candidate
+        return None
+
+    def add(self, key: Hashable, text: str, summary: Optional[str] = None) -> bool:
+        """
+        加入一条数据。与已有数据重复时不加入并返回 False。
+        summary 为在 prompt 中展示该条目时使用的文本。
+        """
+        if self.find_duplicate(text) is not None:
+            self.rejected += 1
+            return False
+        self._exact[self._exact_key(text)] = key
+        if self.threshold is not None:
+            signature = self.hasher.signature(shingles(text))
+            self._signatures[key] = signature
+            for band, band_key in self._bands_of(signature):
+                self._buckets[band].setdefault(band_key, []).append(key)
+        self._summaries.append(summary if summary is not None else text)
+        return True
+
+    def sample(self, k: int) -> List[str]:
+        """随机抽取最多 k 条已有数据的展示文本"""
+        if len(self._summaries) <= k:
+            return list(self._summaries)
+        return self._rng.sample(self._summaries, k)
+
+    def prompt_hint(self, sample_size: int) -> str:
+        """
+        生成放入 prompt 的已有数据提示：数量和少量样例，长度与已生成数量无关。
+        """
+        if not self._summaries:
+            return "无"
+        lines = [f"已生成 {len(self._summaries)} 条。以下为部分已有数据示例，新数据请与它们明显不同："]
+        lines.extend(self.sample(sample_size))
+        return "\n".join(lines)
+
+
+def accumulate_usage(totals: Dict[str, int], usage: Optional[Dict[str, Any]]):
+    """累加一次 LLM 调用返回的 usage（prompt_tokens / completion_tokens）"""
+    for key in ("prompt_tokens", "completion_tokens"):
+        if usage and isinstance(usage.get(key), int):
+            totals[key] = totals.get(key, 0) + usage[key]
+
+
+def generation_stats(usage: Dict[str, int], accepted: int, generated: int,
+                     rejected: Dict[str, int]) -> Dict[str, Any]:
+    """
+    汇总一次生成的 token 消耗和浪费情况。
+    generated 为模型输出的条目总数，rejected 为按原因统计的被丢弃条目数，
+    wasted_ratio 为未被采用的生成条目占比。
+    """
+    total_tokens = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "generated_items": generated,
+        "accepted_items": accepted,
+        "rejected": rejected,
+        "wasted_ratio": round(1 - accepted / generated, 4) if generated else None,
+        "tokens_per_accepted_item": round(total_tokens / accepted, 2) if accepted else None,
+    }
@@ -0,0 +1,21 @@
+"""
+生成数据的 ID 分配。
+
+过去由模型自己编造 community_id / user_id 并由代理丢弃冲突的条目，浪费生成的 token
+和迭代次数。现在模型只生成内容字段，条目通过校验和去重后由服务器分配 ID：
+ID 连续、不会冲突，多个批次并发生成时也不需要互相协调。
+"""
+from typing import Iterable
+
+
+class IdAllocator:
+    """单调递增的 ID 分配器。used 为已使用的 ID（从检查点恢复时传入），新 ID 从其最大值之后开始"""
+
+    def __init__(self, used: Iterable[int] = (), start: int = 1):
+        self._next = max(max(used, default=start - 1), start - 1) + 1
+
+    def next_id(self) -> int:
+        """分配一个 ID"""
+        value = self._next
+        self._next += 1
+        return value
@@ -0,0 +1,306 @@
+"""
+长时间运行的数据生成任务（训练数据、机器学习数据、用户数据）的后台任务管理。
+
+任务提交后立即返回任务 ID，由固定数量的 worker 协程在后台执行；任务状态（进度、
+检查点、结果）以 JSON 文件保存在本地目录中。服务重启后，未完成的任务会从最后一个
+检查点继续执行，因此生成大量数据时不再依赖单个 HTTP 连接一直存活。
+
+任务处理函数的签名为 `async def handler(params: dict, ctx: JobContext) -> dict`，
+通过 ctx.state 读取上次的检查点，通过 ctx.checkpoint() 保存检查点并报告进度。
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_INTERRUPTED = "interrupted"  # 服务关闭时被中断，重启后继续
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+RESUMABLE_STATES = (JOB_QUEUED, JOB_RUNNING, JOB_INTERRUPTED)
+
+
+class JobInterrupted(Exception):
+    """处理函数因服务关闭而提前结束时抛出，任务会在重启后从检查点继续"""
+
+
+class JobContext:
+    """传给任务处理函数的上下文，用于读取/保存检查点和报告进度"""
+
+    def __init__(self, manager: "JobManager", job: Dict[str, Any]):
+        self._manager = manager
+        self._job = job
+
+    @property
+    def job_id(self) -> str:
+        return self._job["id"]
+
+    @property
+    def state(self) -> Dict[str, Any]:
+        """上一次保存的检查点，全新任务为空字典"""
+        return self._job.get("checkpoint") or {}
+
+    async def report(self, progress: int, total: Optional[int] = None, message: Optional[str] = None):
+        """更新进度（不保存检查点）"""
+        self._job["progress"] = progress
+        if total is not None:
+            self._job["total"] = total
+        if message is not None:
+            self._job["message"] = message
+        await self._manager._persist(self._job)
+
+    async def checkpoint(self, state: Dict[str, Any], progress: int, total: Optional[int] = None,
+                         message: Optional[str] = None):
+        """保存检查点并更新进度，重启后任务从这里继续"""
+        self._job["checkpoint"] = state
+        await self.report(progress, total, message)
+
+
+class NullJobContext:
+    """直接通过 HTTP 接口同步调用时使用的空上下文"""
+
+    job_id = None
+    state: Dict[str, Any] = {}
+
+    async def report(self, progress: int, total: Optional[int] = None, message: Optional[str] = None):
+        pass
+
+    async def checkpoint(self, state: Dict[str, Any], progress: int, total: Optional[int] = None,
+                         message: Optional[str] = None):
+        pass
+
+
+JobHandler = Callable[[Dict[str, Any], JobContext], Awaitable[Dict[str, Any]]]
+
+
+class JobManager:
+    """
+    后台任务管理器。
+    - state_dir: 任务状态文件目录，每个任务一个 <job_id>.json，结果保存为 <job_id>.result.json
+    - workers: 同时执行的任务数
+    """
+
+    def __init__(self, state_dir: str, workers: int = 2):
+        self.state_dir = state_dir
+        self.workers = max(1, workers)
+        self.handlers: Dict[str, JobHandler] = {}
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._stopping = False
+
+    def register(self, kind: str, handler: JobHandler):
+        self.handlers[kind] = handler
+
+    # ---- 持久化 ----
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.result.json")
+
+    def _write_json(self, path: str, data: Any):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def _persist(self, job: Dict[str, Any]):
+        job["updated_at"] = time.time()
+        await asyncio.to_thread(self._write_json, self._state_path(job["id"]), job)
+        self._publish(job)
+
+    def _load_jobs(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        for name in os.listdir(self.state_dir):
+            if not name.endswith(".json") or name.endswith(".result.json"):
+                continue
+            try:
+                with open(os.path.join(self.state_dir, name), 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+                self.jobs[job["id"]] = job
+            except (OSError, json.JSONDecodeError, KeyError) as e:
+                logger.warning(f"读取任务状态文件失败: {name}, 错误: {e}")
+
+    # ---- 生命周期 ----
+
+    async def start(self):
+        """加载已有任务，把未完成的任务重新排队，并启动 worker"""
+        self._stopping = False
+        self._queue = asyncio.Queue()
+        self._load_jobs()
+        resumed = sorted(
+            (job for job in self.jobs.values() if job["status"] in RESUMABLE_STATES),
+            key=lambda job: job["created_at"]
+        )
+        for job in resumed:
+            job["status"] = JOB_QUEUED
+            await self._persist(job)
+            self._queue.put_nowait(job["id"])
+        if resumed:
+            logger.info(f"恢复 {len(resumed)} 个未完成的后台任务")
+        self._worker_tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        """停止 worker；正在运行的任务标记为 interrupted，重启后从检查点继续"""
+        self._stopping = True
+        for task in self._running.values():
+            task.cancel()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    # ---- 任务操作 ----
+
+    async def submit(self, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        if kind not in self.handlers:
+            raise KeyError(kind)
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "params": params,
+            "status": JOB_QUEUED,
+            "progress": 0,
+            "total": None,
+            "message": "",
+            "checkpoint": {},
+            "error": None,
+            "output_file": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.jobs[job["id"]] = job
+        await self._persist(job)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.jobs.get(job_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return sorted(self.jobs.values(), key=lambda job: job["created_at"], reverse=True)
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] in FINISHED_STATES:
+            return job
+        task = self._running.get(job_id)
+        if task is not None:
+            job["cancel_requested"] = True
+            task.cancel()
+        else:
+            job["status"] = JOB_CANCELLED
+            await self._persist(job)
+        return job
+
+    def load_result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        path = self.result_path(job_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def summary(job: Dict[str, Any]) -> Dict[str, Any]:
+        """对外展示的任务信息（不包含检查点数据）"""
+        return {key: value for key, value in job.items() if key not in ("checkpoint", "cancel_requested")}
+
+    # ---- 进度订阅 ----
+
+    def _publish(self, job: Dict[str, Any]):
+        snapshot = self.summary(job)
+        for queue in self._subscribers.get(job["id"], []):
+            if queue.full():
+                queue.get_nowait()  # 订阅者处理不过来时丢弃最旧的进度
+            queue.put_nowait(snapshot)
+
+    async def events(self, job_id: str, heartbeat_seconds: float = 15.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        订阅任务进度：先产出当前状态，之后每次更新产出一次，任务结束后停止。
+        长时间没有更新时产出 None，调用方可据此发送心跳。
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+        self._subscribers.setdefault(job_id, []).append(queue)
+        try:
+            yield self.summary(job)
+            if job["status"] in FINISHED_STATES:
+                return
+            while True:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield snapshot
+                if snapshot["status"] in FINISHED_STATES:
+                    return
+        finally:
+            self._subscribers[job_id].remove(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    # ---- 执行 ----
+
+    async def _worker(self, index: int):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != JOB_QUEUED:
+                continue
+            task = asyncio.create_task(self._run_job(job))
+            self._running[job_id] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                # worker 自身被取消（服务关闭，stop() 已取消任务）：等待任务保存中断状态再退出
+                await asyncio.gather(task, return_exceptions=True)
+                raise
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _run_job(self, job: Dict[str, Any]):
+        handler = self.handlers.get(job["kind"])
+        job["status"] = JOB_RUNNING
+        job["error"] = None
+        await self._persist(job)
+        logger.info(f"开始执行后台任务 {job['id']} ({job['kind']})")
+        try:
+            if handler is None:
+                raise ValueError(f"未知的任务类型: {job['kind']}")
+            result = await handler(job["params"], JobContext(self, job))
+            await asyncio.to_thread(self._write_json, self.result_path(job["id"]), result)
+            job["output_file"] = result.get("file_path") if isinstance(result, dict) else None
+            job["status"] = JOB_COMPLETED
+            logger.info(f"后台任务 {job['id']} 已完成")
+        except asyncio.CancelledError:
+            if job.pop("cancel_requested", False):
+                job["status"] = JOB_CANCELLED
+                logger.info(f"后台任务 {job['id']} 已取消")
+            else:
+                job["status"] = JOB_INTERRUPTED
+                logger.info(f"后台任务 {job['id']} 被中断，重启后将从检查点继续")
+        except JobInterrupted as e:
+            job["status"] = JOB_INTERRUPTED
+            job["message"] = str(e)
+        except Exception as e:
+            logger.error(f"后台任务 {job['id']} 执行失败: {e}")
+            job["status"] = JOB_FAILED
+            job["error"] = str(e)
+        await self._persist(job)
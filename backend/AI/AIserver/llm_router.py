@@ -0,0 +1,328 @@
+"""
+多后端 LLM 路由：按延迟选择后端并自动故障转移。
+
+后端在 llm_router.backends 中声明，均为 OpenAI 兼容的 chat/completions 接口：
+- kind=http: 通过共享的 httpx 客户端访问（本地 vLLM 副本，或带 api_key 的远端服务）
+    {"name": "local", "kind": "http", "url": "...", "model": "...", "api_key": "...", "guided_decoding": true}
+  不指定 url 时使用 vllm.api_urls 中的本地副本（由 replica_pool 负载均衡），model 默认 vllm.default_model
+- kind=tongyi: 通过 tongyi_client 的共享 AsyncOpenAI 客户端访问通义千问，model 默认 tongyi.model；
+  未配置密钥（环境变量 DASHSCOPE_API_KEY 或 tongyi.api_key）时不参与路由
+guided_decoding 为 false 的后端不发送 vLLM 的引导解码参数；后端以 400 拒绝并在错误信息中
+指明引导解码参数时（旧版本 vLLM 等），去掉参数重发，之后不再向该后端发送（其他后端不受影响）。
+
+llm_router.routes 为每个接口声明可用的后端（按优先顺序），未声明的接口使用 default。
+路由器记录每个后端最近的延迟（非流式为总耗时，流式为首 token 延迟）与成功/失败结果：
+- 样本不足 min_samples 的后端优先尝试（按声明顺序），以便尽快得到延迟数据；
+- 其余健康后端按延迟中位数从快到慢尝试；
+- 连续失败 failure_threshold 次的后端冷却 cooldown_seconds 秒，冷却期间排在最后，
+  冷却结束后重新参与选择，成功一次即恢复。
+连接失败、超时、429 和 5xx 时换下一个后端重试；流式请求只在输出第一个 token 前切换。
+其他 4xx（请求本身有误）直接抛出。
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+import openai
+
+import replica_pool
+import tongyi_client
+import vllm_client
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUTE = "default"
+GUIDED_PARAMS = ("guided_json", "response_format")
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class BackendStats:
+    """单个后端的延迟、结果与健康状态（后端配置重载后保留）"""
+
+    def __init__(self):
+        window = config.llm_router_window
+        self.latencies: deque = deque(maxlen=window)  # 非流式请求的总耗时
+        self.ttft: deque = deque(maxlen=window)  # 流式请求的首 token 延迟
+        self.outcomes: deque = deque(maxlen=window)  # True 为成功
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.in_flight = 0
+
+    def record_success(self, elapsed: float, streaming: bool):
+        (self.ttft if streaming else self.latencies).append(elapsed)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+
+    def record_failure(self):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= config.llm_router_failure_threshold:
+            self.unhealthy_until = time.monotonic() + config.llm_router_cooldown
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def error_rate(self) -> Optional[float]:
+        if not self.outcomes:
+            return None
+        return sum(1 for ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def score(self, streaming: bool) -> Optional[float]:
+        """延迟中位数（秒）；样本不足时返回 None"""
+        samples = list(self.ttft if streaming else self.latencies)
+        if len(samples) < config.llm_router_min_samples:
+            return None
+        return _percentile(samples, 0.5)
+
+    def snapshot(self) -> Dict[str, Any]:
+        def ms(values, q):
+            value = _percentile(list(values), q)
+            return round(value * 1000, 1) if value is not None else None
+
+        error_rate = self.error_rate()
+        return {
+            "healthy": self.healthy(),
+            "in_flight": self.in_flight,
+            "requests": len(self.outcomes),
+            "error_rate": round(error_rate, 4) if error_rate is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_p50_ms": ms(self.latencies, 0.5),
+            "latency_p95_ms": ms(self.latencies, 0.95),
+            "ttft_p50_ms": ms(self.ttft, 0.5),
+            "ttft_p95_ms": ms(self.ttft, 0.95),
+        }
+
+
+class Backend:
+    """一个 OpenAI 兼容后端。prepare() 把接口的 payload 改写为该后端可接受的形式"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.name = spec["name"]
+        self.kind = spec.get("kind", "http")
+        if self.kind not in ("http", "tongyi"):
+            raise ValueError(f"未知的后端类型: {self.kind}")
+        self.url = spec.get("url")  # 为空时使用本地 vLLM 副本池
+        default_model = config.tongyi_model if self.kind == "tongyi" else config.default_model
+        self.model = spec.get("model") or default_model
+        api_key = spec.get("api_key")
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+        self.guided_decoding = spec.get("guided_decoding", self.kind == "http")
+        self.guided_unsupported = False  # 运行中发现后端不接受引导解码参数
+
+    @property
+    def available(self) -> bool:
+        """通义千问后端需要配置密钥，否则每次请求都会因认证失败而无法切换到其他后端"""
+        return self.kind != "tongyi" or bool(config.tongyi_api_key)
+
+    def prepare(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        payload = dict(payload, model=self.model)
+        if not self.guided_decoding or self.guided_unsupported:
+            for key in GUIDED_PARAMS:
+                payload.pop(key, None)
+        return payload
+
+    async def complete(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        if self.kind == "http" and self.url is None:
+            key = replica_pool.conversation_key(payload["messages"])
+            attempts = len(replica_pool.pool.replicas())
+            for attempt in range(attempts):
+                try:
+                    with replica_pool.pool.lease(key) as url:
+                        return await vllm_client.chat_completion(payload, url=url, timeout=timeout,
+                                                                 headers=self.headers)
+                except replica_pool.CONNECTION_ERRORS:
+                    # 连接失败的副本已被标记为不健康；还有健康副本时换一个重试
+                    if attempt + 1 == attempts or not replica_pool.pool.healthy_count():
+                        raise
+        if self.kind == "http":
+            return await vllm_client.chat_completion(payload, url=self.url, timeout=timeout, headers=self.headers)
+        # 通义千问只走流式客户端，拼接为非流式响应的格式
+        usage: Dict[str, Any] = {}
+        parts = [content async for content in self.stream(payload, usage)]
+        return {
+            "model": self.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(parts)}}],
+            "usage": usage or None,
+        }
+
+    def stream(self, payload: Dict[str, Any], usage: Optional[Dict[str, Any]] = None,
+               timeout: Optional[float] = None) -> AsyncIterator[str]:
+        if self.kind == "http" and self.url is None:
+            return self._stream_pooled(payload, usage, timeout)
+        if self.kind == "http":
+            return vllm_client.iter_chat_deltas(payload, url=self.url, timeout=timeout, usage=usage,
+                                                headers=self.headers)
+        params = {key: value for key, value in payload.items() if key not in ("model", "messages", "stream")}
+        return tongyi_client.stream_chat(payload["messages"], model=self.model, usage=usage, **params)
+
+    async def _stream_pooled(self, payload: Dict[str, Any], usage: Optional[Dict[str, Any]],
+                             timeout: Optional[float]) -> AsyncIterator[str]:
+        key = replica_pool.conversation_key(payload["messages"])
+        attempts = len(replica_pool.pool.replicas())
+        for attempt in range(attempts):
+            started = False
+            try:
+                with replica_pool.pool.lease(key) as url:
+                    deltas = vllm_client.iter_chat_deltas(payload, url=url, timeout=timeout, usage=usage,
+                                                          headers=self.headers)
+                    try:
+                        async for content in deltas:
+                            started = True
+                            yield content
+                    finally:
+                        await deltas.aclose()
+                return
+            except replica_pool.CONNECTION_ERRORS:
+                # 输出第一个 token 前连接失败时换一个健康副本重试
+                if started or attempt + 1 == attempts or not replica_pool.pool.healthy_count():
+                    raise
+
+
+_stats: Dict[str, BackendStats] = {}
+_backends: Dict[str, Backend] = {}
+_backends_spec: Optional[list] = None
+
+
+def backends() -> Dict[str, Backend]:
+    """按当前配置构建后端（配置变化后重建，统计数据按名称保留）"""
+    global _backends, _backends_spec
+    spec = config.llm_backends
+    if spec != _backends_spec:
+        _backends = {item["name"]: Backend(item) for item in spec}
+        _backends_spec = spec
+    return _backends
+
+
+def stats_for(name: str) -> BackendStats:
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = BackendStats()
+    return stats
+
+
+def candidates(endpoint: str, streaming: bool = False) -> List[Backend]:
+    """接口可用的后端，按尝试顺序排列"""
+    available = backends()
+    routes = config.llm_routes
+    names = routes.get(endpoint) or routes.get(DEFAULT_ROUTE) or list(available)
+    declared = [available[name] for name in names if name in available and available[name].available]
+    healthy = [backend for backend in declared if stats_for(backend.name).healthy()]
+    unmeasured = [backend for backend in healthy if stats_for(backend.name).score(streaming) is None]
+    measured = sorted((backend for backend in healthy if backend not in unmeasured),
+                      key=lambda backend: stats_for(backend.name).score(streaming))
+    cooling = [backend for backend in declared if backend not in healthy]
+    return unmeasured + measured + cooling
+
+
+def _retryable(error: Exception) -> bool:
+    """是否应换下一个后端重试：连接失败、超时、限流和服务端错误"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (httpx.HTTPError, openai.APIConnectionError))
+
+
+def _rejects_guided(payload: Dict[str, Any], error: Exception) -> bool:
+    """是否为后端拒绝引导解码参数：400 且错误信息中提到了请求里的引导解码参数"""
+    if not isinstance(error, httpx.HTTPStatusError) or error.response.status_code != 400:
+        return False
+    body = error.response.text
+    return any(key in payload and key in body for key in GUIDED_PARAMS)
+
+
+async def chat_completion(endpoint: str, payload: Dict[str, Any],
+                          timeout: Optional[float] = None) -> Dict[str, Any]:
+    """非流式请求，返回 OpenAI 格式的响应；所有后端都失败时抛出最后一个错误"""
+    last_error: Optional[Exception] = None
+    for backend in candidates(endpoint):
+        stats = stats_for(backend.name)
+        stats.in_flight += 1
+        start = time.perf_counter()
+        prepared = backend.prepare(payload)
+        try:
+            try:
+                result = await backend.complete(prepared, timeout=timeout)
+            except httpx.HTTPStatusError as e:
+                if not _rejects_guided(prepared, e):
+                    raise
+                # 该后端不支持引导解码参数：去掉后重发，之后不再向它发送
+                logger.warning(f"后端 {backend.name} 不支持引导解码，改为仅提示约束: {e.response.text[:200]}")
+                backend.guided_unsupported = True
+                result = await backend.complete(backend.prepare(payload), timeout=timeout)
+        except Exception as e:
+            if not _retryable(e):
+                raise
+            stats.record_failure()
+            last_error = e
+            logger.warning(f"后端 {backend.name} 请求失败（{endpoint}），尝试下一个后端: {e}")
+            continue
+        finally:
+            stats.in_flight -= 1
+        stats.record_success(time.perf_counter() - start, streaming=False)
+        return result
+    raise last_error or RuntimeError(f"接口 {endpoint} 没有可用的后端")
+
+
+async def stream_chat(endpoint: str, payload: Dict[str, Any], usage: Optional[Dict[str, Any]] = None,
+                      timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """
+    流式请求，逐个产出增量文本。输出第一个 token 前失败时换下一个后端；
+    之后的失败直接抛出（已发送给调用方的内容无法撤回）。
+    """
+    last_error: Optional[Exception] = None
+    for backend in candidates(endpoint, streaming=True):
+        stats = stats_for(backend.name)
+        stats.in_flight += 1
+        start = time.perf_counter()
+        started = False
+        deltas = backend.stream(backend.prepare(payload), usage=usage, timeout=timeout)
+        try:
+            async for content in deltas:
+                if not started:
+                    started = True
+                    stats.record_success(time.perf_counter() - start, streaming=True)
+                yield content
+            if not started:
+                stats.record_success(time.perf_counter() - start, streaming=True)
+            return
+        except Exception as e:
+            if started or not _retryable(e):
+                if started:
+                    stats.record_failure()
+                raise
+            stats.record_failure()
+            last_error = e
+            logger.warning(f"后端 {backend.name} 流式请求失败（{endpoint}），尝试下一个后端: {e}")
+        finally:
+            stats.in_flight -= 1
+            await deltas.aclose()
+    raise last_error or RuntimeError(f"接口 {endpoint} 没有可用的后端")
+
+
+def message_content(result: Dict[str, Any]) -> str:
+    """取出非流式响应中的回复文本"""
+    choices = result.get("choices") or []
+    return ((choices[0].get("message") or {}).get("content") or "") if choices else ""
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "routes": config.llm_routes,
+        "backends": {
+            name: dict({"kind": backend.kind, "model": backend.model,
+                        "guided_decoding": backend.guided_decoding and not backend.guided_unsupported},
+                       **stats_for(name).snapshot())
+            for name, backend in backends().items()
+        }
+    }
@@ -0,0 +1,132 @@
+"""
+模拟外部社团 API（/api/club/list 与 /api/club/{id}/info），用于本地测试 club_crawler.py。
+
+- 社团详情带 ETag 与 Last-Modified，请求带 If-None-Match / If-Modified-Since 且未变化时返回 304；
+- --latency 为每个请求的延迟，--fail-rate 为随机返回 503 的比例（测试重试）；
+- POST /mock/touch/{club_id} 修改一个社团（成员数加一、追加一个帖子），
+  POST /mock/add 新增一个社团，DELETE /mock/club/{club_id} 删除一个社团，用于测试增量更新。
+
+用法:
+    python mock_club_api.py --clubs 300 --latency 0.05 --fail-rate 0.05 --port 8000
+然后把 config.json 的 external_api.base_url 指向 http://127.0.0.1:8000
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+from email.utils import formatdate
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request, Response
+
+app = FastAPI()
+
+_TAGS = ["摄影", "篮球", "编程", "动漫", "书法", "话剧", "街舞", "围棋", "吉他", "辩论",
+         "天文", "机器人", "志愿", "徒步", "烘焙", "模联", "电竞", "合唱", "国画", "羽毛球"]
+
+settings = {"latency": 0.0, "fail_rate": 0.0}
+clubs = {}
+
+
+def make_club(club_id: int, rng: random.Random):
+    tags = rng.sample(_TAGS, 3)
+    return {
+        "club_id": club_id,
+        "club_name": f"{tags[0]}社{club_id}",
+        "category": rng.randint(1, 5),
+        "tags": json.dumps(tags, ensure_ascii=False),
+        "logo_url": f"https://example.com/logo/{club_id}.png",
+        "desc": f"一个关于{'、'.join(tags)}的社团",
+        "created_at": "2024-09-01 10:00:00",
+        "member_count": rng.randint(5, 200),
+        "members": [],
+        "posts": [
+            {"post_id": club_id * 100 + i, "club_id": club_id, "author_id": rng.randint(1, 1000),
+             "title": f"{tags[0]}活动第{i}期", "comment_count": rng.randint(0, 30),
+             "created_at": "2024-10-01 12:00:00"}
+            for i in range(1, rng.randint(2, 6))
+        ],
+        "_modified": formatdate(usegmt=True),
+    }
+
+
+def etag_of(club) -> str:
+    body = json.dumps({k: v for k, v in club.items() if k != "_modified"}, ensure_ascii=False, sort_keys=True)
+    return '"' + hashlib.md5(body.encode("utf-8")).hexdigest() + '"'
+
+
+async def simulate():
+    if settings["latency"]:
+        await asyncio.sleep(settings["latency"])
+    if random.random() < settings["fail_rate"]:
+        raise HTTPException(status_code=503, detail="mock failure")
+
+
+def public(club, post_num: int):
+    data = {k: v for k, v in club.items() if k != "_modified"}
+    data["posts"] = data["posts"][:post_num]
+    return data
+
+
+@app.get("/api/club/list")
+async def club_list(offset: int = 0, num: int = 100):
+    await simulate()
+    items = sorted(clubs.values(), key=lambda club: club["club_id"])[offset:offset + num]
+    return [{k: v for k, v in club.items() if k not in ("members", "posts", "_modified")} for club in items]
+
+
+@app.get("/api/club/{club_id}/info")
+async def club_info(club_id: int, request: Request, post_num: int = 5):
+    await simulate()
+    club = clubs.get(club_id)
+    if club is None:
+        raise HTTPException(status_code=404, detail="club not found")
+    etag = etag_of(club)
+    headers = {"ETag": etag, "Last-Modified": club["_modified"]}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=json.dumps(public(club, post_num), ensure_ascii=False),
+                    media_type="application/json", headers=headers)
+
+
+@app.post("/mock/touch/{club_id}")
+async def touch(club_id: int):
+    club = clubs[club_id]
+    club["member_count"] += 1
+    club["posts"].insert(0, {"post_id": club_id * 100 + len(club["posts"]) + 1, "club_id": club_id,
+                             "author_id": 1, "title": "新的活动通知", "comment_count": 0,
+                             "created_at": "2024-11-01 12:00:00"})
+    club["_modified"] = formatdate(usegmt=True)
+    return {"etag": etag_of(club)}
+
+
+@app.post("/mock/add")
+async def add():
+    club_id = max(clubs, default=0) + 1
+    clubs[club_id] = make_club(club_id, random.Random(club_id))
+    return {"club_id": club_id}
+
+
+@app.delete("/mock/club/{club_id}")
+async def delete(club_id: int):
+    clubs.pop(club_id, None)
+    return {"deleted": club_id}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟外部社团 API")
+    parser.add_argument("--clubs", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    settings.update(latency=args.latency, fail_rate=args.fail_rate)
+    rng = random.Random(0)
+    for club_id in range(1, args.clubs + 1):
+        clubs[club_id] = make_club(club_id, rng)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
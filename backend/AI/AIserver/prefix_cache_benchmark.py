@@ -0,0 +1,98 @@
+"""
+测量 prompt 布局对 vLLM 前缀缓存和首 token 延迟（TTFT）的影响。
+
+对每个模板用不同的请求数据连续调用多次，比较两种布局：
+- registry: prompt_registry 的布局，固定指令在 system 消息中，请求数据在最后
+- interleaved: 旧布局，请求数据在前、指令在后（同一接口两次调用在开头就不同）
+第一次调用的 TTFT 包含完整 prefill；之后的调用在 registry 布局下应命中前缀缓存。
+vLLM 需开启前缀缓存（新版本默认开启，旧版本使用 --enable-prefix-caching）。
+
+用法:
+    python prefix_cache_benchmark.py
+    python prefix_cache_benchmark.py --url http://localhost:8000/v1/chat/completions --repeat 8
+"""
+import argparse
+import json
+import statistics
+import time
+
+import prompt_registry
+from config_manager import config
+
+# 每个模板的若干组请求数据，循环使用
+SAMPLE_VARIABLES = {
+    "screen_application": [
+        {"applicant_data": json.dumps({"姓名": f"同学{i}", "专业": major, "技能": skill}, ensure_ascii=False),
+         "application_reason": f"我对{club}很感兴趣，希望能和大家一起进步。", "club_name": club,
+         "required_conditions_str": "- 热爱集体活动\n- 每周能参加一次例会"}
+        for i, (major, skill, club) in enumerate([
+            ("计算机科学", "Python", "编程社"), ("新闻学", "摄影", "摄影社"),
+            ("体育教育", "篮球", "篮球社"), ("美术学", "国画", "书画社")])
+    ],
+    "club_atmosphere": [
+        {"communication_content": text} for text in [
+            "大家周末的外拍都很开心，新人也很快融入了。", "例会上对活动预算有些争论，但最后达成了一致。",
+            "最近比赛训练很辛苦，学长们经常给新人加油。", "群里每天都在分享作品，气氛很活跃。"]
+    ],
+    "plan_event": [
+        {"event_idea": idea} for idea in [
+            "我们想为50人办一场户外烧烤", "举办一次面向全校的编程马拉松",
+            "组织社团成员去郊区徒步并拍摄风景", "在图书馆前办一场读书分享会"]
+    ],
+    "slogan": [
+        {"theme": theme} for theme in ["摄影社招新", "篮球联赛开幕", "环保志愿活动", "校园歌手大赛"]
+    ],
+}
+
+
+def interleaved_messages(template: prompt_registry.PromptTemplate, variables):
+    """旧布局：简短的系统提示 + 请求数据在前、完整指令在后"""
+    return [
+        {"role": "system", "content": template.system.split("\n", 1)[0]},
+        {"role": "user", "content": template.render(**variables) + "\n\n" + template.system}
+    ]
+
+
+def measure_ttft(url: str, model: str, messages, max_tokens: int) -> float:
+    """流式请求，返回收到第一个内容增量的耗时（秒）"""
+    import requests
+
+    payload = {"model": model, "messages": messages, "max_tokens": max_tokens,
+               "temperature": 0.7, "stream": True}
+    start = time.perf_counter()
+    with requests.post(url, json=payload, stream=True, timeout=300) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                continue
+            choices = json.loads(line[6:]).get("choices") or []
+            if choices and (choices[0].get("delta") or {}).get("content"):
+                return time.perf_counter() - start
+    return time.perf_counter() - start
+
+
+def run(url: str, model: str, repeat: int, max_tokens: int):
+    print(f"{'模板':>20} {'布局':>12} {'首次TTFT(ms)':>14} {'后续TTFT中位数(ms)':>20}")
+    for name, samples in SAMPLE_VARIABLES.items():
+        template = prompt_registry.get(name)
+        for layout in ("interleaved", "registry"):
+            timings = []
+            for i in range(repeat):
+                variables = samples[i % len(samples)]
+                if layout == "registry":
+                    messages = template.messages(**variables)
+                else:
+                    messages = interleaved_messages(template, variables)
+                timings.append(measure_ttft(url, model, messages, max_tokens) * 1000)
+            warm = statistics.median(timings[1:]) if len(timings) > 1 else float("nan")
+            print(f"{name:>20} {layout:>12} {timings[0]:>14.1f} {warm:>20.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="prompt 布局对前缀缓存与 TTFT 的影响")
+    parser.add_argument("--url", default=config.vllm_api_url)
+    parser.add_argument("--model", default=config.default_model)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=16, help="只需测量首 token，生成长度可以很短")
+    args = parser.parse_args()
+    run(args.url, args.model, args.repeat, args.max_tokens)
@@ -0,0 +1,227 @@
+"""
+各功能接口的 prompt 模板注册表。
+
+vLLM 的自动前缀缓存（automatic prefix caching）只复用完全相同的 token 前缀。过去各接口
+把用户数据插在长指令模板的中间，并把系统提示在 system 和 user 消息里各写一遍，
+同一接口的两次调用在第一个变量处就出现差异，长指令每次都要重新 prefill。
+
+这里每个模板分为两部分：
+- 固定部分（system 消息）：角色设定 + 全部指令和输出格式要求，同一接口的所有调用完全相同；
+- 变量部分（user 消息）：本次请求的数据，放在最后。
+这样同一接口的重复调用共享整个固定部分的 KV 缓存，只需 prefill 变量部分。
+
+模板保存在 prompts/ 目录（prompts.dir）下，每个模板一个 <name>.txt 文件：
+
+    可选的说明文字（不会发送给模型）
+    [[system]]
+    固定部分，原样发送
+    [[user]]
+    变量部分，{variable} 为请求数据
+
+服务启动时加载一次并预编译，通过 /reload_config 热更新。每个模板记录固定部分和
+变量部分的 token 数（使用模型 tokenizer，见 token_counter.py）以及调用耗时，
+通过 /prompt_stats 查看，用于调整 prompt 成本。
+"""
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from string import Formatter
+from typing import Any, Dict, List, Optional, Tuple
+
+import token_counter
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_MARKER = "[[system]]"
+USER_MARKER = "[[user]]"
+
+_LATENCY_WINDOW = 200  # 每个模板保留最近多少次调用的耗时
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class TemplateStats:
+    """单个模板的调用统计（模板热更新后保留）"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.user_tokens_total = 0
+        self.user_tokens_max = 0
+        self.latencies: deque = deque(maxlen=_LATENCY_WINDOW)
+
+    def record_render(self, user_tokens: int):
+        self.calls += 1
+        self.user_tokens_total += user_tokens
+        self.user_tokens_max = max(self.user_tokens_max, user_tokens)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = list(self.latencies)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_user_tokens": round(self.user_tokens_total / self.calls, 1) if self.calls else None,
+            "max_user_tokens": self.user_tokens_max,
+            "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+            "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        }
+
+
+def _compile(text: str) -> List[Tuple[str, Optional[str], str, Optional[str]]]:
+    """把 str.format 模板预解析为 (文本, 变量名, 格式, 转换) 列表，只支持简单变量名"""
+    parts = []
+    for literal, field, spec, conversion in Formatter().parse(text):
+        if field is not None and not field.isidentifier():
+            raise ValueError(f"不支持的模板变量: {{{field}}}")
+        parts.append((literal, field, spec or "", conversion))
+    return parts
+
+
+class PromptTemplate:
+    """
+    - name: 模板名称
+    - system: 固定部分（角色设定与指令），原样作为 system 消息，不做格式化
+    - user: 变量部分，{variable} 处填入请求数据
+    """
+
+    def __init__(self, name: str, system: str, user: str, stats: Optional[TemplateStats] = None):
+        self.name = name
+        self.system = system.strip()
+        self.user = user.strip()
+        self._parts = _compile(self.user)
+        self.variables = sorted({field for _, field, _, _ in self._parts if field})
+        self.stats = stats or TemplateStats()
+        self._system_tokens: Optional[Tuple[bool, int]] = None
+
+    @property
+    def system_tokens(self) -> int:
+        """固定部分的 token 数（tokenizer 加载完成后按模型 tokenizer 重新计算）"""
+        exact = token_counter.is_exact()
+        if self._system_tokens is None or self._system_tokens[0] != exact:
+            self._system_tokens = (exact, token_counter.count_tokens(self.system))
+        return self._system_tokens[1]
+
+    def render(self, **variables: Any) -> str:
+        out = []
+        for literal, field, spec, conversion in self._parts:
+            out.append(literal)
+            if field is None:
+                continue
+            value = variables[field]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "s":
+                value = str(value)
+            out.append(format(value, spec))
+        return "".join(out)
+
+    def messages(self, **variables: Any) -> List[Dict[str, str]]:
+        """返回发送给 vLLM 的消息列表：固定的 system 前缀在前，请求数据在后"""
+        user_content = self.render(**variables)
+        self.stats.record_render(token_counter.count_tokens(user_content))
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": user_content}
+        ]
+
+    @contextmanager
+    def timed(self):
+        """记录一次使用该模板的模型调用耗时，调用抛出异常时计为错误"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.stats.errors += 1
+            raise
+        finally:
+            self.stats.latencies.append(time.perf_counter() - start)
+
+    def info(self) -> Dict[str, Any]:
+        return dict(
+            {"system_tokens": self.system_tokens, "variables": self.variables},
+            **self.stats.snapshot()
+        )
+
+
+def parse_template_file(name: str, text: str, stats: Optional[TemplateStats] = None) -> PromptTemplate:
+    """解析模板文件内容（[[system]] 与 [[user]] 两节）"""
+    system_at = text.find(SYSTEM_MARKER)
+    user_at = text.find(USER_MARKER)
+    if system_at == -1 or user_at == -1 or user_at < system_at:
+        raise ValueError(f"模板 {name} 缺少 {SYSTEM_MARKER} 或 {USER_MARKER} 节")
+    system = text[system_at + len(SYSTEM_MARKER):user_at]
+    user = text[user_at + len(USER_MARKER):]
+    return PromptTemplate(name, system, user, stats)
+
+
+_templates: Dict[str, PromptTemplate] = {}
+_loaded_from: Optional[str] = None
+
+
+def prompt_dir() -> str:
+    directory = config.prompt_dir
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
+    return directory
+
+
+def load(directory: Optional[str] = None) -> List[str]:
+    """
+    从目录加载全部模板，返回加载失败的错误信息列表。
+    单个文件有错误时保留该模板之前的版本，其余模板照常更新。
+    """
+    global _templates, _loaded_from
+    directory = directory or prompt_dir()
+    templates: Dict[str, PromptTemplate] = {}
+    errors = []
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".txt"):
+            continue
+        name = file_name[:-len(".txt")]
+        previous = _templates.get(name)
+        try:
+            with open(os.path.join(directory, file_name), 'r', encoding='utf-8') as f:
+                templates[name] = parse_template_file(name, f.read(), previous.stats if previous else None)
+        except (OSError, ValueError) as e:
+            errors.append(f"{file_name}: {e}")
+            logger.error(f"加载 prompt 模板失败: {file_name}, 错误: {e}")
+            if previous is not None:
+                templates[name] = previous
+    _templates = templates
+    _loaded_from = directory
+    logger.info(f"已加载 {len(templates)} 个 prompt 模板: {directory}")
+    return errors
+
+
+def reload() -> List[str]:
+    """按当前配置的目录重新读取模板文件，并重新计算 token 数"""
+    return load()
+
+
+def get(name: str) -> PromptTemplate:
+    if _loaded_from is None:
+        load()
+    return _templates[name]
+
+
+def names() -> List[str]:
+    if _loaded_from is None:
+        load()
+    return sorted(_templates)
+
+
+def stats() -> Dict[str, Any]:
+    """各模板的 token 数与调用统计"""
+    return {
+        "tokenizer": token_counter.tokenizer_name(),
+        "exact_token_counts": token_counter.is_exact(),
+        "templates": {name: _templates[name].info() for name in names()}
+    }
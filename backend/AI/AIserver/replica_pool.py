@@ -0,0 +1,257 @@
+"""
+多个 vLLM 副本之间的负载均衡与健康检查。
+
+vllm.api_urls 列出所有副本的 chat/completions 地址（未配置时只有 vllm.api_url）。
+选择副本的策略（vllm.balancing.policy）：
+- least_outstanding: 本进程发往各副本、尚未完成的请求数最少者；
+- queue_aware: 在此基础上加上副本 /metrics 中排队的请求数（vllm:num_requests_waiting，
+  其他客户端发来的请求也计入），读不到指标时退化为 least_outstanding。
+
+多轮对话按会话键（system 消息 + 第一条 user 消息）做 rendezvous 哈希，同一会话总是
+发往同一副本以命中前缀缓存；该副本负载比最空闲的副本高出 sticky_max_imbalance 以上时
+改发最空闲的副本。副本增减时只有原来落在变动副本上的会话会迁移。
+
+后台任务每隔 health_check_interval 秒检查各副本的 /health 并读取 /metrics 和 /v1/models；
+请求时连接失败的副本也会立即标记为不健康，直到下一次检查通过。
+/health 与 /models 直接返回最近一次检查的结果（附带检查耗时和距今时间），不再逐次请求 vLLM。
+超过 3 个检查周期没有完成检查时视为过期（stale）。
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import httpx
+import requests
+
+import vllm_client
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+LEAST_OUTSTANDING = "least_outstanding"
+QUEUE_AWARE = "queue_aware"
+
+_METRIC_LINE = re.compile(r'^(vllm:[a-z_]+)(?:\{[^}]*\})?\s+([0-9.eE+-]+|NaN)$')
+CONNECTION_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, requests.exceptions.ConnectionError)
+
+
+def base_url(chat_url: str) -> str:
+    return chat_url.replace("/v1/chat/completions", "")
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    """解析 Prometheus 文本格式中的 vllm:* 指标（同名指标的多个标签值求和）"""
+    values: Dict[str, float] = {}
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line.strip())
+        if match and match.group(2) != "NaN":
+            values[match.group(1)] = values.get(match.group(1), 0.0) + float(match.group(2))
+    return values
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.base_url = base_url(url)
+        self.in_flight = 0
+        self.healthy = True  # 第一次检查之前先假定可用
+        self.waiting: Optional[float] = None
+        self.running: Optional[float] = None
+        self.kv_cache_usage: Optional[float] = None
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.probe_latency: Optional[float] = None  # 最近一次 /health 请求的耗时（秒）
+        self.models: Optional[List[Dict[str, Any]]] = None  # 最近一次读取到的 /v1/models
+
+    def load(self, policy: str) -> float:
+        if policy == QUEUE_AWARE and self.waiting is not None:
+            return self.in_flight + self.waiting
+        return self.in_flight
+
+    def update_metrics(self, metrics: Dict[str, float]):
+        self.waiting = metrics.get("vllm:num_requests_waiting")
+        self.running = metrics.get("vllm:num_requests_running")
+        # 新版本为 kv_cache_usage_perc，旧版本为 gpu_cache_usage_perc
+        self.kv_cache_usage = metrics.get("vllm:kv_cache_usage_perc", metrics.get("vllm:gpu_cache_usage_perc"))
+
+    def age(self) -> Optional[float]:
+        """距最近一次检查完成的秒数；尚未检查过时为 None"""
+        return round(time.monotonic() - self.last_check, 1) if self.last_check is not None else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "running": self.running,
+            "kv_cache_usage": self.kv_cache_usage,
+            "probe_latency_ms": round(self.probe_latency * 1000, 1) if self.probe_latency is not None else None,
+            "last_check_age_s": self.age(),
+            "last_error": self.last_error,
+        }
+
+
+def _rendezvous_weight(key: str, url: str) -> int:
+    digest = hashlib.blake2b(f"{key}|{url}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def conversation_key(messages: Sequence[Dict[str, Any]]) -> Optional[str]:
+    """会话键：system 消息与第一条 user 消息，同一多轮对话的后续请求保持不变"""
+    system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+    first_user = next((m.get("content") or "" for m in messages if m.get("role") == "user"), None)
+    if first_user is None:
+        return None
+    return hashlib.blake2b(f"{system}\x00{first_user}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ReplicaPool:
+    def __init__(self):
+        self._replicas: Dict[str, Replica] = {}
+        self._lock = threading.RLock()  # /chat 的流式转发在线程池中运行
+        self._task: Optional[asyncio.Task] = None
+
+    def replicas(self) -> List[Replica]:
+        """按当前配置的副本列表返回副本（新增的副本加入，移除的副本丢弃）"""
+        urls = config.vllm_api_urls
+        if list(self._replicas) != urls:
+            with self._lock:
+                self._replicas = {url: self._replicas.get(url) or Replica(url) for url in urls}
+        return list(self._replicas.values())
+
+    def select(self, key: Optional[str] = None) -> Replica:
+        replicas = self.replicas()
+        candidates = [replica for replica in replicas if replica.healthy] or replicas
+        policy = config.balancing_policy
+        least_loaded = min(candidates, key=lambda replica: replica.load(policy))
+        if key is None or not config.balancing_sticky:
+            return least_loaded
+        preferred = max(candidates, key=lambda replica: _rendezvous_weight(key, replica.url))
+        if preferred.load(policy) - least_loaded.load(policy) > config.balancing_max_imbalance:
+            return least_loaded
+        return preferred
+
+    def acquire(self, key: Optional[str] = None) -> Replica:
+        """选择副本并计入一个未完成请求，请求结束后必须调用 release()"""
+        with self._lock:
+            replica = self.select(key)
+            replica.in_flight += 1
+        return replica
+
+    def release(self, replica: Replica):
+        with self._lock:
+            replica.in_flight -= 1
+
+    def mark_unhealthy(self, replica: Replica, error: Exception):
+        """请求时连接失败：暂停使用该副本，直到下一次健康检查通过"""
+        replica.healthy = False
+        replica.last_error = str(error)
+        logger.warning(f"vLLM 副本连接失败，暂停使用直到健康检查通过: {replica.url}, 错误: {error}")
+
+    @contextmanager
+    def lease(self, key: Optional[str] = None) -> Iterator[str]:
+        """在请求期间占用一个副本，产出副本的 chat/completions 地址"""
+        replica = self.acquire(key)
+        try:
+            yield replica.url
+        except CONNECTION_ERRORS as e:
+            self.mark_unhealthy(replica, e)
+            raise
+        finally:
+            self.release(replica)
+
+    async def check(self, replica: Replica):
+        client = vllm_client.get_client()
+        timeout = httpx.Timeout(config.health_check_timeout)
+        start = time.perf_counter()
+        try:
+            response = await client.get(f"{replica.base_url}/health", timeout=timeout)
+            healthy = response.status_code == 200
+            replica.last_error = None if healthy else f"HTTP {response.status_code}"
+        except httpx.HTTPError as e:
+            healthy = False
+            replica.last_error = str(e) or type(e).__name__
+        replica.probe_latency = time.perf_counter() - start
+        if healthy:
+            # 指标只用于负载估计、模型列表只用于展示，读取失败不影响健康状态
+            try:
+                response = await client.get(f"{replica.base_url}/metrics", timeout=timeout)
+                if response.status_code == 200:
+                    replica.update_metrics(parse_metrics(response.text))
+            except httpx.HTTPError:
+                pass
+            try:
+                response = await client.get(f"{replica.base_url}/v1/models", timeout=timeout)
+                if response.status_code == 200:
+                    replica.models = response.json().get("data") or []
+            except (httpx.HTTPError, ValueError):
+                pass
+        if healthy != replica.healthy:
+            logger.info(f"vLLM 副本 {replica.url} 状态变为 {'healthy' if healthy else 'unhealthy'}")
+        replica.healthy = healthy
+        replica.last_check = time.monotonic()
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas()))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check_all()
+            except Exception as e:
+                logger.error(f"vLLM 副本健康检查出错: {e}")
+            await asyncio.sleep(config.health_check_interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def healthy_count(self) -> int:
+        return sum(1 for replica in self.replicas() if replica.healthy)
+
+    def last_check_age(self) -> Optional[float]:
+        """所有副本中最久未检查的一个距今的秒数；有副本尚未检查过时为 None"""
+        ages = [replica.age() for replica in self.replicas()]
+        return None if None in ages else max(ages)
+
+    def stale(self) -> bool:
+        age = self.last_check_age()
+        return age is None or age > 3 * config.health_check_interval
+
+    def models(self) -> Optional[List[Dict[str, Any]]]:
+        """各副本最近一次读取到的模型列表（按 id 去重，健康副本优先）；还没有读取到时为 None"""
+        merged: Dict[str, Dict[str, Any]] = {}
+        found = False
+        for replica in sorted(self.replicas(), key=lambda replica: not replica.healthy):
+            if replica.models is not None:
+                found = True
+                for model in replica.models:
+                    merged.setdefault(model.get("id"), model)
+        return list(merged.values()) if found else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "policy": config.balancing_policy,
+            "sticky": config.balancing_sticky,
+            "last_check_age_s": self.last_check_age(),
+            "stale": self.stale(),
+            "replicas": [replica.snapshot() for replica in self.replicas()]
+        }
+
+
+pool = ReplicaPool()
@@ -0,0 +1,287 @@
+"""
+按语义相似度命中的响应缓存（默认关闭，semantic_cache.enabled）。
+
+很多 /chat 和 /club_recommend 请求只是同一个问题的不同说法（"有什么摄影社团" 与
+"推荐摄影类社团"），每次都要完整生成一遍。这里把请求文本转换为向量，在已缓存的请求中
+找出最相似的一条，余弦相似度达到阈值（semantic_cache.threshold，可按接口在 thresholds
+中覆盖）时直接返回其结果。向量有两种：
+- 配置了 semantic_cache.model 且安装了 sentence-transformers 时，用该 CPU 小模型
+  （如 BAAI/bge-small-zh-v1.5）计算句向量，能识别换了说法的同一问题；模型在启动时于
+  线程中加载，加载完成前使用下面的稀疏向量；
+- 否则使用稀疏 TF-IDF 向量：特征为归一化文本的单字和相邻两字（安装了 jieba 时再加上
+  分词结果），IDF 由缓存中已有的请求统计，通过倒排索引找候选。字面特征分不清只差一个
+  关键词的问题（"有什么摄影社团" 与 "有什么篮球社团"），只适合在高阈值下命中几乎相同的请求。
+两种向量的相似度尺度不同，阈值应当用 semantic_cache_eval.py 按实际使用的向量评估后设置。
+
+- context: 必须完全相同才能命中的部分（系统提示、模型、社团数据版本等），不参与相似度；
+- 条目超过 ttl_seconds 过期，超过 max_entries 时淘汰最久未命中的条目（LRU）。
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config_manager import config
+from text_utils import normalize_text
+
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
+DENSE = "dense"
+SPARSE = "sparse"
+
+MAX_CANDIDATES = 50  # 每次查询最多计算多少个候选条目的相似度
+_WINDOW = 200  # 保留最近多少次命中的相似度
+
+
+def features(text: str) -> Dict[str, float]:
+    """文本的词频特征（次线性缩放：1 + log(tf)）"""
+    normalized = normalize_text(text)
+    counts = Counter(normalized)
+    counts.update(normalized[i:i + 2] for i in range(len(normalized) - 1))
+    if jieba is not None:
+        counts.update("w:" + word for word in jieba.cut(text) if len(normalize_text(word)) > 1)
+    return {term: 1.0 + math.log(count) for term, count in counts.items()}
+
+
+_model = None
+_model_name: Optional[str] = None
+_load_failed = False
+_model_lock = threading.Lock()
+
+
+def get_model():
+    """加载（并缓存）句向量模型，未配置或不可用时返回 None。首次加载可能较慢，启动时应在线程中调用"""
+    global _model, _model_name, _load_failed
+    name = config.semantic_cache_model
+    if not name or SentenceTransformer is None:
+        return None
+    if _model is not None and _model_name == name:
+        return _model
+    if _load_failed and _model_name == name:
+        return None
+    with _model_lock:
+        if _model is not None and _model_name == name:
+            return _model
+        try:
+            _model = SentenceTransformer(name, device="cpu")
+            _load_failed = False
+            logger.info(f"语义缓存已加载句向量模型: {name}")
+        except Exception as e:
+            _model = None
+            _load_failed = True
+            logger.warning(f"加载句向量模型失败，语义缓存使用稀疏向量: {name}, 错误: {e}")
+        _model_name = name
+    return _model
+
+
+def model_ready() -> bool:
+    return _model is not None and _model_name == config.semantic_cache_model
+
+
+def embed(text: str) -> Tuple[str, Any]:
+    """文本的向量，返回 (向量类型, 向量)；句向量模型尚未加载完成时使用稀疏向量，不会阻塞等待加载"""
+    if model_ready():
+        return DENSE, _model.encode(text, normalize_embeddings=True)
+    return SPARSE, features(text)
+
+
+def context_key(*parts: Any) -> str:
+    """由必须完全相同的部分组成的上下文键"""
+    return hashlib.blake2b("\x00".join(str(part) for part in parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _Entry:
+    def __init__(self, context: str, text: str, kind: str, vector: Any, value: Any):
+        self.context = context
+        self.text = text
+        self.normalized = normalize_text(text)
+        self.kind = kind
+        self.vector = vector  # 句向量（已归一化）或稀疏特征
+        self.value = value
+        self.created = time.monotonic()
+        self.hits = 0
+
+
+class SemanticCache:
+    """单个接口的语义缓存"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()  # 按最近使用排序
+        self._postings: Dict[str, Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()  # /chat 的流式转发在线程池中写入缓存
+        self.lookups = 0
+        self.hits = 0
+        self.stores = 0
+        self.evictions = 0
+        self.similarities: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def threshold(self) -> float:
+        return config.semantic_cache_thresholds.get(self.name, config.semantic_cache_threshold)
+
+    def _idf(self, term: str) -> float:
+        total = len(self._entries)
+        return math.log((1 + total) / (1 + len(self._postings.get(term, ())))) + 1.0
+
+    def _norm(self, terms: Dict[str, float], idf: Dict[str, float]) -> float:
+        return math.sqrt(sum((weight * idf[term]) ** 2 for term, weight in terms.items()))
+
+    def similarity(self, a: Dict[str, float], b: Dict[str, float]) -> float:
+        """两组特征按当前 IDF 加权后的余弦相似度"""
+        idf = {term: self._idf(term) for term in set(a) | set(b)}
+        norm = self._norm(a, idf) * self._norm(b, idf)
+        if not norm:
+            return 0.0
+        return sum(weight * b[term] * idf[term] ** 2 for term, weight in a.items() if term in b) / norm
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        if entry.kind != SPARSE:
+            return
+        for term in entry.vector:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.discard(entry_id)
+                if not postings:
+                    del self._postings[term]
+
+    def _expire(self):
+        deadline = time.monotonic() - config.semantic_cache_ttl
+        for entry_id in [entry_id for entry_id, entry in self._entries.items() if entry.created < deadline]:
+            self._remove(entry_id)
+
+    def _best_match(self, context: str, kind: str, vector: Any) -> Tuple[Optional[int], float]:
+        if kind == DENSE:
+            scores = ((entry_id, float(vector @ entry.vector)) for entry_id, entry in self._entries.items()
+                      if entry.kind == DENSE and entry.context == context)
+            return max(scores, key=lambda item: item[1], default=(None, 0.0))
+        # 按共享特征的 IDF 之和挑出候选，只对前 MAX_CANDIDATES 个计算完整的相似度
+        overlap: Dict[int, float] = {}
+        for term in vector:
+            postings = self._postings.get(term)
+            if postings:
+                idf = self._idf(term)
+                for entry_id in postings:
+                    overlap[entry_id] = overlap.get(entry_id, 0.0) + idf
+        candidates = sorted(overlap, key=overlap.get, reverse=True)
+        best_id, best = None, 0.0
+        checked = 0
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if entry.context != context:
+                continue
+            score = self.similarity(vector, entry.vector)
+            if score > best:
+                best_id, best = entry_id, score
+            checked += 1
+            if checked >= MAX_CANDIDATES:
+                break
+        return best_id, best
+
+    def lookup(self, context: str, text: str) -> Optional[Tuple[Any, float]]:
+        """查找相似的已缓存请求，命中时返回 (缓存的结果, 相似度)"""
+        if not config.semantic_cache_enabled:
+            return None
+        kind, vector = embed(text)
+        with self._lock:
+            self.lookups += 1
+            self._expire()
+            entry_id, score = self._best_match(context, kind, vector)
+            if entry_id is None or score < self.threshold:
+                return None
+            entry = self._entries[entry_id]
+            entry.hits += 1
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            self.similarities = (self.similarities + [score])[-_WINDOW:]
+        logger.info(f"语义缓存命中（{self.name}，相似度 {score:.3f}）: {text[:50]!r} ≈ {entry.text[:50]!r}")
+        return entry.value, score
+
+    def store(self, context: str, text: str, value: Any):
+        if not config.semantic_cache_enabled:
+            return
+        kind, vector = embed(text)
+        if kind == SPARSE and not vector:
+            return
+        with self._lock:
+            # 相同上下文下完全相同的请求只保留最新的结果
+            normalized = normalize_text(text)
+            for entry_id, entry in list(self._entries.items()):
+                if entry.context == context and entry.normalized == normalized:
+                    self._remove(entry_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(context, text, kind, vector, value)
+            if kind == SPARSE:
+                for term in vector:
+                    self._postings.setdefault(term, set()).add(entry_id)
+            self.stores += 1
+            while len(self._entries) > config.semantic_cache_max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    async def alookup(self, context: str, text: str) -> Optional[Tuple[Any, float]]:
+        """在线程中执行 lookup()（计算句向量较耗 CPU，不阻塞事件循环）"""
+        if not config.semantic_cache_enabled:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(None, self.lookup, context, text)
+
+    async def astore(self, context: str, text: str, value: Any):
+        if config.semantic_cache_enabled:
+            await asyncio.get_running_loop().run_in_executor(None, self.store, context, text, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        similarities = sorted(self.similarities)
+        return {
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else None,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_similarity_p50": round(similarities[len(similarities) // 2], 3) if similarities else None,
+        }
+
+
+_caches: Dict[str, SemanticCache] = {}
+
+
+def get_cache(name: str) -> SemanticCache:
+    cache = _caches.get(name)
+    if cache is None:
+        cache = _caches[name] = SemanticCache(name)
+    return cache
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "enabled": config.semantic_cache_enabled,
+        "embedding": config.semantic_cache_model if model_ready() else
+        ("sparse (jieba + char n-gram)" if jieba is not None else "sparse (char n-gram)"),
+        "endpoints": {name: _caches[name].snapshot() for name in sorted(_caches)}
+    }
@@ -0,0 +1,105 @@
+"""
+评估语义缓存（semantic_cache.py）在不同阈值下的命中率与命中质量。
+
+数据为带意图标签的请求文本：按随机顺序依次查询缓存，未命中时以意图作为结果写入缓存；
+命中时若缓存条目的意图与请求相同记为正确命中，否则为错误命中（返回了别的问题的答案）。
+- hit_rate: 命中次数 / 请求数
+- precision: 正确命中 / 命中次数
+- recall: 正确命中 / 可命中的请求数（同一意图此前已出现过的请求）
+
+默认使用内置的社团推荐与常见问题示例（包含只差一个关键词的不同问题）；--file 指定 JSONL 文件
+（每行 {"text": ..., "intent": ...}）。--model 指定 sentence-transformers 模型时评估句向量，
+否则评估稀疏向量。
+
+用法:
+    python semantic_cache_eval.py
+    python semantic_cache_eval.py --thresholds 0.6 0.7 0.8 0.9 --rounds 20
+    python semantic_cache_eval.py --file queries.jsonl
+    python semantic_cache_eval.py --model BAAI/bge-small-zh-v1.5
+"""
+import argparse
+import json
+import random
+
+import semantic_cache
+from config_manager import config
+
+SAMPLE_QUERIES = {
+    "photography": ["有什么摄影社团", "推荐摄影类社团", "我喜欢拍照，有摄影社吗", "想加入摄影协会", "学校有摄影相关的社团吗",
+                    "有什么摄影社团？", "有什么摄影社团呀"],
+    "basketball": ["有什么篮球社团", "推荐篮球类社团", "我喜欢打篮球，有篮球社吗", "想加入篮球协会", "推荐篮球类的社团"],
+    "programming": ["有什么编程社团", "推荐编程类社团", "想学写代码，有计算机相关的社团吗", "有没有程序设计协会"],
+    "dance": ["有什么街舞社团", "推荐舞蹈类社团", "我喜欢跳街舞，有街舞社吗"],
+    "volunteer": ["有什么志愿者社团", "推荐志愿服务类社团", "想做志愿者，有志愿协会吗"],
+    "join": ["怎么加入社团", "加入社团的流程是什么", "如何申请加入一个社团", "社团怎么报名", "怎么加入社团？"],
+    "quit": ["怎么退出社团", "退出社团的流程是什么", "如何申请退出社团"],
+    "create": ["怎么创建社团", "成立新社团需要什么条件", "如何申请创建一个社团"],
+    "fee": ["社团要交会费吗", "加入社团需要交钱吗", "社团会费是多少"],
+    "activity_time": ["社团活动一般什么时候", "社团活动时间是怎么安排的", "社团一般几点活动"],
+}
+
+
+def load_queries(path):
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                queries.append((item["text"], item["intent"]))
+    return queries
+
+
+def evaluate(queries, threshold, rounds, seed=0):
+    """返回 (请求数, 命中数, 正确命中数, 可命中请求数)"""
+    config.config["semantic_cache"].update({"threshold": threshold, "thresholds": {}})
+    rng = random.Random(seed)
+    totals = [0, 0, 0, 0]
+    for _ in range(rounds):
+        cache = semantic_cache.SemanticCache("eval")
+        order = queries[:]
+        rng.shuffle(order)
+        seen = set()
+        for text, intent in order:
+            totals[0] += 1
+            if intent in seen:
+                totals[3] += 1
+            hit = cache.lookup("", text)
+            if hit is None:
+                cache.store("", text, intent)
+            else:
+                totals[1] += 1
+                if hit[0] == intent:
+                    totals[2] += 1
+            seen.add(intent)
+    return tuple(totals)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语义缓存阈值评估")
+    parser.add_argument("--file", help="JSONL 文件，每行 {\"text\": ..., \"intent\": ...}")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95])
+    parser.add_argument("--rounds", type=int, default=10, help="随机打乱顺序重复的次数")
+    parser.add_argument("--model", default="", help="sentence-transformers 模型名或本地路径，不指定时评估稀疏向量")
+    args = parser.parse_args()
+
+    config.config.setdefault("semantic_cache", {})
+    config.config["semantic_cache"].update({"enabled": True, "model": args.model})
+    if args.model and semantic_cache.get_model() is None:
+        parser.error(f"无法加载句向量模型: {args.model}")
+
+    if args.file:
+        queries = load_queries(args.file)
+    else:
+        queries = [(text, intent) for intent, texts in SAMPLE_QUERIES.items() for text in texts]
+    print(f"{len(queries)} 条请求，{len({intent for _, intent in queries})} 个意图，"
+          f"向量: {semantic_cache.stats()['embedding']}")
+    print(f"{'阈值':>6} {'hit_rate':>9} {'precision':>10} {'recall':>8}")
+    for threshold in args.thresholds:
+        requests, hits, correct, answerable = evaluate(queries, threshold, args.rounds)
+        precision = correct / hits if hits else float("nan")
+        recall = correct / answerable if answerable else float("nan")
+        print(f"{threshold:>6.2f} {hits / requests:>9.3f} {precision:>10.3f} {recall:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
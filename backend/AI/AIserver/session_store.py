@@ -0,0 +1,382 @@
+"""
+/chat 的服务端会话：在服务器上保存多轮对话的历史，客户端每轮只发送新消息。
+
+过去 /chat 要求客户端每轮重新发送完整的 messages 历史，请求体和 prefill 都随对话长度
+增长，历史过长时只能由客户端自己截断。这里：
+- 会话保存系统提示、最近的消息和早期对话的摘要。客户端以 new_session=true 开始会话，
+  会话 id 在响应头 X-Session-Id 中返回；之后的请求带上 session_id，messages 只包含本轮的
+  新消息（delta），服务器拼接历史后转发，生成成功后把新消息和回复追加到会话；
+- 内存中最多保存 sessions.max_sessions 个会话，超出时淘汰最久未使用的会话（LRU）。配置了
+  sessions.spill_dir 时被淘汰的会话写入磁盘（每个会话一个 JSON 文件），再次访问时读回；
+  服务关闭时内存中的会话同样写入磁盘。超过 sessions.idle_ttl_seconds 未使用的会话过期；
+- 历史超过 sessions.max_history_tokens 时压缩：保留最近约 sessions.keep_recent_messages 条消息，
+  更早的消息在后台由模型与已有摘要合并为新的摘要（sessions.compaction 为 summary），或直接
+  丢弃（window；摘要生成失败时同样退化为丢弃）。摘要只在压缩时变化，两次压缩之间各轮请求的
+  前缀保持不变，可以复用 vLLM 的前缀缓存。
+同一会话的请求应依次发送（上一轮返回后再发下一轮），并发请求的追加顺序不确定。
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+import llm_router
+import prompt_registry
+import token_budget
+import token_counter
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+SUMMARY = "summary"
+WINDOW = "window"
+
+SESSION_HEADER = "X-Session-Id"
+SUMMARY_HEADER = "以下是本次对话较早部分的摘要："
+
+_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+_SWEEP_INTERVAL = 600  # 清理过期会话（包括磁盘上的）的最短间隔（秒）
+_ROLE_NAMES = {"user": "用户", "assistant": "助手", "system": "系统"}
+
+
+class Session:
+    """一个会话：系统提示、早期对话的摘要和最近的消息"""
+
+    def __init__(self, session_id: str, system_prompt: Optional[str] = None):
+        self.session_id = session_id
+        self.system_prompt = system_prompt
+        self.summary = ""
+        self.messages: List[Dict[str, str]] = []
+        self.message_tokens: List[int] = []  # 各条消息的 token 数，避免每轮重新计算整个历史
+        self.turns = 0
+        self.compacted = 0  # 已合并进摘要（或丢弃）的消息数
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.compacting = False
+
+    def is_empty(self) -> bool:
+        return not self.messages and not self.summary
+
+    def history_tokens(self) -> int:
+        return sum(self.message_tokens)
+
+    def context(self) -> List[Dict[str, str]]:
+        """发送给模型的历史：系统提示（附带摘要）在前，最近的消息在后"""
+        system = self.system_prompt or ""
+        if self.summary:
+            # 摘要并入唯一的 system 消息，部分模型的 chat template 不接受多条 system 消息
+            system = f"{system}\n\n{SUMMARY_HEADER}\n{self.summary}" if system else f"{SUMMARY_HEADER}\n{self.summary}"
+        context = [{"role": "system", "content": system}] if system else []
+        return context + list(self.messages)
+
+    def to_dict(self, include_tokens: bool = True) -> Dict[str, Any]:
+        data = {
+            "session_id": self.session_id,
+            "system_prompt": self.system_prompt,
+            "summary": self.summary,
+            "messages": self.messages,
+            "turns": self.turns,
+            "compacted": self.compacted,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        if include_tokens:
+            data["message_tokens"] = self.message_tokens
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Session":
+        session = cls(data["session_id"], data.get("system_prompt"))
+        session.summary = data.get("summary") or ""
+        session.messages = data.get("messages") or []
+        session.message_tokens = data.get("message_tokens") or [
+            token_budget.message_tokens([message]) for message in session.messages
+        ]
+        session.turns = data.get("turns", 0)
+        session.compacted = data.get("compacted", 0)
+        session.created_at = data.get("created_at", session.created_at)
+        session.updated_at = data.get("updated_at", session.updated_at)
+        return session
+
+
+async def summarize(summary: str, messages: List[Dict[str, str]]) -> str:
+    """把较早的消息与已有摘要合并为新的摘要"""
+    template = prompt_registry.get("session_summary")
+    conversation = "\n".join(f"{_ROLE_NAMES.get(m['role'], m['role'])}: {m['content']}" for m in messages)
+    prompt, max_tokens = token_budget.prepare(
+        template, ceiling=config.sessions_summary_max_tokens, truncate=("conversation",),
+        summary=summary or "（无）", conversation=conversation
+    )
+    payload = {
+        "messages": prompt,
+        "max_tokens": max_tokens,
+        "temperature": 0.3,
+        "top_p": 0.95
+    }
+    with template.timed():
+        result = await llm_router.chat_completion(template.name, payload)
+    text = llm_router.message_content(result).strip()
+    if not text:
+        raise ValueError("模型返回的摘要为空")
+    return text
+
+
+class SessionStore:
+    def __init__(self):
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()  # 按最近使用排序
+        self._lock = threading.Lock()  # /chat 的流式转发在线程池中追加消息
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._last_sweep = 0.0
+        self.created = 0
+        self.evicted = 0
+        self.spilled = 0
+        self.loaded = 0
+        self.expired = 0
+        self.compactions = 0
+        self.compaction_failures = 0
+
+    # ---- 磁盘 ----
+
+    @property
+    def spill_dir(self) -> Optional[str]:
+        path = config.sessions_spill_dir
+        if not path:
+            return None
+        if not os.path.isabs(path):
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        return path
+
+    def _path(self, session_id: str) -> Optional[str]:
+        directory = self.spill_dir
+        return os.path.join(directory, f"{session_id}.json") if directory else None
+
+    def _spill(self, session: Session):
+        path = self._path(session.session_id)
+        if path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(session.to_dict(), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self.spilled += 1
+        except OSError as e:
+            logger.error(f"会话写入磁盘失败，会话 {session.session_id} 被丢弃: {e}")
+
+    def _load(self, session_id: str) -> Optional[Session]:
+        path = self._path(session_id)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                session = Session.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"读取磁盘上的会话失败: {path}, 错误: {e}")
+            return None
+        finally:
+            self._remove_file(session_id)
+        self.loaded += 1
+        return session
+
+    def _remove_file(self, session_id: str):
+        path = self._path(session_id)
+        if path is not None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除会话文件失败: {path}, 错误: {e}")
+
+    def _expired(self, session: Session, now: float) -> bool:
+        return now - session.updated_at > config.sessions_idle_ttl
+
+    def sweep(self):
+        """删除过期的会话（内存中和磁盘上的）"""
+        now = time.time()
+        self._last_sweep = now
+        with self._lock:
+            for session_id in [session_id for session_id, session in self._sessions.items()
+                               if self._expired(session, now)]:
+                del self._sessions[session_id]
+                self.expired += 1
+        directory = self.spill_dir
+        if not directory or not os.path.isdir(directory):
+            return
+        deadline = now - config.sessions_idle_ttl
+        for entry in os.scandir(directory):
+            try:
+                if entry.name.endswith(".json") and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    self.expired += 1
+            except OSError:
+                pass
+
+    # ---- 生命周期 ----
+
+    def open(self):
+        """在事件循环中调用（服务器启动时），后台压缩任务在该循环中运行"""
+        self._loop = asyncio.get_running_loop()
+        self.sweep()
+
+    async def close(self):
+        """取消进行中的压缩，配置了 spill_dir 时把内存中的会话写入磁盘（重启后可以继续）"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            for session in sessions:
+                session.compacting = False
+                self._spill(session)
+        self._loop = None
+
+    # ---- 读写 ----
+
+    def _insert(self, session: Session):
+        """放入内存（调用方持有锁），超出 max_sessions 时淘汰最久未使用的会话"""
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        now = time.time()
+        while len(self._sessions) > max(1, config.sessions_max_sessions):
+            _, evicted = self._sessions.popitem(last=False)
+            self.evicted += 1
+            if not self._expired(evicted, now):
+                self._spill(evicted)
+
+    def create(self, system_prompt: Optional[str] = None) -> Session:
+        if time.time() - self._last_sweep > _SWEEP_INTERVAL:
+            self.sweep()
+        session = Session(uuid.uuid4().hex, system_prompt)
+        with self._lock:
+            self._insert(session)
+            self.created += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """按 id 获取会话（内存中没有时从磁盘读回），不存在或已过期时返回 None"""
+        if not _ID_PATTERN.match(session_id or ""):
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._load(session_id)
+                if session is None:
+                    return None
+                self._insert(session)
+            else:
+                self._sessions.move_to_end(session_id)
+            if self._expired(session, time.time()):
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        if not _ID_PATTERN.match(session_id or ""):
+            return False
+        with self._lock:
+            found = self._sessions.pop(session_id, None) is not None
+            path = self._path(session_id)
+            if path is not None and os.path.exists(path):
+                self._remove_file(session_id)
+                found = True
+        return found
+
+    def append(self, session: Session, messages: List[Dict[str, str]]):
+        """一轮对话完成后追加本轮的新消息和回复，历史过长时在后台压缩"""
+        tokens = [token_budget.message_tokens([message]) for message in messages]
+        with self._lock:
+            session.messages.extend(messages)
+            session.message_tokens.extend(tokens)
+            session.turns += 1
+            session.updated_at = time.time()
+            # 请求期间会话可能已被淘汰到磁盘，重新放回内存并以这里的内容为准
+            if self._sessions.get(session.session_id) is not session:
+                self._remove_file(session.session_id)
+                self._insert(session)
+            else:
+                self._sessions.move_to_end(session.session_id)
+            compact = (not session.compacting and self._loop is not None
+                       and session.history_tokens() > config.sessions_max_history_tokens
+                       and self._split(session) > 0)
+            if compact:
+                session.compacting = True
+        if compact:
+            self._loop.call_soon_threadsafe(self._start_compaction, session)
+
+    # ---- 压缩 ----
+
+    @staticmethod
+    def _split(session: Session) -> int:
+        """
+        要压缩的最早消息数：保留最近 keep_recent_messages 条，保留部分从 user 消息开始；
+        keep_recent_messages 为 0 时全部压缩进摘要。
+        """
+        split = len(session.messages) - max(0, config.sessions_keep_recent_messages)
+        while 0 < split < len(session.messages) and session.messages[split]["role"] != "user":
+            split -= 1
+        return max(0, split)
+
+    def _start_compaction(self, session: Session):
+        task = asyncio.create_task(self._compact(session))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _compact(self, session: Session):
+        with self._lock:
+            split = self._split(session)
+            old = session.messages[:split]
+            summary = session.summary
+        try:
+            if config.sessions_compaction == SUMMARY and old:
+                summary = await summarize(summary, old)
+        except asyncio.CancelledError:
+            session.compacting = False
+            raise
+        except Exception as e:
+            self.compaction_failures += 1
+            logger.warning(f"会话 {session.session_id} 生成摘要失败，直接丢弃较早的 {split} 条消息: {e}")
+        with self._lock:
+            # 压缩期间追加的消息都在 split 之后，不受影响
+            del session.messages[:split]
+            del session.message_tokens[:split]
+            session.summary = summary
+            session.compacted += split
+            session.compacting = False
+            self.compactions += 1
+        logger.info(f"会话 {session.session_id} 已压缩 {split} 条消息，剩余 {len(session.messages)} 条、"
+                    f"{session.history_tokens()} tokens，摘要 {token_counter.count_tokens(summary)} tokens")
+
+    def stats(self) -> Dict[str, Any]:
+        directory = self.spill_dir
+        on_disk = 0
+        if directory and os.path.isdir(directory):
+            on_disk = sum(1 for name in os.listdir(directory) if name.endswith(".json"))
+        return {
+            "in_memory": len(self._sessions),
+            "on_disk": on_disk,
+            "max_sessions": config.sessions_max_sessions,
+            "compaction": config.sessions_compaction,
+            "created": self.created,
+            "evicted": self.evicted,
+            "spilled": self.spilled,
+            "loaded": self.loaded,
+            "expired": self.expired,
+            "compactions": self.compactions,
+            "compaction_failures": self.compaction_failures,
+            "compacting": len(self._tasks),
+        }
+
+
+store = SessionStore()
@@ -0,0 +1,155 @@
+"""
+LLM 流式输出中 JSON 数组的增量解析。
+
+数据生成接口要求模型返回一个 JSON 数组（或 {"key": [...]} 中的数组）。过去先把
+整段流式响应拼成字符串，再用 find('[') / 正则截取后整体 json.loads：只要有一条数据
+格式有误（或输出被 max_tokens 截断），整批数据都会被丢弃。
+
+JsonArrayStream 逐段接收增量文本，每当数组中的一个元素闭合就立即解析并产出，
+格式有误的元素单独跳过并计数；已处理的文本会被丢弃，内存占用只与单个元素的大小有关。
+"""
+import json
+import re
+from typing import Any, Iterator, List, Optional
+
+# 元素解析失败时的简单修复：去掉对象/数组末尾多余的逗号
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+
+def parse_element(text: str) -> Any:
+    """解析单个数组元素，失败时尝试修复常见的格式问题后再解析"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(_TRAILING_COMMA.sub(r'\1', text))
+
+
+class JsonArrayStream:
+    """
+    增量 JSON 数组解析器。
+    - key: 为 None 时解析文本中的第一个数组；否则解析 "key": [...] 中的数组
+    调用 feed() 传入增量文本，返回本次新闭合的元素列表。数组结束后 done 为 True，
+    之后传入的文本会被忽略。errors 为解析失败被跳过的元素数。
+    """
+
+    def __init__(self, key: Optional[str] = None):
+        self.key = key
+        self._start_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key)) if key else None
+        self._buffer = ""
+        self._pos = 0  # 下一个待扫描字符在 _buffer 中的位置
+        self._started = False
+        self._depth = 0  # 相对于目标数组的嵌套深度，目标数组内部为 1
+        self._in_string = False
+        self._escape = False
+        self._in_comment = False
+        self._element_start: Optional[int] = None
+        self.done = False
+        self.count = 0
+        self.errors = 0
+
+    def _find_start(self) -> bool:
+        if self._start_pattern is not None:
+            match = self._start_pattern.search(self._buffer)
+            if match is None:
+                # 保留末尾一小段，防止 key 被切分在两次增量之间
+                keep = len(self.key) + 16
+                self._buffer = self._buffer[-keep:]
+                return False
+            self._pos = match.end()
+        else:
+            index = self._buffer.find('[')
+            if index == -1:
+                self._buffer = ""
+                return False
+            self._pos = index + 1
+        self._started = True
+        self._depth = 1
+        return True
+
+    def _emit(self, text: str, out: List[Any]):
+        text = text.strip()
+        if not text:
+            return
+        try:
+            out.append(parse_element(text))
+            self.count += 1
+        except json.JSONDecodeError:
+            self.errors += 1
+
+    def feed(self, chunk: str) -> List[Any]:
+        out: List[Any] = []
+        if self.done or not chunk:
+            return out
+        self._buffer += chunk
+        if not self._started and not self._find_start():
+            return out
+
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            ch = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._in_comment:
+                if ch == '\n':
+                    self._in_comment = False
+            elif ch == '"':
+                self._in_string = True
+                if self._element_start is None:
+                    self._element_start = i
+            elif ch in '{[':
+                if self._depth == 1 and self._element_start is None:
+                    self._element_start = i
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 1 and self._element_start is not None:
+                    # 对象/数组元素闭合，立即产出
+                    self._emit(buffer[self._element_start:i + 1], out)
+                    self._element_start = None
+                elif self._depth == 0:
+                    # 目标数组结束
+                    if self._element_start is not None:
+                        self._emit(buffer[self._element_start:i], out)
+                        self._element_start = None
+                    self.done = True
+                    i += 1
+                    break
+            elif self._depth == 1:
+                if ch == ',':
+                    if self._element_start is not None:
+                        self._emit(buffer[self._element_start:i], out)
+                        self._element_start = None
+                elif ch == '/' and self._element_start is None:
+                    if i + 1 == len(buffer):
+                        break  # 等下一段文本再判断是否为注释
+                    if buffer[i + 1] == '/':
+                        # 模型有时会照抄示例中的 "// ..." 注释
+                        self._in_comment = True
+                    else:
+                        self._element_start = i
+                elif not ch.isspace() and self._element_start is None:
+                    self._element_start = i
+            i += 1
+
+        # 丢弃已处理的文本，只保留尚未闭合的元素
+        keep_from = self._element_start if self._element_start is not None else i
+        self._buffer = buffer[keep_from:]
+        if self._element_start is not None:
+            self._element_start = 0
+        self._pos = i - keep_from
+        if self.done:
+            self._buffer = ""
+            self._pos = 0
+        return out
+
+
+def iter_json_array(text: str, key: Optional[str] = None) -> Iterator[Any]:
+    """逐个产出完整文本中 JSON 数组的元素（跳过格式有误的元素）"""
+    yield from JsonArrayStream(key).feed(text)
+
@@ -0,0 +1,130 @@
+"""
+结构化输出：让模型按 Pydantic 模型返回 JSON 并解析为模型实例。
+
+各个返回 JSON 的接口过去各自去掉 ```json 代码块后直接 json.loads，模型输出稍有
+格式问题（多余的说明文字、末尾逗号、照抄示例中的注释）整个请求就失败。
+这里统一处理：
+1. 由 Pydantic 模型生成 JSON Schema，通过 vLLM 的引导解码（guided decoding）约束输出；
+2. 解析时先直接解析，失败再做容错修复后解析，并用模型校验字段；
+3. 只有解析或校验失败时才重试，重试时把错误告诉模型。
+"""
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+import llm_router
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T", bound=BaseModel)
+
+# 引导解码方式：guided_json（vLLM 扩展参数）、response_format（OpenAI json_schema 格式）或 none
+GUIDED_JSON = "guided_json"
+RESPONSE_FORMAT = "response_format"
+
+_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$')
+_LINE_COMMENT = re.compile(r'^\s*//.*$', re.MULTILINE)
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+_schema_cache: Dict[type, Dict[str, Any]] = {}
+
+
+class StructuredOutputError(ValueError):
+    """多次尝试后仍无法得到符合模型的输出"""
+
+
+def schema_for(model_cls: Type[BaseModel]) -> Dict[str, Any]:
+    """模型对应的 JSON Schema（缓存）"""
+    schema = _schema_cache.get(model_cls)
+    if schema is None:
+        schema = _schema_cache[model_cls] = model_cls.model_json_schema()
+    return schema
+
+
+def repair_json(text: str) -> str:
+    """
+    容错修复：去掉 Markdown 代码块和前后的说明文字、整行的 // 注释、
+    对象/数组末尾多余的逗号。
+    """
+    text = _FENCE.sub('', text.strip())
+    start, end = text.find('{'), text.rfind('}')
+    if start != -1 and end > start:
+        text = text[start:end + 1]
+    text = _LINE_COMMENT.sub('', text)
+    return _TRAILING_COMMA.sub(r'\1', text)
+
+
+def parse_structured(text: str, model_cls: Type[T]) -> T:
+    """把模型输出解析为 model_cls 实例，直接解析失败时先修复再解析"""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = json.loads(repair_json(text))
+    return model_cls.model_validate(data)
+
+
+def _guided_params(model_cls: Type[BaseModel]) -> Dict[str, Any]:
+    mode = config.structured_output_mode
+    if mode == GUIDED_JSON:
+        return {"guided_json": schema_for(model_cls)}
+    if mode == RESPONSE_FORMAT:
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {"name": model_cls.__name__, "schema": schema_for(model_cls)}
+        }}
+    return {}
+
+
+async def generate_structured(model_cls: Type[T], messages: List[Dict[str, str]], *,
+                              max_tokens: int = 2048, temperature: float = 0.7, top_p: float = 0.95,
+                              endpoint: str = llm_router.DEFAULT_ROUTE, max_retries: Optional[int] = None,
+                              check: Optional[Callable[[T], None]] = None,
+                              on_usage: Optional[Callable[[Dict[str, Any]], None]] = None) -> T:
+    """
+    请求模型生成符合 model_cls 的 JSON 并返回校验后的实例。
+    check 用于额外的业务校验（例如字段不能为空），抛出 ValueError 视为输出无效并重试。
+    on_usage 在每次收到响应后以 usage（附带 finish_reason）调用，用于统计输出长度。
+    endpoint 为路由名称，决定请求发往哪些后端（见 llm_router.py）。
+    重试次数用尽后抛出 StructuredOutputError。
+    """
+    retries = config.structured_output_max_retries if max_retries is None else max_retries
+    conversation = list(messages)
+    last_error: Optional[Exception] = None
+    content = ""
+
+    for attempt in range(retries + 1):
+        payload = {
+            "messages": conversation,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+        }
+        # 不支持引导解码的后端由路由器去掉这些参数（见 llm_router.Backend）
+        payload.update(_guided_params(model_cls))
+        result = await llm_router.chat_completion(endpoint, payload)
+
+        choices = result.get("choices") or []
+        content = llm_router.message_content(result)
+        if on_usage is not None:
+            on_usage(dict(result.get("usage") or {}, finish_reason=choices[0].get("finish_reason") if choices else None))
+        try:
+            parsed = parse_structured(content, model_cls)
+            if check is not None:
+                check(parsed)
+            if attempt:
+                logger.info(f"{model_cls.__name__} 第 {attempt + 1} 次尝试解析成功")
+            return parsed
+        except (json.JSONDecodeError, ValidationError, ValueError) as e:
+            last_error = e
+            logger.warning(f"{model_cls.__name__} 输出无效（第 {attempt + 1} 次尝试）: {e}; 响应内容: {content[:200]}...")
+            # 重试时带上上一次的输出和错误，让模型修正
+            conversation = list(messages) + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": f"上面的输出无法解析或缺少字段（{str(e)[:200]}）。请只返回符合要求格式的完整JSON，不要包含任何其他文本。"}
+            ]
+
+    raise StructuredOutputError(f"AI返回的响应格式错误，无法解析为JSON: {last_error}; 响应内容: {content[:100]}...")
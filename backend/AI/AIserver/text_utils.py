@@ -0,0 +1,18 @@
+"""
+通用的文本处理函数：粗略的 token 估算和文本规范化。
+
+不依赖配置和第三方库，供流式统计（tongyi_client）、tokenizer 不可用时的回退
+（token_counter）、语义缓存（semantic_cache）和生成数据去重（dedup_index）共用。
+"""
+import re
+
+
+def normalize_text(text: str) -> str:
+    """统一大小写并去掉空白和标点，避免仅格式不同的文本被当作不同内容"""
+    return re.sub(r'[\s\W_]+', '', str(text).lower())
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：中文等非 ASCII 字符约 1 token/字，ASCII 约 4 字符/token"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
@@ -0,0 +1,179 @@
+"""
+按接口管理 token 预算：max_tokens 的取值与超长输入的截断。
+
+各接口过去写死 max_tokens=2048 / 8000（/chat 默认 30000），与实际输出长度无关。
+vLLM 按 max_tokens 为请求预留 KV 缓存并据此调度，上限远大于实际输出时能同时运行的
+请求变少；输入过长时 prompt + max_tokens 超出上下文长度，请求直接被拒绝。
+
+这里：
+1. 用模型 tokenizer 计算 prompt 的 token 数（见 token_counter.py）；
+2. 每个接口记录最近的输出 token 数，样本足够后 max_tokens 取分位数 × 余量，原来写死的
+   值作为上限；输出被截断（finish_reason 为 length）时按翻倍记录，预算随之放宽；
+3. prompt + max_tokens 超出上下文时截断指定的输入字段：保留开头约 2/3 和结尾约 1/3，
+   中间替换为省略标记。同样的输入总是截断为同样的结果。
+批量生成接口的输出长度与条目数成正比，按每条的 token 数记录（items_max_tokens）。
+"""
+import logging
+import math
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import token_counter
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+TRUNCATION_MARKER = "\n……（中间内容过长，已省略）……\n"
+MESSAGE_OVERHEAD = 8  # 每条消息的 chat template 标记（角色、分隔符）大约占用的 token 数
+CONTEXT_MARGIN = 64  # token 数估算误差的余量
+
+
+class OutputBudget:
+    """
+    单个接口的输出长度分布。
+    - ceiling: 允许的最大 max_tokens（即原来写死的值）
+    - per_item: 为 True 时样本为每条数据的 token 数，max_tokens 按条目数计算
+    """
+
+    def __init__(self, name: str, ceiling: int, per_item: bool = False):
+        self.name = name
+        self.ceiling = ceiling
+        self.per_item = per_item
+        self.samples: deque = deque(maxlen=config.token_budget_window)
+        self.requests = 0
+        self.truncated = 0
+
+    def record(self, completion_tokens: Optional[int], max_tokens: int,
+               finish_reason: Optional[str] = None, items: int = 1):
+        if not isinstance(completion_tokens, int):
+            return
+        self.requests += 1
+        if finish_reason == "length" or completion_tokens >= max_tokens:
+            # 被截断的输出实际需要多长未知，按翻倍记录，下次给更大的预算
+            self.truncated += 1
+            completion_tokens = max(completion_tokens, min(self.ceiling, max_tokens * 2))
+        if items > 0:
+            self.samples.append(completion_tokens / items)
+
+    def learned(self) -> Optional[float]:
+        """样本分位数 × 余量；样本不足时返回 None"""
+        if len(self.samples) < max(1, config.token_budget_min_samples):
+            return None
+        ordered = sorted(self.samples)
+        value = ordered[min(len(ordered) - 1, int(config.token_budget_percentile * len(ordered)))]
+        return value * config.token_budget_headroom
+
+    def max_tokens(self, items: int = 1) -> int:
+        learned = self.learned()
+        if learned is None:
+            return self.ceiling
+        return max(min(config.token_budget_min_tokens, self.ceiling), min(self.ceiling, math.ceil(learned * items)))
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+        snapshot = {
+            "ceiling": self.ceiling,
+            "requests": self.requests,
+            "truncated": self.truncated,
+            "samples": len(ordered),
+            "p50_tokens": round(ordered[len(ordered) // 2], 1) if ordered else None,
+        }
+        if self.per_item:
+            learned = self.learned()
+            snapshot["tokens_per_item"] = round(learned, 1) if learned is not None else None
+        else:
+            snapshot["max_tokens"] = self.max_tokens()
+        return snapshot
+
+
+_budgets: Dict[str, OutputBudget] = {}
+
+
+def get_budget(name: str, ceiling: int, per_item: bool = False) -> OutputBudget:
+    budget = _budgets.get(name)
+    if budget is None:
+        budget = _budgets[name] = OutputBudget(name, ceiling, per_item)
+    return budget
+
+
+def message_tokens(messages: Sequence[Dict[str, str]]) -> int:
+    """消息列表的 prompt token 数"""
+    return sum(token_counter.count_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+
+def fit_context(max_tokens: int, prompt_tokens: int) -> int:
+    """把 max_tokens 限制在上下文的剩余空间内"""
+    return max(1, min(max_tokens, config.context_window - prompt_tokens - CONTEXT_MARGIN))
+
+
+def _cut(text: str, keep: int) -> str:
+    head = (keep * 2 + 2) // 3
+    tail = keep - head
+    return text[:head] + TRUNCATION_MARKER + (text[-tail:] if tail else "")
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """把文本截断到 max_tokens 以内：保留开头和结尾，中间替换为省略标记"""
+    if token_counter.count_tokens(text) <= max_tokens:
+        return text
+    if token_counter.count_tokens(TRUNCATION_MARKER) >= max_tokens:
+        return ""
+    # 二分查找能保留的最多字符数
+    low, high = 0, len(text) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if token_counter.count_tokens(_cut(text, middle)) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return _cut(text, low)
+
+
+def prepare(template, ceiling: int = 2048, truncate: Sequence[str] = (),
+            **variables: Any) -> Tuple[List[Dict[str, str]], int]:
+    """
+    渲染 prompt 模板并确定 max_tokens，返回 (消息列表, max_tokens)。
+    prompt 加上输出预算超出上下文时，从最长的开始依次截断 truncate 中列出的变量。
+    """
+    max_tokens = get_budget(template.name, ceiling).max_tokens()
+    input_limit = config.context_window - max_tokens - CONTEXT_MARGIN
+    excess = (template.system_tokens + 2 * MESSAGE_OVERHEAD
+              + token_counter.count_tokens(template.render(**variables)) - input_limit)
+    if excess > 0:
+        fields = [field for field in truncate if isinstance(variables.get(field), str)]
+        lengths = {field: token_counter.count_tokens(variables[field]) for field in fields}
+        for field in sorted(fields, key=lambda f: -lengths[f]):
+            if excess <= 0:
+                break
+            shortened = truncate_text(variables[field], max(0, lengths[field] - excess))
+            excess -= lengths[field] - token_counter.count_tokens(shortened)
+            variables[field] = shortened
+            logger.warning(f"{template.name} 输入过长，已截断 {field}: {lengths[field]} tokens")
+    messages = template.messages(**variables)
+    return messages, fit_context(max_tokens, message_tokens(messages))
+
+
+def items_max_tokens(name: str, items: int, messages: Sequence[Dict[str, str]], ceiling: int = 8000) -> int:
+    """批量生成 items 条数据时的 max_tokens"""
+    max_tokens = get_budget(name, ceiling, per_item=True).max_tokens(items)
+    return fit_context(max_tokens, message_tokens(messages))
+
+
+def record(name: str, usage: Optional[Dict[str, Any]], max_tokens: int, items: int = 1):
+    """记录一次调用的输出 token 数（usage 为 vLLM 返回的 usage，可带 finish_reason）"""
+    budget = _budgets.get(name)
+    if budget is not None and usage:
+        budget.record(usage.get("completion_tokens"), max_tokens, usage.get("finish_reason"), items)
+
+
+def recorder(name: str, max_tokens: int) -> Callable[[Dict[str, Any]], None]:
+    """返回记录函数，供 generate_structured 的 on_usage 使用（每次尝试都记录）"""
+    return lambda usage: record(name, usage, max_tokens)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "context_window": config.context_window,
+        "exact_token_counts": token_counter.is_exact(),
+        "endpoints": {name: _budgets[name].snapshot() for name in sorted(_budgets)}
+    }
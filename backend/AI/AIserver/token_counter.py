@@ -0,0 +1,66 @@
+"""
+按所服务模型的 tokenizer 计算 token 数。
+
+优先用 transformers 加载 tokenizer（名称或本地路径取 tokenizer.path，默认与
+vllm.default_model 相同；下载后缓存在本地 HuggingFace 缓存目录）。未安装
+transformers 或加载失败时退回按字符粗略估算。
+"""
+import logging
+import threading
+from typing import Optional
+
+from config_manager import config
+from text_utils import estimate_tokens
+
+try:
+    from transformers import AutoTokenizer
+except ImportError:
+    AutoTokenizer = None
+
+logger = logging.getLogger(__name__)
+
+_tokenizer = None
+_tokenizer_name: Optional[str] = None
+_load_failed = False
+_lock = threading.Lock()
+
+
+def tokenizer_name() -> str:
+    return config.tokenizer_path or config.default_model
+
+
+def get_tokenizer():
+    """加载（并缓存）tokenizer，不可用时返回 None。首次加载可能较慢，启动时应在线程中调用"""
+    global _tokenizer, _tokenizer_name, _load_failed
+    name = tokenizer_name()
+    if _tokenizer is not None and _tokenizer_name == name:
+        return _tokenizer
+    if AutoTokenizer is None or (_load_failed and _tokenizer_name == name):
+        return None
+    with _lock:
+        if _tokenizer is not None and _tokenizer_name == name:
+            return _tokenizer
+        try:
+            _tokenizer = AutoTokenizer.from_pretrained(name, local_files_only=config.tokenizer_local_files_only)
+            _load_failed = False
+            logger.info(f"已加载 tokenizer: {name}")
+        except Exception as e:
+            _tokenizer = None
+            _load_failed = True
+            logger.warning(f"加载 tokenizer 失败，token 数将按字符估算: {name}, 错误: {e}")
+        _tokenizer_name = name
+    return _tokenizer
+
+
+def is_exact() -> bool:
+    """当前 token 数是否由模型 tokenizer 计算（否则为估算值）"""
+    return _tokenizer is not None and _tokenizer_name == tokenizer_name()
+
+
+def count_tokens(text: str) -> int:
+    """计算文本的 token 数；tokenizer 尚未加载或不可用时按字符估算，不会阻塞等待加载"""
+    if not text:
+        return 0
+    if is_exact():
+        return len(_tokenizer.encode(text, add_special_tokens=False))
+    return estimate_tokens(text)
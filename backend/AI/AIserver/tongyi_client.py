@@ -0,0 +1,160 @@
+"""
+通义千问（DashScope OpenAI 兼容模式）的流式调用适配器。
+
+/summarize_tongyi 过去每次请求都新建一个同步 OpenAI 客户端（新的连接池和 TLS 握手），
+并在同步生成器中迭代流式响应，每个总结请求占用一个线程池线程；客户端断开后上游仍会
+一直生成到结束。
+
+这里：
+- 进程内共享一个 AsyncOpenAI 客户端并复用连接，配置变化（/reload_config）后重建；
+- 以异步生成器产出增量文本，调用方停止迭代（例如客户端断开）时关闭上游连接，上游随之停止生成；
+- 记录首 token 延迟（TTFT）、输出速度和请求结果，通过 stats() 查看。
+base_url 可配置（tongyi.base_url），测试时可以指向本地任意 OpenAI 兼容服务。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from config_manager import config
+from text_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_WINDOW = 200  # 保留最近多少次请求的延迟和速度
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class StreamMetrics:
+    """流式请求的结果计数、首 token 延迟和输出速度（tokens/s）"""
+
+    def __init__(self):
+        self.requests = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.errors = 0
+        self.ttft: deque = deque(maxlen=_WINDOW)
+        self.tokens_per_second: deque = deque(maxlen=_WINDOW)
+
+    def finish(self, outcome: str, start: float, first_token_at: Optional[float], completion_tokens: int):
+        if outcome == "completed":
+            self.completed += 1
+        elif outcome == "cancelled":
+            self.cancelled += 1
+        else:
+            self.errors += 1
+        if first_token_at is not None:
+            self.ttft.append(first_token_at - start)
+            generation_time = time.perf_counter() - first_token_at
+            if outcome == "completed" and generation_time > 0 and completion_tokens > 1:
+                self.tokens_per_second.append((completion_tokens - 1) / generation_time)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ttft = list(self.ttft)
+        speed = list(self.tokens_per_second)
+        return {
+            "requests": self.requests,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+            "ttft_p50_ms": round(_percentile(ttft, 0.5) * 1000, 1) if ttft else None,
+            "ttft_p95_ms": round(_percentile(ttft, 0.95) * 1000, 1) if ttft else None,
+            "tokens_per_second_p50": round(_percentile(speed, 0.5), 1) if speed else None,
+        }
+
+
+metrics = StreamMetrics()
+
+_client: Optional[AsyncOpenAI] = None
+_client_settings: Optional[tuple] = None
+_retired: List[AsyncOpenAI] = []  # 配置变化前创建的客户端，可能仍有进行中的请求，关闭服务时一并关闭
+
+
+def get_client() -> AsyncOpenAI:
+    """获取（必要时创建）进程内共享的 AsyncOpenAI 客户端"""
+    global _client, _client_settings
+    settings = (config.tongyi_base_url, config.tongyi_api_key, config.tongyi_timeout, config.tongyi_max_connections)
+    if _client is None or _client_settings != settings:
+        if _client is not None:
+            _retired.append(_client)
+        base_url, api_key, timeout, max_connections = settings
+        _client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        )
+        _client_settings = settings
+    return _client
+
+
+async def close_client():
+    """关闭共享客户端（服务器关闭时调用）"""
+    global _client, _client_settings
+    for client in _retired + ([_client] if _client is not None else []):
+        await client.close()
+    _retired.clear()
+    _client = None
+    _client_settings = None
+
+
+async def stream_chat(messages: List[Dict[str, str]], model: Optional[str] = None,
+                      usage: Optional[Dict[str, Any]] = None, **params: Any) -> AsyncIterator[str]:
+    """
+    流式请求 chat/completions，逐个产出增量文本。params 为其他生成参数（temperature 等）。
+    传入 usage 字典时写入上游返回的 token 用量。
+    调用方提前停止迭代并关闭生成器（或所在任务被取消）时，上游连接随之关闭。
+    """
+    metrics.requests += 1
+    start = time.perf_counter()
+    first_token_at: Optional[float] = None
+    completion_estimate = 0
+    outcome = "error"
+    usage = usage if usage is not None else {}
+    stream = None
+    try:
+        stream = await get_client().chat.completions.create(
+            model=model or config.tongyi_model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage.update(chunk.usage.model_dump(exclude_none=True))
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                completion_estimate += estimate_tokens(content)
+                yield content
+        outcome = "completed"
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    finally:
+        if stream is not None:
+            await stream.close()
+        completion_tokens = usage.get("completion_tokens") or completion_estimate
+        metrics.finish(outcome, start, first_token_at, completion_tokens)
+        if outcome == "cancelled":
+            logger.info(f"通义千问流式请求已取消，已输出约 {completion_estimate} tokens")
+
+
+def stats() -> Dict[str, Any]:
+    return dict({"base_url": config.tongyi_base_url, "model": config.tongyi_model}, **metrics.snapshot())
@@ -0,0 +1,96 @@
+"""
+访问 vLLM（OpenAI 兼容接口）的共享异步客户端。
+
+进程内复用同一个 httpx.AsyncClient 及其连接池，请求不会阻塞事件循环，
+多个请求可以同时发往 vLLM，由其连续批处理（continuous batching）合并执行。
+"""
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+from config_manager import config
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """获取（必要时创建）进程内共享的异步 HTTP 客户端"""
+    global _client
+    if _client is None or _client.is_closed:
+        max_connections = config.vllm_max_connections
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.request_timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+    return _client
+
+
+async def close_client():
+    """关闭共享客户端（服务器关闭时调用）"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def iter_chat_deltas(payload: Dict[str, Any], url: Optional[str] = None,
+                           timeout: Optional[float] = None,
+                           usage: Optional[Dict[str, Any]] = None,
+                           headers: Optional[Dict[str, str]] = None) -> AsyncIterator[str]:
+    """
+    以流式方式请求 chat/completions，逐个产出增量文本。
+    传入 usage 字典时请求 vLLM 在流末尾返回 token 用量，并写入该字典。
+    headers 为额外的请求头（例如远端 OpenAI 兼容服务的 Authorization）。
+    调用方提前停止迭代并关闭生成器时，连接随之关闭，vLLM 会中止该请求。
+    """
+    payload = dict(payload, stream=True)
+    if usage is not None:
+        payload["stream_options"] = {"include_usage": True}
+    request_timeout = httpx.Timeout(timeout, connect=10.0) if timeout else None
+    kwargs = {"timeout": request_timeout} if request_timeout else {}
+    async with get_client().stream("POST", url or config.vllm_api_url, json=payload, headers=headers,
+                                   **kwargs) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            # 移除"data: "前缀
+            data = line[6:]
+            if data == "[DONE]":
+                break
+            try:
+                json_data = json.loads(data)
+            except json.JSONDecodeError:
+                logger.debug(f"无法解析的SSE数据行: {data}")
+                continue
+            if usage is not None and json_data.get("usage"):
+                usage.update(json_data["usage"])
+            choices = json_data.get("choices") or []
+            if choices:
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    yield content
+
+
+async def stream_chat_completion(payload: Dict[str, Any], url: Optional[str] = None,
+                                 timeout: Optional[float] = None) -> str:
+    """以流式方式请求并拼接完整的回复文本"""
+    parts = []
+    async for content in iter_chat_deltas(payload, url=url, timeout=timeout):
+        parts.append(content)
+    return "".join(parts)
+
+
+async def chat_completion(payload: Dict[str, Any], url: Optional[str] = None,
+                          timeout: Optional[float] = None,
+                          headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """非流式请求 chat/completions，返回解析后的 JSON 响应"""
+    payload = dict(payload, stream=False)
+    kwargs = {"timeout": httpx.Timeout(timeout, connect=10.0)} if timeout else {}
+    response = await get_client().post(url or config.vllm_api_url, json=payload, headers=headers, **kwargs)
+    response.raise_for_status()
+    return response.json()
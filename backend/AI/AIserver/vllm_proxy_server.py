@@ -1,18 +1,18 @@
 import requests
 import json
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Body, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import logging
 import os
 import sys
 import summary
-from openai import OpenAI
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
 import time
 import re
+import random
 import signal
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
@@ -31,6 +31,26 @@ except ImportError as e:
     print("请确保config_manager.py文件存在且语法正确")
     sys.exit(1)
 
+import vllm_client
+from job_manager import JobManager, JobContext, NullJobContext, JobInterrupted, JOB_COMPLETED
+from dedup_index import DedupIndex, accumulate_usage, generation_stats
+from text_utils import estimate_tokens
+from stream_json import JsonArrayStream
+from structured_output import generate_structured
+import prompt_registry
+import llm_router
+import club_crawler
+import club_refresh
+import club_store
+import coalescer
+import replica_pool
+import semantic_cache
+import session_store
+import token_budget
+import token_counter
+import tongyi_client
+from id_allocator import IdAllocator
+
 # 配置日志
 logging.basicConfig(
     level=getattr(logging, config.log_level),
@@ -42,6 +62,7 @@ logger = logging.getLogger(__name__)
 server_should_exit = False
 active_tasks = set()
 shutdown_event = asyncio.Event()
+job_manager = JobManager(os.path.join(current_dir, config.job_state_dir), workers=config.job_workers)
 
 def handle_exit_signal(signum, frame):
     """处理退出信号"""
@@ -82,16 +103,36 @@ async def startup_event():
     global server_should_exit, active_tasks
     server_should_exit = False
     active_tasks.clear()
+    prompt_registry.load()
+    club_store.store.open()
+    club_store.store.import_json(CLUB_INFORMATION_FILE)
+    club_refresher.start()
+    session_store.store.open()
+    replica_pool.pool.start()
+    # 加载 tokenizer 可能需要读取/下载模型文件，放到线程中；加载完成前 token 数按字符估算
+    asyncio.get_running_loop().run_in_executor(None, token_counter.get_tokenizer)
+    if config.semantic_cache_enabled:
+        # 句向量模型同样在线程中加载，加载完成前语义缓存使用稀疏向量
+        asyncio.get_running_loop().run_in_executor(None, semantic_cache.get_model)
+    await job_manager.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """服务器关闭时的清理"""
     global server_should_exit
     server_should_exit = True
+    await job_manager.stop()  # 未完成的后台任务保留检查点，重启后继续
     logger.info("等待所有任务完成...")
     while active_tasks:
         await asyncio.sleep(0.1)
     logger.info("所有任务已完成")
+    await club_refresher.stop()
+    await session_store.store.close()  # 配置了 sessions.spill_dir 时会话写入磁盘，重启后可以继续
+    await replica_pool.pool.stop()
+    await vllm_client.close_client()
+    await tongyi_client.close_client()
+    await club_crawler.close_client()
+    club_store.store.close()
 
 # 配置CORS
 if config.enable_cors:
@@ -101,6 +142,7 @@ if config.enable_cors:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[session_store.SESSION_HEADER],
     )
 
 class Message(BaseModel):
@@ -115,11 +157,17 @@ class ChatRequest(BaseModel):
     top_p: Optional[float] = config.default_top_p
     stream: Optional[bool] = True
     system_prompt: Optional[str] = "You are a helpful assistant."
+    # 服务端会话（见 session_store.py）：new_session 为 True 时以 messages 为初始历史创建会话，
+    # 会话 id 在响应头 X-Session-Id 中返回；之后带上 session_id，messages 只包含本轮的新消息，
+    # system_prompt 沿用创建会话时的值
+    session_id: Optional[str] = None
+    new_session: Optional[bool] = False
 
 class ChatResponse(BaseModel):
     response: str
     model: str
     usage: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
 
 class TongyiSummaryRequest(BaseModel):
     text: str
@@ -187,6 +235,14 @@ class FinancialBookkeepingResponse(BaseModel):
     confirmation_message: str # AI生成的确认信息或提示
     original_input: str # 原始输入，方便调试
 
+class FinancialBookkeepingOutput(BaseModel):
+    """
+    记账接口中由模型生成的部分，用于结构化输出。
+    引导解码仍按 FinancialEntry 约束每个条目，但条目在接口中逐个校验，单个条目不完整时跳过而不是整批失败。
+    """
+    parsed_entries: List[Dict[str, Any]] = Field(json_schema_extra={"items": FinancialEntry.model_json_schema()})
+    confirmation_message: str
+
 # 新增财务报表生成请求和响应模型
 class FinancialReportRequest(BaseModel):
     club_name: str # 社团名称
@@ -210,6 +266,12 @@ class BudgetWarningResponse(BaseModel):
     club_budget_limit: Optional[float] = None # 社团存储的预算上限
     club_budget_description: Optional[str] = None # 社团存储的预算描述
 
+class BudgetWarningOutput(BaseModel):
+    """预算预警接口中由模型生成的部分，用于结构化输出"""
+    warning_message: str
+    is_over_budget: bool
+    percentage_used: float
+
 # 新增修改预算请求模型
 class UpdateBudgetRequest(BaseModel):
     club_name: str # 社团名称
@@ -298,6 +360,7 @@ class MLDataGenerationRequest(BaseModel):
     num_users: int = 5
     num_interactions: int = 8
     save_file: Optional[str] = "ml_data.json" # 新增保存文件名
+    parallelism: Optional[int] = None  # 每个阶段同时发往 vLLM 的批次数，默认取 vllm.generation_parallelism
 
 class MLDataGenerationResponse(BaseModel):
     communities: List[CommunityItem]
@@ -305,6 +368,7 @@ class MLDataGenerationResponse(BaseModel):
     interactions: List[InteractionItem]
     message: str # 新增消息字段
     file_path: Optional[str] = None # 新增保存文件路径字段
+    stats: Optional[Dict[str, Any]] = None # token 消耗与去重统计
 
 # New Pydantic Models for User data generation
 class UserItem(BaseModel):
@@ -327,36 +391,7 @@ class UserDataGenerationResponse(BaseModel):
     sample_data: List[UserItem]
     file_path: Optional[str] = None
 
-# tongyi_chat 函数
-api_key_tongyi="sk-354859a6d3ae438fb8ab9b98194f5266"
-base_url_tongyi="https://dashscope.aliyuncs.com/compatible-mode/v1"
-def tongyi_chat_embedded(messages=None,temperature=0.7,max_tokens=1024,presence_penalty=0.0,top_p=1.0):
-    try:        
-        client = OpenAI(
-            api_key=api_key_tongyi,
-            base_url=base_url_tongyi,
-        )
-        messages_for_api=[
-            {"role": "system", "content": "你是一个专业的通知总结专家，请根据通知内容总结，基于通知像人一样总结，更像朋友之间的聊天。"},
-            {"role": "user", "content": messages}
-        ]
-        completion = client.chat.completions.create(
-            model="qwen-plus",
-            messages=messages_for_api,
-            stream=True,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            presence_penalty=presence_penalty,
-            top_p=top_p
-        )
-        for chunk in completion:
-            if chunk.choices[0].delta.content is not None:
-                yield{"type": "content", "content": chunk.choices[0].delta.content}
-    except Exception as e:
-        logger.error(f"通义千问API调用错误: {e}")
-        # 可以在这里根据需要抛出更具体的异常或返回错误信息
-        # 为了在HTTP响应中捕获，这里不直接 sys.exit(1)
-        yield{"type": "error", "content": f"通义千问API调用错误: {e}"}
+TONGYI_SUMMARY_SYSTEM_PROMPT = "你是一个专业的通知总结专家，请根据通知内容总结，基于通知像人一样总结，更像朋友之间的聊天。"
 
 # 全局财务数据存储路径
 FINANCIAL_DATA_FILE = os.path.join(current_dir, config.financial_data_file)
@@ -392,130 +427,59 @@ def save_financial_data(data: Dict[str, Any]):
     except Exception as e:
         logger.error(f"保存财务数据文件失败: {e}")
 
-# 全局社团信息存储路径
+# 旧的社团信息文件，社团信息现在保存在 club_store 中，首次启动时从该文件导入
 CLUB_INFORMATION_FILE = os.path.join(current_dir, config.club_information_file) if hasattr(config, 'club_information_file') else os.path.join(current_dir, 'Club_information.json')
 
 def load_club_information() -> Dict[str, Any]:
-    """从JSON文件加载所有社团的信息"""
-    if not os.path.exists(CLUB_INFORMATION_FILE):
-        return {} # 如果文件不存在，返回一个空字典
-    try:
-        with open(CLUB_INFORMATION_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if not isinstance(data, dict): # 确保加载的是字典
-                logger.error(f"社团信息文件格式错误，应为字典，但加载到: {type(data)}")
-                os.rename(CLUB_INFORMATION_FILE, f"{CLUB_INFORMATION_FILE}.bak_{int(time.time())}")
-                logger.warning(f"已备份损坏的社团信息文件到 {CLUB_INFORMATION_FILE}.bak_{int(time.time())}")
-                return {}
-            return data
-    except json.JSONDecodeError as e:
-        logger.error(f"加载社团信息文件时JSON解析错误: {e}")
-        os.rename(CLUB_INFORMATION_FILE, f"{CLUB_INFORMATION_FILE}.bak_{int(time.time())}")
-        logger.warning(f"已备份损坏的社团信息文件到 {CLUB_INFORMATION_FILE}.bak_{int(time.time())}")
-        return {}
-    except Exception as e:
-        logger.error(f"加载社团信息文件失败: {e}")
-        return {}
-
-def save_club_information(data: Dict[str, Any]):
-    """将所有社团的信息保存到JSON文件"""
-    try:
-        with open(CLUB_INFORMATION_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        logger.error(f"保存社团信息文件失败: {e}")
-
-async def fetch_club_list(offset: int = 0, num: int = 100) -> List[ClubListResponseItem]:
-    """从远程API获取社团列表"""
-    try:
-        if not hasattr(config, 'external_api') or not hasattr(config.external_api, 'base_url'):
-            logger.error("config.json中未配置external_api.base_url")
-            raise HTTPException(status_code=500, detail="外部API基础URL未配置")
-        
-        url = f"{config.external_api.base_url}/api/club/list?offset={offset}&num={num}"
-        logger.info(f"正在从 {url} 获取社团列表")
-        response = requests.get(url, timeout=config.request_timeout)
-        response.raise_for_status() # 检查HTTP错误
-        
-        club_list_data = response.json()
-        clubs = [ClubListResponseItem(**item) for item in club_list_data]
-        logger.info(f"成功获取 {len(clubs)} 个社团的列表")
-        return clubs
-    except requests.exceptions.Timeout:
-        logger.error("获取社团列表超时")
-        raise HTTPException(status_code=504, detail="获取社团列表超时")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"获取社团列表失败: {e}")
-        raise HTTPException(status_code=500, detail=f"获取社团列表失败: {e}")
-    except Exception as e:
-        logger.error(f"处理社团列表时发生未知错误: {e}")
-        raise HTTPException(status_code=500, detail=f"服务器内部错误: {e}")
+    """加载所有社团的信息（club_id 字符串 -> 社团信息，见 club_store.py）"""
+    return club_store.store.all()
 
-async def fetch_club_details(club_id: int, post_num: int = 5) -> ClubDetailResponse:
-    """从远程API获取单个社团的详细信息"""
+def parse_club_detail(data: Dict[str, Any]) -> Dict[str, Any]:
+    """校验外部 API 返回的社团详情，并把 tags 字段反序列化为列表"""
+    club_detail = ClubDetailResponse(**data)
+    club = club_detail.dict()
     try:
-        if not hasattr(config, 'external_api') or not hasattr(config.external_api, 'base_url'):
-            logger.error("config.json中未配置external_api.base_url")
-            raise HTTPException(status_code=500, detail="外部API基础URL未配置")
-
-        url = f"{config.external_api.base_url}/api/club/{club_id}/info?post_num={post_num}"
-        logger.info(f"正在从 {url} 获取社团详情 (ID: {club_id})")
-        response = requests.get(url, timeout=config.request_timeout)
-        response.raise_for_status() # 检查HTTP错误
-
-        club_detail_data = response.json()
-        club_detail = ClubDetailResponse(**club_detail_data)
-        logger.info(f"成功获取社团 (ID: {club_id}) 的详情")
-        return club_detail
-    except requests.exceptions.Timeout:
-        logger.error(f"获取社团 (ID: {club_id}) 详情超时")
-        raise HTTPException(status_code=504, detail=f"获取社团 (ID: {club_id}) 详情超时")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"获取社团 (ID: {club_id}) 详情失败: {e}")
-        raise HTTPException(status_code=500, detail=f"获取社团 (ID: {club_id}) 详情失败: {e}")
-    except Exception as e:
-        logger.error(f"处理社团 (ID: {club_id}) 详情时发生未知错误: {e}")
-        raise HTTPException(status_code=500, detail=f"服务器内部错误: {e}")
+        club["tags"] = json.loads(club_detail.tags)
+    except json.JSONDecodeError:
+        logger.warning(f"社团 {club_detail.club_name} (ID: {club_detail.club_id}) 的tags字段无法解析为JSON: {club_detail.tags}")
+        club["tags"] = [club_detail.tags] # 如果解析失败，将其作为单个标签列表
+    return club
 
 async def update_club_information():
-    """获取所有社团列表和详情，并保存到本地JSON文件"""
+    """并发获取所有社团列表和详情（见 club_crawler.py），增量写入社团信息存储（见 club_store.py）"""
     try:
-        all_clubs_data = {}
-        offset = 0
-        num = 100
-        while True:
-            club_list = await fetch_club_list(offset=offset, num=num)
-            if not club_list:
-                break
-            
-            for club_item in club_list:
-                try:
-                    club_detail = await fetch_club_details(club_id=club_item.club_id)
-                    # 反序列化tags字段
-                    try:
-                        club_detail.tags = json.loads(club_detail.tags)
-                    except json.JSONDecodeError:
-                        logger.warning(f"社团 {club_detail.club_name} (ID: {club_detail.club_id}) 的tags字段无法解析为JSON: {club_detail.tags}")
-                        club_detail.tags = [club_detail.tags] # 如果解析失败，将其作为单个标签列表
+        store = club_store.store
+        # 已有数据的社团发条件请求，未变化（304）时不需要重新写入
+        validators = store.validators()
+        result = await club_crawler.crawl(known=store.ids(), validators=validators)
 
-                    # 将ClubDetailResponse对象转换为字典并存储
-                    all_clubs_data[str(club_detail.club_id)] = club_detail.dict()
-                except HTTPException as e:
-                    logger.error(f"获取社团 {club_item.club_name} (ID: {club_item.club_id}) 详情失败: {e.detail}")
-                except Exception as e:
-                    logger.error(f"处理社团 {club_item.club_name} (ID: {club_item.club_id}) 详情时发生未知错误: {e}")
-            
-            offset += num
-            if len(club_list) < num: # 如果返回的列表数量小于请求的数量，说明已经到末尾
-                break
-        
-        save_club_information(all_clubs_data)
-        logger.info(f"成功更新了 {len(all_clubs_data)} 个社团的信息到 {CLUB_INFORMATION_FILE}")
-        return {"message": f"成功更新了 {len(all_clubs_data)} 个社团的信息", "status": "success"}
+        fetched = {}
+        for club_id, data in result.details.items():
+            try:
+                fetched[club_id] = parse_club_detail(data)
+            except Exception as e:
+                logger.error(f"处理社团 (ID: {club_id}) 详情时发生未知错误: {e}")
+        changes = store.upsert_many(fetched, validators)
+        # 列表中已不存在的社团删除；获取失败的社团暂时保留上次的数据
+        deleted = store.delete_missing(result.listed)
+
+        total = store.count()
+        logger.info(f"成功更新了 {total} 个社团的信息（变化 {len(changes)} 个，删除 {len(deleted)} 个）到 {store.path}")
+        return {
+            "message": f"成功更新了 {total} 个社团的信息",
+            "status": "success",
+            "changed": len(changes),
+            "deleted": len(deleted),
+            "latest_seq": store.latest_seq(),
+            "stats": result.metrics.snapshot()
+        }
     except Exception as e:
         logger.error(f"更新社团信息失败: {e}")
         raise HTTPException(status_code=500, detail=f"更新社团信息失败: {e}")
 
+# 定时在后台刷新社团信息，并把变化的社团增量同步给推荐服务（见 club_refresh.py）
+club_refresher = club_refresh.ClubRefresher(update_club_information)
+
 @app.get("/")
 async def root():
     """健康检查接口"""
@@ -529,19 +493,18 @@ async def root():
 @app.get("/health")
 async def health_check():
     """详细的健康检查，包括vLLM服务器连接状态"""
-    try:
-        # 尝试连接vLLM服务器
-        health_url = config.vllm_api_url.replace("/v1/chat/completions", "/health")
-        response = requests.get(health_url, timeout=5)
-        vllm_status = "connected" if response.status_code == 200 else "unavailable"
-    except Exception as e:
-        logger.warning(f"无法连接到vLLM服务器: {e}")
-        vllm_status = "disconnected"
+    # 副本状态由后台健康检查维护（见 replica_pool.py），这里不再逐次请求 vLLM
+    healthy = replica_pool.pool.healthy_count()
+    if replica_pool.pool.stale():
+        vllm_status = "unknown"
+    else:
+        vllm_status = "connected" if healthy else "disconnected"
     
     return {
         "proxy_server": "running",
         "vllm_server": vllm_status,
         "vllm_api_url": config.vllm_api_url,
+        "vllm_replicas": replica_pool.pool.snapshot(),
         "server_config": {
             "host": config.server_host,
             "port": config.server_port,
@@ -549,49 +512,124 @@ async def health_check():
         }
     }
 
+def cached_chat_stream(text: str, model: str):
+    """把语义缓存中的回答按 OpenAI 流式格式发送（一个内容块加结束块）"""
+    for delta, finish_reason in (({"role": "assistant", "content": text}, None), ({}, "stop")):
+        chunk = {
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        yield ("data: " + json.dumps(chunk, ensure_ascii=False) + "\n\n").encode("utf-8")
+    yield b"data: [DONE]\n\n"
+
+def collect_stream_delta(line: bytes, parts: List[str]) -> Optional[str]:
+    """从 vLLM 的一行 SSE 数据中取出增量文本追加到 parts，返回其中的 finish_reason"""
+    data = line[len(b"data:"):].strip()
+    if data == b"[DONE]":
+        return None
+    try:
+        choices = json.loads(data).get("choices") or []
+    except ValueError:
+        return None
+    if not choices:
+        return None
+    content = (choices[0].get("delta") or {}).get("content")
+    if content:
+        parts.append(content)
+    return choices[0].get("finish_reason")
+
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_response: Response = None):
     """
     接收聊天请求并转发给vLLM服务器
     
     Args:
-        request: 包含消息列表和生成参数的请求
+        request: 包含消息列表和生成参数的请求；带 session_id 时 messages 只包含本轮的新消息
         
     Returns:
         ChatResponse: 包含模型响应的响应对象
     """
+    session = None
+    if request.session_id:
+        session = session_store.store.get(request.session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"会话不存在或已过期，请重新发送完整历史: {request.session_id}")
+    elif request.new_session:
+        session = session_store.store.create(request.system_prompt)
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="messages 不能为空")
+    session_headers = {session_store.SESSION_HEADER: session.session_id} if session is not None else None
+    # simple_chat 等内部调用没有 http_response，会话 id 只在 ChatResponse.session_id 中返回
+    if session_headers and http_response is not None:
+        http_response.headers.update(session_headers)
+
     try:
+        new_messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
         # 构造发送给vLLM的payload
         payload = {
             "model": request.model,
-            "messages": [msg.dict() for msg in request.messages],
+            "messages": new_messages,
             "max_tokens": request.max_tokens,
             "temperature": request.temperature,
             "top_p": request.top_p,
             "stream": request.stream
         }
         
-        # 如果有系统提示，添加到消息列表开头
-        if request.system_prompt:
+        if session is not None:
+            # 会话中的系统提示、摘要和最近的消息在前，本轮的新消息在后
+            payload["messages"] = session.context() + new_messages
+        elif request.system_prompt:
+            # 如果有系统提示，添加到消息列表开头
             payload["messages"].insert(0, {
                 "role": "system",
                 "content": request.system_prompt
             })
+        # prompt + max_tokens 不能超出模型上下文长度，否则 vLLM 直接拒绝请求
+        payload["max_tokens"] = token_budget.fit_context(
+            request.max_tokens or config.default_max_tokens, token_budget.message_tokens(payload["messages"])
+        )
         
         headers = {
             "Content-Type": "application/json"
         }
         
         logger.info(f"转发请求到vLLM服务器: {request.model}")
-        logger.info(f"消息数量: {len(request.messages)}")
+        logger.info(f"消息数量: {len(payload['messages'])}")
+        # 同一多轮对话发往同一个副本，复用前缀缓存；会话压缩后第一条消息会变化，按会话 id 路由
+        conversation = session.session_id if session is not None else replica_pool.conversation_key(payload["messages"])
+
+        def save_turn(reply: str):
+            if session is not None:
+                session_store.store.append(session, new_messages + [{"role": "assistant", "content": reply}])
+
+        # 单轮问答可以用语义缓存中相似问题的回答（见 semantic_cache.py）；多轮对话依赖上文，不缓存
+        cache = semantic_cache.get_cache("chat")
+        question = None
+        roles = [msg.role for msg in request.messages]
+        if ((session is None or session.is_empty())
+                and roles[-1:] == ["user"] and all(role == "system" for role in roles[:-1])):
+            question = request.messages[-1].content
+            cache_context = semantic_cache.context_key(
+                request.model, json.dumps(payload["messages"][:-1], ensure_ascii=False)
+            )
+            cached = await cache.alookup(cache_context, question)
+            if cached is not None:
+                save_turn(cached[0])
+                if request.stream:
+                    return StreamingResponse(cached_chat_stream(cached[0], request.model),
+                                             media_type="text/event-stream", headers=session_headers)
+                return ChatResponse(response=cached[0], model=request.model, usage=None,
+                                    session_id=session.session_id if session is not None else None)
         
         # 发送请求到vLLM服务器
         # 根据是否流式传输，处理响应
         if request.stream:
             def generate():
+                replica = replica_pool.pool.acquire(conversation)
                 try:
                     response = requests.post(
-                        config.vllm_api_url, 
+                        replica.url, 
                         headers=headers, 
                         json=payload, 
                         timeout=config.request_timeout,
@@ -600,6 +638,9 @@ async def chat(request: ChatRequest):
                     logger.info(f"vLLM流式响应状态码: {response.status_code}")
                     response.raise_for_status() # 检查HTTP错误
 
+                    parts = []
+                    finish_reason = None
+                    collect = question is not None or session is not None
                     for line in response.iter_lines():
                         if line:
                             # Log the raw line for debugging
@@ -608,8 +649,16 @@ async def chat(request: ChatRequest):
                             # Ensure it's a data line before yielding
                             if line.startswith(b"data:"):
                                 yield line + b"\n\n" # 确保每个事件以双换行符结束
+                                if collect:
+                                    finish_reason = collect_stream_delta(line, parts) or finish_reason
                             else:
                                 logger.warning(f"接收到非SSE格式行: {line.decode('utf-8')}")
+                    # 完整生成（未被 max_tokens 截断）的回答才写入语义缓存
+                    if question is not None and finish_reason == "stop":
+                        cache.store(cache_context, question, "".join(parts))
+                    # 生成完成（包括被 max_tokens 截断）后才写入会话，出错时客户端可以重发本轮消息
+                    if finish_reason is not None:
+                        save_turn("".join(parts))
 
                 except requests.exceptions.Timeout:
                     logger.error("请求vLLM服务器超时")
@@ -619,6 +668,7 @@ async def chat(request: ChatRequest):
                     yield json.dumps({"error": f"vLLM服务器错误: {e.response.text}"}).encode('utf-8') + b"\n\n"
                 except requests.exceptions.ConnectionError as e: # Catch ConnectionError
                     logger.error(f"连接vLLM服务器时发生错误: {e}")
+                    replica_pool.pool.mark_unhealthy(replica, e)
                     yield json.dumps({"error": f"无法连接到vLLM服务器: {str(e)}"}).encode('utf-8') + b"\n\n"
                 except requests.exceptions.RequestException as e: # Catch other RequestExceptions
                     error_detail = str(e)
@@ -629,15 +679,18 @@ async def chat(request: ChatRequest):
                 except Exception as e:
                     logger.error(f"处理请求时发生未知错误: {e}")
                     yield json.dumps({"error": f"服务器内部错误: {str(e)}"}).encode('utf-8') + b"\n\n"
+                finally:
+                    replica_pool.pool.release(replica)
 
-            return StreamingResponse(generate(), media_type="text/event-stream")
+            return StreamingResponse(generate(), media_type="text/event-stream", headers=session_headers)
         else:
-            response = requests.post(
-                config.vllm_api_url, 
-                headers=headers, 
-                json=payload, 
-                timeout=config.request_timeout
-            )
+            with replica_pool.pool.lease(conversation) as vllm_url:
+                response = requests.post(
+                    vllm_url, 
+                    headers=headers, 
+                    json=payload, 
+                    timeout=config.request_timeout
+                )
             
             if response.status_code != 200:
                 logger.error(f"vLLM服务器返回错误: {response.status_code} - {response.text}")
@@ -662,11 +715,16 @@ async def chat(request: ChatRequest):
                 if "message" in choice and "content" in choice["message"]:
                     response_text = choice["message"]["content"]
                     
+                    if question is not None and choice.get("finish_reason") == "stop":
+                        await cache.astore(cache_context, question, response_text)
+                    save_turn(response_text)
+
                     # 构造响应
                     chat_response = ChatResponse(
                         response=response_text,
                         model=request.model,
-                        usage=result.get("usage")
+                        usage=result.get("usage"),
+                        session_id=session.session_id if session is not None else None
                     )
                     
                     logger.info(f"成功生成响应，长度: {len(response_text)}")
@@ -701,6 +759,25 @@ async def chat(request: ChatRequest):
             detail=f"服务器内部错误: {str(e)}"
         )
 
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """会话的系统提示、早期对话的摘要和最近的消息"""
+    session = session_store.store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {session_id}")
+    return dict(session.to_dict(include_tokens=False), history_tokens=session.history_tokens())
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not session_store.store.delete(session_id):
+        raise HTTPException(status_code=404, detail=f"会话不存在或已过期: {session_id}")
+    return {"status": "success", "session_id": session_id}
+
+@app.get("/session_stats")
+async def session_stats():
+    """会话存储的统计：内存中/磁盘上的会话数、淘汰、读回和压缩次数"""
+    return session_store.store.stats()
+
 @app.post("/simple_chat")
 async def simple_chat(prompt: str, model: str = config.default_model, max_tokens: int = config.default_max_tokens):
     """
@@ -733,7 +810,7 @@ async def simple_chat(prompt: str, model: str = config.default_model, max_tokens
     }
 
 @app.post("/summarize_tongyi")
-async def summarize_with_tongyi(req: TongyiSummaryRequest):
+async def summarize_with_tongyi(req: TongyiSummaryRequest, http_request: Request):
     """
     使用通义千问模型总结文本
     
@@ -743,26 +820,69 @@ async def summarize_with_tongyi(req: TongyiSummaryRequest):
     Returns:
         包含总结结果的响应对象
     """
-    def generate_summary_stream():
-        for chunk in tongyi_chat_embedded(
-            messages=req.text,
-            temperature=req.temperature,
-            max_tokens=req.max_tokens,
-            presence_penalty=req.presence_penalty,
-            top_p=req.top_p
-        ):
-            if chunk.get("type") == "content":
+    messages = [
+        {"role": "system", "content": TONGYI_SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": req.text}
+    ]
+
+    params = {
+        "temperature": req.temperature,
+        "max_tokens": req.max_tokens,
+        "presence_penalty": req.presence_penalty,
+        "top_p": req.top_p
+    }
+    # 同时到达的相同总结请求共享一次上游生成（见 coalescer.py）
+    key = coalescer.request_key("summarize", text=req.text, **params)
+
+    async def generate_summary_stream():
+        # 默认发往通义千问，不可用时切换到本地 vLLM（见 llm_router.routes.summarize）
+        deltas = coalescer.stream(
+            "summarize", key, lambda: llm_router.stream_chat("summarize", dict(params, messages=messages))
+        )
+        try:
+            async for content in deltas:
+                if await http_request.is_disconnected():
+                    # 客户端已断开：关闭上游连接，不再继续生成
+                    logger.info("客户端已断开，停止通义千问流式总结")
+                    return
                 # 将内容封装为SSE格式的JSON
-                yield ("data: " + json.dumps({"summary": chunk.get("content", "")}) + "\n\n").encode('utf-8')
-            elif chunk.get("type") == "error":
-                logger.error("通义千问流式总结错误: {}".format(chunk.get('content')))
-                # 将错误信息封装为SSE格式的JSON
-                yield ("data: " + json.dumps({"error": chunk.get("content", "未知错误")}) + "\n\n").encode('utf-8')
+                yield ("data: " + json.dumps({"summary": content}) + "\n\n").encode('utf-8')
+        except Exception as e:
+            logger.error(f"通义千问流式总结错误: {e}")
+            # 将错误信息封装为SSE格式的JSON
+            yield ("data: " + json.dumps({"error": f"通义千问API调用错误: {e}"}) + "\n\n").encode('utf-8')
+        finally:
+            await deltas.aclose()
         # 发送结束标记
         yield b"data: [DONE]\n\n"
-    
+
     return StreamingResponse(generate_summary_stream(), media_type="text/event-stream")
 
+@app.get("/llm_backends")
+async def llm_backends():
+    """各后端的健康状态、错误率和延迟统计，以及各接口的路由配置"""
+    return llm_router.stats()
+
+@app.get("/club_crawler_stats")
+async def club_crawler_stats():
+    """社团信息抓取的进度（正在进行时）与最近一次抓取的指标"""
+    return club_crawler.stats()
+
+@app.get("/coalescing_stats")
+async def coalescing_stats():
+    """相同并发请求的合并情况：各接口的请求数、实际生成次数和被合并的请求数"""
+    return coalescer.stats()
+
+@app.get("/semantic_cache_stats")
+async def semantic_cache_stats():
+    """语义缓存各接口的条目数、命中率和命中时的相似度"""
+    return semantic_cache.stats()
+
+@app.get("/tongyi_stats")
+async def tongyi_stats():
+    """通义千问流式请求的首 token 延迟、输出速度和结果统计"""
+    return tongyi_client.stats()
+
 @app.post("/content", response_model=ContentGenerationResponse)
 async def generate_content(request: ContentGenerationRequest):
     """
@@ -775,36 +895,23 @@ async def generate_content(request: ContentGenerationRequest):
         ContentGenerationResponse: 包含生成的文本。
     """
     try:
-        base_prompt = """你是一位文案创作大师，擅长运用多种文体风格进行改写。请根据我提供的原始文案{content}，将其以一种不同的、具有鲜明{style}特征的文体进行改写，并确保每种改写后的内容都达到{expection}的效果。"""
-        
-        # 格式化Prompt
-        full_prompt = base_prompt.format(
-            content=request.content,
-            style=request.style,
-            expection=request.expection
-        )
-        
-        logger.info(f"生成的AI内容Prompt: {full_prompt[:200]}...") # 增加日志长度
-
-        generated_text = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一位文案创作大师，擅长运用多种文体风格进行改写。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed for content length
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
+        template = prompt_registry.get("content")
+        messages, max_tokens = token_budget.prepare(
+            template, truncate=("content",), content=request.content, style=request.style, expection=request.expection
         )
+        logger.info(f"生成的AI内容Prompt: {messages[-1]['content'][:200]}...")
 
-        chat_response = await chat(chat_request) # Call the local chat function
+        payload = {
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "top_p": 0.95
+        }
+        with template.timed():
+            result = await llm_router.chat_completion(template.name, payload)
+        token_budget.record(template.name, result.get("usage"), max_tokens)
 
-        generated_text = chat_response.response
+        generated_text = llm_router.message_content(result)
 
         if not generated_text.strip():
             raise ValueError("AI未返回有效的生成内容。")
@@ -826,36 +933,23 @@ async def generate_content(request: ContentGenerationRequest):
         ContentGenerationResponse: 包含生成的文本。
     """
     try:
-        base_prompt = """你是一位文案创作大师，擅长运用多种文体风格进行改写。请根据我提供的原始文案{content}，将其以一种不同的、具有鲜明{style}特征的文体进行改写，并确保每种改写后的内容都能对{target_people}产生吸引力。"""
-        
-        # 格式化Prompt
-        full_prompt = base_prompt.format(
-            content=request.content,
-            style=request.style,
-            target_people=request.target_people
-        )
-        
-        logger.info(f"生成的AI内容Prompt: {full_prompt[:200]}...") # 增加日志长度
-
-        generated_text = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一位文案创作大师，擅长运用多种文体风格进行改写。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed for content length
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
+        template = prompt_registry.get("introduction")
+        messages, max_tokens = token_budget.prepare(
+            template, truncate=("content",), content=request.content, style=request.style, target_people=request.target_people
         )
+        logger.info(f"生成的AI内容Prompt: {messages[-1]['content'][:200]}...")
 
-        chat_response = await chat(chat_request) # Call the local chat function
+        payload = {
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "top_p": 0.95
+        }
+        with template.timed():
+            result = await llm_router.chat_completion(template.name, payload)
+        token_budget.record(template.name, result.get("usage"), max_tokens)
 
-        generated_text = chat_response.response
+        generated_text = llm_router.message_content(result)
 
         if not generated_text.strip():
             raise ValueError("AI未返回有效的生成内容。")
@@ -878,34 +972,23 @@ async def generate_content(request: SloganGenerationRequest):
         ContentGenerationResponse: 包含生成的文本。
     """
     try:
-        base_prompt = """你擅长写宣传口号：1.简短有力；2.突出亮点；3.引发共鸣。 现在你需要根据以下需求写宣传口号：${theme}。"""
-        
-        # 格式化Prompt
-        full_prompt = base_prompt.format(
-            theme=request.theme
-        )
-        
-        logger.info(f"生成的AI内容Prompt: {full_prompt[:200]}...") # 增加日志长度
-
-        generated_text = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你擅长写宣传口号：1.简短有力；2.突出亮点；3.引发共鸣。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed for slogan length
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
+        template = prompt_registry.get("slogan")
+        messages, max_tokens = token_budget.prepare(
+            template, truncate=("theme",), theme=request.theme
         )
+        logger.info(f"生成的AI内容Prompt: {messages[-1]['content'][:200]}...")
 
-        chat_response = await chat(chat_request) # Call the local chat function
+        payload = {
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "top_p": 0.95
+        }
+        with template.timed():
+            result = await llm_router.chat_completion(template.name, payload)
+        token_budget.record(template.name, result.get("usage"), max_tokens)
 
-        generated_text = chat_response.response
+        generated_text = llm_router.message_content(result)
 
         if not generated_text.strip():
             raise ValueError("AI未返回有效的生成内容。")
@@ -919,38 +1002,26 @@ async def generate_content(request: SloganGenerationRequest):
 @app.get("/models")
 async def list_models():
     """
-    获取可用的模型列表（从vLLM服务器）
+    获取可用的模型列表（后台健康检查缓存的 vLLM /v1/models 结果）
     """
-    try:
-        models_url = config.vllm_api_url.replace("/v1/chat/completions", "/v1/models")
-        response = requests.get(models_url, timeout=10)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.warning(f"无法获取模型列表: {response.status_code}")
-            return {
-                "data": [
-                    {
-                        "id": config.default_model,
-                        "object": "model",
-                        "created": 0,
-                        "owned_by": "vllm"
-                    }
-                ]
+    models = replica_pool.pool.models()
+    if models is None:
+        # 还没有成功读取过模型列表（刚启动或所有副本不可用）
+        models = [
+            {
+                "id": config.default_model,
+                "object": "model",
+                "created": 0,
+                "owned_by": "vllm"
             }
-    except Exception as e:
-        logger.warning(f"获取模型列表时发生错误: {e}")
-        return {
-            "data": [
-                {
-                    "id": config.default_model,
-                    "object": "model",
-                    "created": 0,
-                    "owned_by": "vllm"
-                }
-            ]
-        }
+        ]
+    return {
+        "object": "list",
+        "data": models,
+        "cached": True,
+        "last_check_age_s": replica_pool.pool.last_check_age(),
+        "stale": replica_pool.pool.stale()
+    }
 
 @app.get("/config")
 async def get_config():
@@ -986,11 +1057,25 @@ async def reload_config_endpoint():
     try:
         config.reload()
         logger.info("配置文件已成功重载")
+        prompt_errors = await asyncio.to_thread(prompt_registry.reload)
+        if prompt_errors:
+            return {"message": "配置文件已重载，部分prompt模板加载失败（沿用旧版本）", "status": "partial",
+                    "prompt_errors": prompt_errors}
         return {"message": "配置文件已成功重载", "status": "success"}
     except Exception as e:
         logger.error(f"重载配置文件失败: {e}")
         raise HTTPException(status_code=500, detail=f"重载配置文件失败: {e}")
 
+@app.get("/prompt_stats")
+async def prompt_stats():
+    """各 prompt 模板的 token 数（固定部分/变量部分）与调用耗时统计"""
+    return prompt_registry.stats()
+
+@app.get("/token_budget_stats")
+async def token_budget_stats():
+    """各接口的输出长度分布与当前使用的 max_tokens"""
+    return token_budget.stats()
+
 @app.post("/screen_application", response_model=ApplicationScreeningResponse)
 async def screen_application(request: ApplicationScreeningRequest):
     """
@@ -1003,79 +1088,29 @@ async def screen_application(request: ApplicationScreeningRequest):
         ApplicationScreeningResponse: 包含AI生成的摘要和建议。
     """
     try:
-        # 构建详细的LLM提示
-        prompt_template = """
-你是一个智能社团申请筛选助手，你的任务是根据申请者的资料和社团的招新要求，对申请进行评估，并生成简洁的摘要和明确的建议。
-
-请按照以下JSON格式返回结果：
-{{
-  "summary": "[AI生成的申请摘要]",
-  "suggestion": "[AI生成的建议]"
-}}
-
---- 申请信息 ---
-申请者资料: {applicant_data}
-申请理由: {application_reason}
---- 社团名称 ---
-{club_name}
-
---- 社团特质 ---
-{required_conditions_str}
-
-请开始评估并生成摘要和建议。
-"""
-        
         required_conditions_str = "\n".join([f"- {cond}" for cond in request.required_conditions])
 
-        full_prompt = prompt_template.format(
-            applicant_data=json.dumps(request.applicant_data, ensure_ascii=False, indent=2),
+        # 固定指令在前、请求数据在后，便于 vLLM 复用前缀缓存
+        template = prompt_registry.get("screen_application")
+        messages, max_tokens = token_budget.prepare(
+            template, truncate=("application_reason", "applicant_data"),
+            applicant_data=json.dumps(request.applicant_data, ensure_ascii=False),
             application_reason=request.application_reason,
             required_conditions_str=required_conditions_str,
             club_name=request.club_name
         )
-        
-        logger.info(f"AI申请筛选Prompt: {full_prompt[:200]}...") # 增加日志长度
-
-        llm_response_content = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一个智能社团申请筛选助手，你的任务是根据申请者的资料和社团的招新要求，对申请进行评估，并生成简洁的摘要和明确的建议。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
-        )
-
-        chat_response = await chat(chat_request) # Call the local chat function
-
-        llm_response_content = chat_response.response
+        logger.info(f"AI申请筛选Prompt: {messages[-1]['content'][:200]}...")
 
-        if not llm_response_content.strip():
-            raise ValueError("AI未返回有效的响应内容。")
-
-        # 尝试解析LLM的JSON响应，先移除可能的markdown代码块
-        json_string = llm_response_content.strip()
-        if json_string.startswith("```json") and json_string.endswith("```"):
-            json_string = json_string[len("```json"): -len("```")].strip()
-        
-        try:
-            parsed_response = json.loads(json_string)
-            summary = parsed_response.get("summary", "")
-            suggestion = parsed_response.get("suggestion", "")
-            
-            if not summary or not suggestion:
+        def check(result: ApplicationScreeningResponse):
+            if not result.summary.strip() or not result.suggestion.strip():
                 raise ValueError("AI返回的JSON格式不完整，缺少summary或suggestion字段。")
 
-            return ApplicationScreeningResponse(summary=summary.strip(), suggestion=suggestion.strip())
-        except json.JSONDecodeError:
-            logger.error(f"AI响应不是有效的JSON: {llm_response_content}")
-            raise ValueError(f"AI返回的响应格式错误，无法解析为JSON: {llm_response_content[:100]}...")
+        with template.timed():
+            result = await generate_structured(
+                ApplicationScreeningResponse, messages, max_tokens=max_tokens, check=check,
+                endpoint=template.name, on_usage=token_budget.recorder(template.name, max_tokens)
+            )
+        return ApplicationScreeningResponse(summary=result.summary.strip(), suggestion=result.suggestion.strip())
             
     except Exception as e:
         logger.error(f"AI申请筛选失败: {e}")
@@ -1093,71 +1128,28 @@ async def club_atmosphere(request: ClubAtmosphereRequest):
         ClubAtmosphereResponse: 包含AI生成的氛围标签和文化摘要。
     """
     try:
-        # 构建LLM提示
-        prompt_template = """
-你是一个社团氛围透视镜AI，你的任务是根据社团内部的交流内容，分析其情感和主题，并生成社团的"氛围标签"和一段"文化摘要"。
-在保护隐私的前提下，请不要提及具体的人名，只关注整体氛围和趋势。
-
-请按照以下JSON格式返回结果：
-{{
-  "atmosphere_tags": ["标签1", "标签2", "标签3"],
-  "culture_summary": "[AI生成的文化摘要]"
-}}
-
---- 社团交流内容 ---
-{communication_content}
-
-请开始分析并生成氛围标签和文化摘要。
-"""
-        
-        full_prompt = prompt_template.format(
+        template = prompt_registry.get("club_atmosphere")
+        messages, max_tokens = token_budget.prepare(
+            template, truncate=("communication_content",),
             communication_content=request.communication_content
         )
-        
-        logger.info(f"AI社团氛围透视Prompt: {full_prompt[:200]}...") # 增加日志长度
-
-        llm_response_content = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一个社团氛围透视镜AI，你的任务是根据社团内部的交流内容，分析其情感和主题，并生成社团的\"氛围标签\"和一段\"文化摘要\"."),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
-        )
-
-        chat_response = await chat(chat_request) # Call the local chat function
-
-        llm_response_content = chat_response.response
-
-        if not llm_response_content.strip():
-            raise ValueError("AI未返回有效的响应内容。")
+        logger.info(f"AI社团氛围透视Prompt: {messages[-1]['content'][:200]}...")
 
-        # 尝试解析LLM的JSON响应，先移除可能的markdown代码块
-        json_string = llm_response_content.strip()
-        if json_string.startswith("```json") and json_string.endswith("```"):
-            json_string = json_string[len("```json"): -len("```")].strip()
-        
-        try:
-            parsed_response = json.loads(json_string)
-            atmosphere_tags = parsed_response.get("atmosphere_tags", [])
-            culture_summary = parsed_response.get("culture_summary", "")
-            
-            if not isinstance(atmosphere_tags, list) or not all(isinstance(tag, str) for tag in atmosphere_tags):
-                raise ValueError("AI返回的atmosphere_tags格式不正确，应为字符串列表。")
-            if not culture_summary:
+        def check(result: ClubAtmosphereResponse):
+            if not result.culture_summary.strip():
                 raise ValueError("AI返回的JSON格式不完整，缺少culture_summary字段。")
 
-            return ClubAtmosphereResponse(atmosphere_tags=atmosphere_tags, culture_summary=culture_summary.strip())
-        except json.JSONDecodeError:
-            logger.error(f"AI响应不是有效的JSON: {llm_response_content}")
-            raise ValueError(f"AI返回的响应格式错误，无法解析为JSON: {llm_response_content[:100]}...")
+        async def generate():
+            with template.timed():
+                return await generate_structured(
+                    ClubAtmosphereResponse, messages, max_tokens=max_tokens, check=check,
+                    endpoint=template.name, on_usage=token_budget.recorder(template.name, max_tokens)
+                )
+
+        # 同时到达的相同请求共享一次生成（见 coalescer.py）
+        key = coalescer.request_key(template.name, communication_content=request.communication_content)
+        result = await coalescer.call(template.name, key, generate)
+        return ClubAtmosphereResponse(atmosphere_tags=result.atmosphere_tags, culture_summary=result.culture_summary.strip())
             
     except Exception as e:
         logger.error(f"AI社团氛围透视失败: {e}")
@@ -1175,90 +1167,25 @@ async def plan_event(request: EventPlanningRequest):
         EventPlanningResponse: 包含AI生成的策划清单、预算估算、风险评估和创意点子。
     """
     try:
-        # 构建LLM提示
-        prompt_template = """
-你是一个智能活动策划参谋AI，你的任务是根据用户提供的活动想法，生成一份详尽的策划框架。
-这份框架应包括待办事项清单、预算智能估算、风险评估与预案，以及创意点子推荐。
-
-请按照以下JSON格式返回结果：
-{{
-  "checklist": [
-    "[待办事项1]",
-    "[待办事项2]",
-    "..."
-  ],
-  "budget_estimate": "[预算估算描述]",
-  "risk_assessment": "[风险评估与预案描述]",
-  "creative_ideas": [
-    "[创意点子1]",
-    "[创意点子2]",
-    "..."
-  ]
-}}
-
---- 活动想法 ---
-{event_idea}
-
-请开始生成活动策划框架。
-"""
-        
-        full_prompt = prompt_template.format(
-            event_idea=request.event_idea
-        )
-        
-        logger.info(f"AI活动策划Prompt: {full_prompt[:200]}...")
-
-        llm_response_content = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一个智能活动策划参谋AI，你的任务是根据用户提供的活动想法，生成一份详尽的策划框架。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
-        )
-
-        chat_response = await chat(chat_request) # Call the local chat function
+        template = prompt_registry.get("plan_event")
+        messages, max_tokens = token_budget.prepare(template, truncate=("event_idea",), event_idea=request.event_idea)
+        logger.info(f"AI活动策划Prompt: {messages[-1]['content'][:200]}...")
 
-        llm_response_content = chat_response.response
-
-        if not llm_response_content.strip():
-            raise ValueError("AI未返回有效的响应内容。")
-
-        # 尝试解析LLM的JSON响应，先移除可能的markdown代码块
-        json_string = llm_response_content.strip()
-        if json_string.startswith("```json") and json_string.endswith("```"):
-            json_string = json_string[len("```json"): -len("```")].strip()
-        
-        try:
-            parsed_response = json.loads(json_string)
-            checklist = parsed_response.get("checklist", [])
-            budget_estimate = parsed_response.get("budget_estimate", "")
-            risk_assessment = parsed_response.get("risk_assessment", "")
-            creative_ideas = parsed_response.get("creative_ideas", [])
-            
-            if not isinstance(checklist, list) or not all(isinstance(item, str) for item in checklist):
-                raise ValueError("AI返回的checklist格式不正确，应为字符串列表。")
-            if not budget_estimate or not risk_assessment:
+        def check(result: EventPlanningResponse):
+            if not result.budget_estimate.strip() or not result.risk_assessment.strip():
                 raise ValueError("AI返回的JSON格式不完整，缺少budget_estimate或risk_assessment字段。")
-            if not isinstance(creative_ideas, list) or not all(isinstance(item, str) for item in creative_ideas):
-                raise ValueError("AI返回的creative_ideas格式不正确，应为字符串列表。")
-
-            return EventPlanningResponse(
-                checklist=checklist,
-                budget_estimate=budget_estimate.strip(),
-                risk_assessment=risk_assessment.strip(),
-                creative_ideas=creative_ideas
+
+        with template.timed():
+            result = await generate_structured(
+                EventPlanningResponse, messages, max_tokens=max_tokens, check=check,
+                endpoint=template.name, on_usage=token_budget.recorder(template.name, max_tokens)
             )
-        except json.JSONDecodeError:
-            logger.error(f"AI响应不是有效的JSON: {llm_response_content}")
-            raise ValueError(f"AI返回的响应格式错误，无法解析为JSON: {llm_response_content[:100]}...")
+        return EventPlanningResponse(
+            checklist=result.checklist,
+            budget_estimate=result.budget_estimate.strip(),
+            risk_assessment=result.risk_assessment.strip(),
+            creative_ideas=result.creative_ideas
+        )
             
     except Exception as e:
         logger.error(f"AI活动策划失败: {e}")
@@ -1277,109 +1204,44 @@ async def financial_bookkeeping(request: FinancialBookkeepingRequest):
         FinancialBookkeepingResponse: 包含AI解析出的财务条目和确认信息。
     """
     try:
-        # 构造发送给vLLM的payload
-        prompt_template = """
-你是一个智能财务助理，你的任务是根据用户输入的自然语言描述，解析出财务支出或收入的详细信息，并生成结构化的记账条目和友好的确认信息。
-
-请优先解析以下信息：
-- **物品/服务 (item)**: 具体购买或涉及的物品或服务。
-- **金额 (amount)**: 具体的金额，应为数字。
-- **类别 (category)**: 支出或收入的类别（如餐饮、交通、物资、办公、活动、报销等）。如果无法明确分类，请使用"未分类"。
-- **经手人/报销人 (payer)**: 涉及的经手人或需要报销的人名。
-- **日期 (date)**: 如果描述中包含日期信息，请解析出来。
-- **备注 (remark)**: 任何其他相关信息。
-
-请按照以下JSON格式返回结果：
-{{
-  "parsed_entries": [
-    {{
-      "item": "[物品/服务描述]",
-      "amount": [金额，浮点数],
-      "category": "[类别，默认为"未分类"]",
-      "payer": "[经手人/报销人，如果没有则为null]",
-      "date": "[日期，例如"今天"、"昨天"、"2023-10-26"，如果没有则为null]",
-      "remark": "[备注信息，如果没有则为null]"
-    }},
-    // 如果有多个条目，可以继续添加
-  ],
-  "confirmation_message": "[AI生成的确认信息或总结，例如"好的，已为您记录…"、"本次消费明细如下:…"。用友好的语气，总结记账内容，以便用户确认。]"
-}}
-
---- 用户输入 ---
-{natural_language_input}
-
-请开始解析并生成财务条目和确认信息。
-"""
-        
-        full_prompt = prompt_template.format(
+        template = prompt_registry.get("financial_bookkeeping")
+        messages, max_tokens = token_budget.prepare(
+            template, truncate=("natural_language_input",),
             natural_language_input=request.natural_language_input
         )
-        
-        logger.info(f"AI财务记账Prompt: {full_prompt[:200]}...")
-
-        llm_response_content = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一个智能财务助理，你的任务是根据用户输入的自然语言描述，解析出财务支出或收入的详细信息，并生成结构化的记账条目和友好的确认信息。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
-        )
-
-        chat_response = await chat(chat_request) # Call the local chat function
-
-        llm_response_content = chat_response.response
-
-        if not llm_response_content.strip():
-            raise ValueError("AI未返回有效的响应内容。")
-
-        # 尝试解析LLM的JSON响应，先移除可能的markdown代码块
-        json_string = llm_response_content.strip()
-        if json_string.startswith("```json") and json_string.endswith("```"):
-            json_string = json_string[len("```json"): -len("```")].strip()
-        
-        try:
-            parsed_response = json.loads(json_string)
-            parsed_entries_data = parsed_response.get("parsed_entries", [])
-            confirmation_message = parsed_response.get("confirmation_message", "")
+        logger.info(f"AI财务记账Prompt: {messages[-1]['content'][:200]}...")
 
-            # 验证 parsed_entries_data 中的每个条目是否符合 FinancialEntry 模型
-            parsed_entries = []
-            for entry_data in parsed_entries_data:
-                try:
-                    entry = FinancialEntry(**entry_data)
-                    parsed_entries.append(entry)
-                except Exception as e:
-                    logger.warning(f"解析单个财务条目时出错: {entry_data}, 错误: {e}")
-                    # 如果单个条目解析失败，可以跳过或记录错误，这里选择跳过不完整的条目
-            
-            if not confirmation_message:
+        def check(result: FinancialBookkeepingOutput):
+            if not result.confirmation_message.strip():
                 raise ValueError("AI返回的JSON格式不完整，缺少confirmation_message字段。")
 
-            # 将新解析的条目保存到文件，按社团名称存储
-            all_clubs_data = load_financial_data()
-            if request.club_name not in all_clubs_data:
-                all_clubs_data[request.club_name] = {"entries": [], "budget": {}} # Initialize with empty budget
+        with template.timed():
+            result = await generate_structured(
+                FinancialBookkeepingOutput, messages, max_tokens=max_tokens, check=check,
+                endpoint=template.name, on_usage=token_budget.recorder(template.name, max_tokens)
+            )
+        # 逐个校验条目，跳过不完整的条目
+        parsed_entries = []
+        for entry_data in result.parsed_entries:
+            try:
+                parsed_entries.append(FinancialEntry(**entry_data))
+            except Exception as e:
+                logger.warning(f"解析单个财务条目时出错: {entry_data}, 错误: {e}")
+
+        # 将新解析的条目保存到文件，按社团名称存储
+        all_clubs_data = load_financial_data()
+        if request.club_name not in all_clubs_data:
+            all_clubs_data[request.club_name] = {"entries": [], "budget": {}} # Initialize with empty budget
 
-            for entry in parsed_entries:
-                all_clubs_data[request.club_name]["entries"].append(entry.dict())
-            save_financial_data(all_clubs_data)
+        for entry in parsed_entries:
+            all_clubs_data[request.club_name]["entries"].append(entry.dict())
+        save_financial_data(all_clubs_data)
 
-            return FinancialBookkeepingResponse(
-                parsed_entries=parsed_entries,
-                confirmation_message=confirmation_message.strip(),
-                original_input=request.natural_language_input
-            )
-        except json.JSONDecodeError:
-            logger.error(f"AI响应不是有效的JSON: {llm_response_content}")
-            raise ValueError(f"AI返回的响应格式错误，无法解析为JSON: {llm_response_content[:100]}...")
+        return FinancialBookkeepingResponse(
+            parsed_entries=parsed_entries,
+            confirmation_message=result.confirmation_message.strip(),
+            original_input=request.natural_language_input
+        )
             
     except Exception as e:
         logger.error(f"AI财务记账失败: {e}")
@@ -1414,82 +1276,24 @@ async def generate_financial_report(request: FinancialReportRequest):
             for entry in entries_to_report
         ])
 
-        prompt_template = """
-你是一个智能财务报表生成助手，你的任务是根据用户提供的财务流水，生成一份清晰、专业的财务报表总结，并详细列出各项支出和收入的分类汇总。请注意，这里主要是支出，如果出现收入字样可以进行分类。
-
-请**直接**按照以下JSON格式返回结果，**不要包含任何Markdown代码块或其他文本**：
-{{
-  "report_summary": "[AI生成的财务报表总结，包括总支出、可能存在的总收入、主要支出类别等，用友好的语言描述。]",
-  "expense_breakdown": {{
-    "[类别1]": [金额],
-    "[类别2]": [金额],
-    "...",
-    "总支出": [总支出金额]
-  }},
-  "income_breakdown": {{
-    "[收入类别1]": [金额],
-    "...",
-    "总收入": [总收入金额]
-  }}
-}}
-
---- 财务流水 ---
-{financial_entries_str}
-
-请开始分析并生成财务报表。
-"""
-
-        full_prompt = prompt_template.format(
-            financial_entries_str=entries_str
-        )
-
-        logger.info(f"AI财务报表Prompt: {full_prompt[:200]}...")
-
-        llm_response_content = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一个智能财务报表生成助手，你的任务是根据用户提供的财务流水，生成一份清晰、专业的财务报表总结，并详细列出各项支出和收入的分类汇总。请注意，这里主要是支出，如果出现收入字样可以进行分类。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
-        )
-
-        chat_response = await chat(chat_request) # Call the local chat function
-
-        llm_response_content = chat_response.response
+        template = prompt_registry.get("financial_report")
+        messages, max_tokens = token_budget.prepare(template, truncate=("financial_entries_str",), financial_entries_str=entries_str)
+        logger.info(f"AI财务报表Prompt: {messages[-1]['content'][:200]}...")
 
-        if not llm_response_content.strip():
-            raise ValueError("AI未返回有效的响应内容。")
-
-        # 尝试解析LLM的JSON响应，先移除可能的markdown代码块
-        json_string = llm_response_content.strip()
-        if json_string.startswith("```json") and json_string.endswith("```"):
-            json_string = json_string[len("```json"): -len("```")].strip()
-
-        try:
-            parsed_response = json.loads(json_string)
-            report_summary = parsed_response.get("report_summary", "")
-            expense_breakdown = parsed_response.get("expense_breakdown", {})
-            income_breakdown = parsed_response.get("income_breakdown", {})
-
-            if not report_summary or not isinstance(expense_breakdown, dict) or not isinstance(income_breakdown, dict):
+        def check(result: FinancialReportResponse):
+            if not result.report_summary.strip():
                 raise ValueError("AI返回的JSON格式不完整或字段类型不正确。")
 
-            return FinancialReportResponse(
-                report_summary=report_summary.strip(),
-                expense_breakdown=expense_breakdown,
-                income_breakdown=income_breakdown
+        with template.timed():
+            result = await generate_structured(
+                FinancialReportResponse, messages, max_tokens=max_tokens, check=check,
+                endpoint=template.name, on_usage=token_budget.recorder(template.name, max_tokens)
             )
-        except json.JSONDecodeError:
-            logger.error(f"AI响应不是有效的JSON: {llm_response_content}")
-            raise ValueError(f"AI返回的响应格式错误，无法解析为JSON: {llm_response_content[:100]}...")
+        return FinancialReportResponse(
+            report_summary=result.report_summary.strip(),
+            expense_breakdown=result.expense_breakdown,
+            income_breakdown=result.income_breakdown
+        )
             
     except HTTPException as http_exc: # Re-raise HTTPException directly
         raise http_exc
@@ -1537,30 +1341,11 @@ async def budget_warning(request: BudgetWarningRequest):
         percentage_used = (request.current_spending / effective_budget_limit) * 100
         is_over_budget = request.current_spending > effective_budget_limit
 
-        prompt_template = """
-你是一个预算管理助手，你的任务是根据当前的支出和预算限额，判断是否超支，并生成一个友好的预警信息。如果用户提供了描述信息，请在预警信息中提及。
-
-请按照以下JSON格式返回结果：
-{{
-  "warning_message": "[AI生成的预警信息，例如"您好，[活动名称]的支出已接近预算上限，请注意控制。"或"恭喜，[活动名称]的支出仍在预算范围内！"]]",
-  "is_over_budget": [true/false],
-  "percentage_used": [预算使用百分比，浮点数，例如95.5]
-}}
-
---- 预算信息 ---
-当前已支出金额: {current_spending:.2f}元
-预算总额: {budget_limit:.2f}元
-预算使用百分比: {percentage_used:.2f}%
-是否超预算: {is_over_budget}
-社团名称: {club_name}
-{description_str}
-
-请开始生成预警信息。
-"""
-
         description_str = f"描述: {request.description}" if request.description else ""
 
-        full_prompt = prompt_template.format(
+        template = prompt_registry.get("budget_warning")
+        messages, max_tokens = token_budget.prepare(
+            template,
             current_spending=request.current_spending,
             budget_limit=effective_budget_limit,
             percentage_used=percentage_used,
@@ -1568,55 +1353,24 @@ async def budget_warning(request: BudgetWarningRequest):
             club_name=request.club_name,
             description_str=description_str
         )
+        logger.info(f"AI预算预警Prompt: {messages[-1]['content'][:200]}...")
 
-        logger.info(f"AI预算预警Prompt: {full_prompt[:200]}...")
-
-        llm_response_content = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一个预算管理助手，你的任务是根据当前的支出和预算限额，判断是否超支，并生成一个友好的预警信息。如果用户提供了描述信息，请在预警信息中提及。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
-        )
-
-        chat_response = await chat(chat_request) # Call the local chat function
-
-        llm_response_content = chat_response.response
-
-        if not llm_response_content.strip():
-            raise ValueError("AI未返回有效的响应内容。")
-
-        json_string = llm_response_content.strip()
-        if json_string.startswith("```json") and json_string.endswith("```"):
-            json_string = json_string[len("```json"): -len("```")].strip()
-
-        try:
-            parsed_response = json.loads(json_string)
-            warning_message = parsed_response.get("warning_message", "")
-            is_over_budget_from_ai = parsed_response.get("is_over_budget", False)
-            percentage_used_from_ai = parsed_response.get("percentage_used", 0.0)
-
-            if not warning_message or not isinstance(is_over_budget_from_ai, bool) or not isinstance(percentage_used_from_ai, (float, int)):
+        def check(result: BudgetWarningOutput):
+            if not result.warning_message.strip():
                 raise ValueError("AI返回的JSON格式不完整或字段类型不正确。")
 
-            return BudgetWarningResponse(
-                warning_message=warning_message.strip(),
-                is_over_budget=is_over_budget_from_ai,
-                percentage_used=percentage_used_from_ai,
-                club_budget_limit=club_budget_limit,
-                club_budget_description=club_budget_description
+        with template.timed():
+            result = await generate_structured(
+                BudgetWarningOutput, messages, max_tokens=max_tokens, check=check,
+                endpoint=template.name, on_usage=token_budget.recorder(template.name, max_tokens)
             )
-        except json.JSONDecodeError:
-            logger.error(f"AI响应不是有效的JSON: {llm_response_content}")
-            raise ValueError(f"AI返回的响应格式错误，无法解析为JSON: {llm_response_content[:100]}...")
+        return BudgetWarningResponse(
+            warning_message=result.warning_message.strip(),
+            is_over_budget=result.is_over_budget,
+            percentage_used=result.percentage_used,
+            club_budget_limit=club_budget_limit,
+            club_budget_description=club_budget_description
+        )
 
     except HTTPException as http_exc: # Re-raise HTTPException directly
         raise http_exc
@@ -1663,75 +1417,123 @@ async def update_budget(request: UpdateBudgetRequest):
         raise HTTPException(status_code=500, detail=f"AI修改预算失败: {e}")
 
 LOCAL_SYNCED_DATA_FILE = os.path.join(current_dir, '..', 'data', 'local_synced_data.jsonl')
+sys.path.append(os.path.join(current_dir, '..', 'data'))
+# 轮转文件的命名与顺序以同步进程的写入器为准
+from jsonl_writer import iter_segment_files
 
-def load_local_synced_data() -> Dict[str, Any]:
+from compactor import latest_records
+
+try:
+    from segment_store import SegmentReader, sync_segment_dir
+    # 同步进程写出的二进制分段存储（见 data/segment_store.py），与同步进程使用同一个 LOCAL_SEGMENT_DIR 设置
+    LOCAL_SYNCED_SEGMENT_DIR = sync_segment_dir()
+except ImportError:
+    SegmentReader = None
+    LOCAL_SYNCED_SEGMENT_DIR = None
+
+def iter_local_synced_lines():
     """
-    从 local_synced_data.jsonl 文件加载社团和帖子信息。
-    将帖子归类到对应的社团下。
+    按写入顺序逐行读取同步数据：先读同步进程轮转出去的分段文件
+    (local_synced_data.jsonl.1, .2, ...)，最后读当前文件。
     """
-    clubs_data = {}
-    
-    if not os.path.exists(LOCAL_SYNCED_DATA_FILE):
-        logger.warning(f"本地同步数据文件不存在: {LOCAL_SYNCED_DATA_FILE}")
+    for path in iter_segment_files(LOCAL_SYNCED_DATA_FILE):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield line
+
+def iter_local_synced_entries():
+    """
+    返回每个文档的最新有效版本，已删除的文档不返回（与压缩后的结果一致，不依赖压缩是否已经执行）。
+    分段存储可用时通过 mmap 读取，只解码 dynamic:: 记录；否则逐行解析 JSONL。
+    """
+    if SegmentReader is not None and LOCAL_SYNCED_SEGMENT_DIR and os.path.isdir(LOCAL_SYNCED_SEGMENT_DIR):
+        with SegmentReader(LOCAL_SYNCED_SEGMENT_DIR) as reader:
+            yield from reader.iter_records(prefix="dynamic::", latest_only=True)
+        return
+    yield from latest_records(_iter_local_synced_json())
+
+def _iter_local_synced_json():
+    for line in iter_local_synced_lines():
+        try:
+            yield json.loads(line.strip())
+        except json.JSONDecodeError as e:
+            logger.error(f"解析 local_synced_data.jsonl 中的JSON行错误: {line.strip()} - {e}")
+
+def load_local_synced_data() -> Dict[str, Any]:
+    """
+    从 local_synced_data.jsonl 文件加载社团和帖子信息。
+    将帖子归类到对应的社团下。
+    """
+    clubs_data = {}
+    
+    if not os.path.exists(LOCAL_SYNCED_DATA_FILE) and not (LOCAL_SYNCED_SEGMENT_DIR and os.path.isdir(LOCAL_SYNCED_SEGMENT_DIR)):
+        logger.warning(f"本地同步数据文件不存在: {LOCAL_SYNCED_DATA_FILE}")
         return {}
 
     try:
-        with open(LOCAL_SYNCED_DATA_FILE, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    entry = json.loads(line.strip())
-                    doc_id = entry.get("id", "")
-                    metadata = entry.get("metadata", {})
-                    document_content = entry.get("document", "")
-
-                    if doc_id.startswith("dynamic::club_id::"):
-                        club_id = doc_id.replace("dynamic::club_id::", "")
-                        if club_id not in clubs_data:
-                            clubs_data[club_id] = {
-                                "club_name": metadata.get("name", f"未知社团 {club_id}"),
-                                "description": metadata.get("description", document_content),
-                                "tags": [],
-                                "posts": []
-                            }
-                        # Parse tags, which might be a JSON string
-                        raw_tags = metadata.get("tags", "[]")
-                        try:
-                            parsed_tags = json.loads(raw_tags)
-                            if isinstance(parsed_tags, list) and all(isinstance(t, str) for t in parsed_tags):
-                                clubs_data[club_id]["tags"] = parsed_tags
-                            else:
-                                clubs_data[club_id]["tags"] = [raw_tags] # Fallback if not a proper list
-                        except json.JSONDecodeError:
-                            clubs_data[club_id]["tags"] = [raw_tags] # Treat as single tag if not JSON array
-
-                        # Update description if document_content is more relevant
-                        if document_content and document_content != "some description":
-                            clubs_data[club_id]["description"] = document_content
-
-                    elif doc_id.startswith("dynamic::post_id::"):
-                        post_club_id = str(metadata.get("club_id")) # Ensure it's a string to match club_id keys
-                        if post_club_id in clubs_data:
-                            post_info = {
-                                "id": doc_id,
-                                "document": document_content,
-                                "title": metadata.get("title", ""),
-                                "author_id": metadata.get("author_id"),
-                                "is_pinned": metadata.get("is_pinned")
-                            }
-                            clubs_data[post_club_id]["posts"].append(post_info)
+        # 只处理每个文档的最新版本；社团记录先于帖子处理（社团更新后其最新版本可能排在帖子之后）
+        entries = sorted(iter_local_synced_entries(),
+                         key=lambda entry: not entry.get("id", "").startswith("dynamic::club_id::"))
+        for entry in entries:
+            try:
+                doc_id = entry.get("id", "")
+                metadata = entry.get("metadata", {})
+                document_content = entry.get("document", "")
+
+                if doc_id.startswith("dynamic::club_id::"):
+                    club_id = doc_id.replace("dynamic::club_id::", "")
+                    if club_id not in clubs_data:
+                        clubs_data[club_id] = {
+                            "club_name": metadata.get("name", f"未知社团 {club_id}"),
+                            "description": metadata.get("description", document_content),
+                            "tags": [],
+                            "posts": []
+                        }
+                    # Parse tags, which might be a JSON string
+                    raw_tags = metadata.get("tags", "[]")
+                    try:
+                        parsed_tags = json.loads(raw_tags)
+                        if isinstance(parsed_tags, list) and all(isinstance(t, str) for t in parsed_tags):
+                            clubs_data[club_id]["tags"] = parsed_tags
                         else:
-                            logger.warning(f"发现孤立帖子，club_id {post_club_id} 未找到对应社团: {entry}")
-                except json.JSONDecodeError as e:
-                    logger.error(f"解析 local_synced_data.jsonl 中的JSON行错误: {line.strip()} - {e}")
-                except Exception as e:
-                    logger.error(f"处理 local_synced_data.jsonl 中的行时发生未知错误: {line.strip()} - {e}")
+                            clubs_data[club_id]["tags"] = [raw_tags] # Fallback if not a proper list
+                    except json.JSONDecodeError:
+                        clubs_data[club_id]["tags"] = [raw_tags] # Treat as single tag if not JSON array
+
+                    # Update description if document_content is more relevant
+                    if document_content and document_content != "some description":
+                        clubs_data[club_id]["description"] = document_content
+
+                elif doc_id.startswith("dynamic::post_id::"):
+                    post_club_id = str(metadata.get("club_id")) # Ensure it's a string to match club_id keys
+                    if post_club_id in clubs_data:
+                        post_info = {
+                            "id": doc_id,
+                            "document": document_content,
+                            "title": metadata.get("title", ""),
+                            "author_id": metadata.get("author_id"),
+                            "is_pinned": metadata.get("is_pinned")
+                        }
+                        clubs_data[post_club_id]["posts"].append(post_info)
+                    else:
+                        logger.warning(f"发现孤立帖子，club_id {post_club_id} 未找到对应社团: {entry}")
+            except Exception as e:
+                logger.error(f"处理 local_synced_data.jsonl 中的记录时发生未知错误: {entry} - {e}")
     except Exception as e:
         logger.error(f"读取本地同步数据文件失败: {LOCAL_SYNCED_DATA_FILE} - {e}")
     
     return clubs_data
 
 # 添加推荐服务的配置
-RECOMMENDATION_SERVICE_URL = "http://localhost:8001"
+RECOMMENDATION_SERVICE_URL = config.recommendation_service_url
+
+USER_NAME_PLACEHOLDER = "{{user_name}}"
+
+def depersonalize_summary(text: str, user_name: str) -> str:
+    return text.replace(user_name, USER_NAME_PLACEHOLDER) if len(user_name or "") >= 2 else text
+
+def personalize_summary(text: str, user_name: str) -> str:
+    return text.replace(USER_NAME_PLACEHOLDER, user_name or "")
 
 @app.post("/club_recommend", response_model=Club_Recommend_Response)
 async def club_recommend(request: Club_Recommend_Request):
@@ -1793,43 +1595,11 @@ async def club_recommend(request: Club_Recommend_Request):
                 recommendation_prompt += f"   描述: {rec['desc']}\n\n"
 
         # 5. 构建完整的提示词
-        prompt_template = """
-你是一个智能社团推荐助手。你的任务是根据用户的个人信息、兴趣标签和专业，从我提供的社团列表中，智能推荐最适合用户的社团。
-对于每个推荐的社团，请说明推荐理由。
-
-请注意：
-1. 推荐系统的建议仅供参考，你应该根据用户的具体情况和社团的详细信息做出独立判断
-2. 可以选择推荐系统建议的社团，也可以推荐其他更适合的社团
-3. 重点关注用户的兴趣、专业和社团的实际活动内容的匹配度
-
-请按照以下JSON格式返回结果：
-{{
-  "Summary_text": "[AI生成的推荐总结，概括推荐理由]",
-  "Recommend_club_list": [
-    {{
-      "club_name": "[社团名称]",
-      "description": "[社团描述]",
-      "tags": ["[标签1]", "[标签2]"],
-      "recommend_reason": "[推荐该社团的理由]"
-    }},
-    // 可以推荐多个社团
-  ]
-}}
-
---- 用户信息 ---
-用户姓名: {user_name}
-用户个人描述: {user_description}
-用户兴趣标签: {user_tags}
-用户专业: {user_major}
-{recommendation_prompt}
---- 可选社团列表 ---
-{clubs_list}
-
-请开始生成社团推荐。
-"""
         user_tags_str = ", ".join(request.User_tags) if request.User_tags else "无"
 
-        full_prompt = prompt_template.format(
+        template = prompt_registry.get("club_recommend")
+        messages, max_tokens = token_budget.prepare(
+            template, truncate=("clubs_list", "user_description"),
             user_name=request.User_name,
             user_description=request.User_description,
             user_tags=user_tags_str,
@@ -1837,94 +1607,122 @@ async def club_recommend(request: Club_Recommend_Request):
             recommendation_prompt=recommendation_prompt,
             clubs_list=clubs_list_for_prompt
         )
+        logger.info(f"AI社团推荐Prompt: {messages[-1]['content'][:200]}...")
 
-        logger.info(f"AI社团推荐Prompt: {full_prompt[:200]}...")
-
-        # 6. 调用AI生成推荐
-        llm_response_content = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一个智能社团推荐助手，你的任务是根据用户的个人信息、兴趣标签和专业，从我提供的社团列表中，智能推荐最适合用户的社团。对于每个推荐的社团，请说明推荐理由。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
-        )
-
-        chat_response = await chat(chat_request) # Call the local chat function
-
-        llm_response_content = chat_response.response
-
-        if not llm_response_content.strip():
-            raise ValueError("AI未返回有效的响应内容。")
-
-        # 7. 解析AI响应
-        json_string = llm_response_content.strip()
-        if json_string.startswith("```json") and json_string.endswith("```"):
-            json_string = json_string[len("```json"): -len("```")].strip()
-
-        try:
-            parsed_response = json.loads(json_string)
-            summary_text = parsed_response.get("Summary_text", "")
-            recommend_club_list_data = parsed_response.get("Recommend_club_list", [])
-
-            if not summary_text or not isinstance(recommend_club_list_data, list):
+        def check(result: Club_Recommend_Response):
+            if not result.Summary_text.strip():
                 raise ValueError("AI返回的JSON格式不完整或字段类型不正确。")
 
-            recommend_club_list = []
-            for club_data in recommend_club_list_data:
-                try:
-                    club_info = ClubInfo(**club_data)
-                    recommend_club_list.append(club_info)
-                except Exception as e:
-                    logger.warning(f"解析单个推荐社团信息时出错: {club_data}, 错误: {e}")
-
+        # 6. 相似的用户描述可以直接使用语义缓存中的推荐（社团数据变化后缓存失效，见 semantic_cache.py）
+        cache = semantic_cache.get_cache(template.name)
+        cache_context = semantic_cache.context_key(template.name, clubs_list_for_prompt)
+        profile_text = f"{request.User_description}\n{user_tags_str}\n{request.User_major}"
+        cached = await cache.alookup(cache_context, profile_text)
+        if cached is not None:
             return Club_Recommend_Response(
-                Summary_text=summary_text.strip(),
-                Recommend_club_list=recommend_club_list
+                Summary_text=personalize_summary(cached[0].Summary_text, request.User_name),
+                Recommend_club_list=cached[0].Recommend_club_list
             )
 
-        except json.JSONDecodeError:
-            logger.error(f"AI响应不是有效的JSON: {llm_response_content}")
-            raise ValueError(f"AI返回的响应格式错误，无法解析为JSON: {llm_response_content[:100]}...")
+        # 7. 调用AI生成推荐并解析响应
+        with template.timed():
+            result = await generate_structured(
+                Club_Recommend_Response, messages, max_tokens=max_tokens, check=check,
+                endpoint=template.name, on_usage=token_budget.recorder(template.name, max_tokens)
+            )
+        response = Club_Recommend_Response(
+            Summary_text=result.Summary_text.strip(),
+            Recommend_club_list=result.Recommend_club_list
+        )
+        # 缓存的总结中不保留用户名，命中时换成新请求的用户名
+        await cache.astore(cache_context, profile_text, Club_Recommend_Response(
+            Summary_text=depersonalize_summary(response.Summary_text, request.User_name),
+            Recommend_club_list=response.Recommend_club_list
+        ))
+        return response
 
     except Exception as e:
         logger.error(f"AI社团推荐失败: {e}")
         raise HTTPException(status_code=500, detail=f"AI社团推荐失败: {e}")
 
 @app.post("/update_club_data")
-async def update_club_data_endpoint():
-    """手动触发更新社团信息。"""
+async def update_club_data_endpoint(wait: bool = False):
+    """
+    手动触发更新社团信息。刷新在后台进行，立即返回（进度见 /club_refresh_status）；
+    已有刷新在进行时不会重复开始。wait=true 时等待刷新完成并返回结果。
+    """
     logger.info("收到更新社团信息的请求...")
     try:
-        result = await update_club_information()
-        return result
+        task, started = club_refresher.trigger("manual")
+        if not wait:
+            return {
+                "message": "已开始后台更新社团信息" if started else "社团信息正在更新中",
+                "status": "started" if started else "running",
+                "refresh": club_refresher.stats()
+            }
+        # 客户端断开时不取消刷新
+        run = await asyncio.shield(task)
+        if run["status"] != "success":
+            raise HTTPException(status_code=500, detail=f"更新社团信息失败: {run.get('error')}")
+        return run["result"]
     except HTTPException as e:
         raise e
     except Exception as e:
         logger.error(f"手动更新社团信息接口失败: {e}")
         raise HTTPException(status_code=500, detail=f"手动更新社团信息接口失败: {e}")
 
+@app.get("/club_refresh_status")
+async def club_refresh_status():
+    """后台刷新社团信息的状态：正在进行/最近一次的刷新、下次定时刷新时间和推荐服务同步情况"""
+    return club_refresher.stats()
+
+@app.get("/club_changes")
+async def club_changes(since: int = 0, limit: int = 1000, include_data: bool = False):
+    """
+    社团信息的变更流：序号大于 since 的变更（按序号升序，最多 limit 条）。
+    reset 为 true 时 since 之后的部分变更已被清理，应重新获取全部社团；
+    include_data=true 时新增/修改的变更附带社团当前的信息（之后又被删除的为 null）。
+    """
+    try:
+        feed = club_store.store.changes_since(since, max(1, min(limit, 10000)))
+        if include_data:
+            clubs = club_store.store.get_many(
+                {change["club_id"] for change in feed["changes"] if change["kind"] == club_store.UPSERT}
+            )
+            for change in feed["changes"]:
+                if change["kind"] == club_store.UPSERT:
+                    change["data"] = clubs.get(change["club_id"])
+        return feed
+    except Exception as e:
+        logger.error(f"获取社团信息变更失败: {e}")
+        raise HTTPException(status_code=500, detail=f"获取社团信息变更失败: {e}")
+
 # 新增训练数据生成请求和响应模型
 class TrainingDataGenerationRequest(BaseModel):
     batch_size: int = 10
     total_count: int = 100
     save_file: Optional[str] = "training_data.jsonl"
     data_type: Optional[str] = "general"  # 可选值: "general", "knowledge" 或 "faq"
+    parallelism: Optional[int] = None  # 同时发往 vLLM 的批次数，默认取 vllm.generation_parallelism
 
 class TrainingDataGenerationResponse(BaseModel):
     generated_count: int
     message: str
     sample_data: List[Dict[str, str]]
 
+TRAINING_FIELDS = ("instruction", "input", "output")
+
+def is_valid_training_item(item: Any) -> bool:
+    """训练数据条目必须包含 instruction、input、output 三个字符串字段"""
+    return isinstance(item, dict) and all(isinstance(item.get(key), str) for key in TRAINING_FIELDS)
+
 @app.post("/generate_training_data", response_model=TrainingDataGenerationResponse)
 async def generate_training_data(request: TrainingDataGenerationRequest):
+    return await run_training_data_generation(request)
+
+async def run_training_data_generation(request: TrainingDataGenerationRequest, ctx: Optional[JobContext] = None):
+    """生成训练数据。ctx 为后台任务上下文，用于保存检查点并在重启后从已生成的数量继续"""
+    ctx = ctx or NullJobContext()
     task_id = id(request)  # 使用请求对象的id作为任务id
     active_tasks.add(task_id)
     try:
@@ -2070,67 +1868,30 @@ async def generate_training_data(request: TrainingDataGenerationRequest):
 
 请直接返回一个包含{batch_size}条数据的完整JSON数组，不要包含任何其他文本。"""
 
-        # 计算每种类型应该生成的数量
-        role_count = request.batch_size // 5  # 每个角色视角的数量
-        topic_count = request.batch_size // 5  # 每个主题的数量
-        template_count = role_count // 3  # 每个模板的使用次数
-        
-        # 格式化提示词
-        current_prompt = None
-        if request.data_type == "knowledge":
-            current_prompt = knowledge_prompt_template.format(
-                batch_size=request.batch_size
-            )
-        elif request.data_type == "faq":
-            current_prompt = faq_prompt_template.format(
-                batch_size=request.batch_size
-            )
-        else:  # 默认使用general模板
-            current_prompt = prompt_template.format(
-                batch_size=request.batch_size,
+        def build_prompt(actual_batch_size: int) -> str:
+            # 计算每种类型应该生成的数量
+            role_count = actual_batch_size // 5  # 每个角色视角的数量
+            topic_count = actual_batch_size // 5  # 每个主题的数量
+            template_count = role_count // 3  # 每个模板的使用次数
+
+            if request.data_type == "knowledge":
+                return knowledge_prompt_template.format(batch_size=actual_batch_size)
+            if request.data_type == "faq":
+                return faq_prompt_template.format(batch_size=actual_batch_size)
+            # 默认使用general模板
+            return prompt_template.format(
+                batch_size=actual_batch_size,
                 role_count=role_count,
                 topic_count=topic_count,
                 template_count=template_count
             )
 
-        total_generated = 0
-        all_data = []
-        
-        while total_generated < request.total_count and not server_should_exit:
-            batch_size = min(request.batch_size, request.total_count - total_generated)
-            
+        async def generate_batch(batch_size: int) -> List[Dict[str, str]]:
             # 实际生成的数量比请求的多2条，因为前两条会被忽略
             actual_batch_size = batch_size + 2
-            
-            # 计算每种类型应该生成的数量
-            role_count = actual_batch_size // 5  # 每个角色视角的数量
-            topic_count = actual_batch_size // 5  # 每个主题的数量
-            template_count = role_count // 3  # 每个模板的使用次数
-            
-            # 格式化提示词
-            current_prompt = None
-            if request.data_type == "knowledge":
-                current_prompt = knowledge_prompt_template.format(
-                    batch_size=actual_batch_size
-                )
-            elif request.data_type == "faq":
-                current_prompt = faq_prompt_template.format(
-                    batch_size=actual_batch_size
-                )
-            else:  # 默认使用general模板
-                current_prompt = prompt_template.format(
-                    batch_size=actual_batch_size,
-                    role_count=role_count,
-                    topic_count=topic_count,
-                    template_count=template_count
-                )
 
-            # 检查是否应该退出
-            check_exit()
-            
             # 构造发送给vLLM的payload
             payload = {
-                "model": config.default_model,
                 "messages": [
                     {
                         "role": "system",
@@ -2138,152 +1899,115 @@ async def generate_training_data(request: TrainingDataGenerationRequest):
                     },
                     {
                         "role": "user",
-                        "content": current_prompt
+                        "content": build_prompt(actual_batch_size)
                     }
                 ],
                 "temperature": 0.7,
                 "top_p": 0.95,
-                "max_tokens": 8000,
                 "stream": True
             }
-            
-            headers = {
-                "Content-Type": "application/json"
-            }
-            
-            # 收集完整的响应
-            llm_response_content = ""
+            payload["max_tokens"] = token_budget.items_max_tokens("training_data", actual_batch_size, payload["messages"])
+
+            # 边生成边解析：每条数据闭合后立即校验，凑够 batch_size 条后停止读取（vLLM 随之中止生成）；
+            # 格式有误的条目单独跳过，连接中断或输出被截断时保留已解析出的有效数据
+            parser = JsonArrayStream()
+            valid_data: List[Dict[str, str]] = []
+            index = invalid_count = 0
+            usage: Dict[str, Any] = {}
+            completion_estimate = 0
+            deltas = llm_router.stream_chat("data_generation", payload, usage=usage, timeout=300)
             try:
-                response = requests.post(
-                    config.vllm_api_url,
-                    headers=headers,
-                    json=payload,
-                    stream=True,
-                    timeout=300  # 增加超时时间到5分钟
-                )
-                response.raise_for_status()
-                
-                # 使用更健壮的SSE处理
-                buffer = ""
-                for line in response.iter_lines():
-                    if not line:
-                        continue
-                        
-                    line = line.decode('utf-8')
-                    if not line.startswith("data: "):
-                        continue
-                        
-                    # 移除"data: "前缀
-                    data = line[6:]
-                    if data == "[DONE]":
+                async for content in deltas:
+                    completion_estimate += estimate_tokens(content)
+                    for item in parser.feed(content):
+                        index += 1
+                        if index <= 2:  # 跳过前两条数据
+                            continue
+                        if is_valid_training_item(item):
+                            valid_data.append(item)
+                        else:
+                            invalid_count += 1
+                    if parser.done or len(valid_data) >= batch_size:
                         break
-                        
-                    try:
-                        json_data = json.loads(data)
-                        if json_data.get("choices") and len(json_data["choices"]) > 0:
-                            choice = json_data["choices"][0]
-                            if choice.get("delta") and "content" in choice["delta"]:
-                                content = choice["delta"]["content"]
-                                llm_response_content += content
-                                buffer += content
-                    except json.JSONDecodeError:
-                        logger.debug(f"无法解析的SSE数据行: {data}")
-                        continue
-                    except Exception as e:
-                        logger.warning(f"处理流式响应数据时出错: {e}")
-                        continue
-                            
-            except requests.exceptions.RequestException as e:
+            except httpx.HTTPError as e:
                 logger.error(f"请求vLLM服务失败: {e}")
-                continue
             except Exception as e:
                 logger.error(f"生成过程出错: {e}")
-                continue
-            
-            if not llm_response_content.strip():
-                logger.warning("本批次生成的内容为空，跳过")
-                continue
+            finally:
+                await deltas.aclose()
+                # 提前停止读取时 vLLM 不会返回 usage，按文本长度估算
+                token_budget.record("training_data", usage or {"completion_tokens": completion_estimate},
+                                    payload["max_tokens"], items=index + parser.errors)
+
+            if invalid_count or parser.errors:
+                logger.debug(f"本批次有 {invalid_count + parser.errors} 条无效数据被过滤")
+            if index == 0 and not parser.errors:
+                logger.warning("本批次响应中未找到有效的JSON数组")
+            elif not valid_data:
+                logger.warning("本批次所有数据都无效")
+            return valid_data[:batch_size]
 
-            # 清理响应文本并尝试解析
-            json_string = llm_response_content.strip()
-            
-            # 记录原始响应以便调试
-            logger.debug(f"原始响应: {json_string[:200]}...")
-            
-            try:
-                # 如果响应已经是一个有效的JSON数组，直接解析
-                if json_string.startswith('[') and json_string.endswith(']'):
-                    try:
-                        batch_data = json.loads(json_string)
-                    except json.JSONDecodeError:
-                        # 如果解析失败，尝试清理JSON字符串
-                        json_string = re.sub(r',\s*]$', ']', json_string)
-                        json_string = re.sub(r'^\[\s*,', '[', json_string)
-                        batch_data = json.loads(json_string)
-                else:
-                    # 如果响应不是直接的JSON数组，尝试提取
-                    start_idx = json_string.find('[')
-                    end_idx = json_string.rfind(']')
-                    
-                    if start_idx == -1 or end_idx == -1:
-                        logger.warning(f"响应中未找到JSON数组标记: {json_string[:200]}...")
-                        continue
-                    
-                    json_string = json_string[start_idx:end_idx + 1]
-                    json_string = re.sub(r',\s*]$', ']', json_string)
-                    json_string = re.sub(r'^\[\s*,', '[', json_string)
-                    batch_data = json.loads(json_string)
-                
-                if not isinstance(batch_data, list):
-                    logger.warning(f"解析结果不是JSON数组: {type(batch_data)}")
-                    continue
-                
-                # 验证每条数据的格式
-                valid_data = []
-                invalid_count = 0
-                for i, item in enumerate(batch_data):
-                    try:
-                        # 跳过前两条数据
-                        if i < 2:
-                            continue
-                            
-                        if not all(key in item for key in ["instruction", "input", "output"]):
-                            invalid_count += 1
-                            continue
-                        if not all(isinstance(item[key], str) for key in ["instruction", "input", "output"]):
-                            invalid_count += 1
-                            continue
-                        valid_data.append(item)
-                    except Exception as e:
-                        invalid_count += 1
+        save_path = None
+        if request.save_file:
+            save_path = os.path.join(current_dir, "generated_data", request.save_file)
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+
+        parallelism = max(1, request.parallelism or config.generation_parallelism)
+        total_generated = ctx.state.get("generated", 0)
+        all_data = list(ctx.state.get("samples", []))
+        pending: Dict[asyncio.Task, Any] = {}  # 进行中的批次 -> (批次序号, 请求条数)
+        completed: Dict[int, List[Dict[str, str]]] = {}  # 已完成但尚未按顺序写出的批次
+        next_batch = 0  # 下一个要发起的批次序号
+        next_to_write = 0  # 下一个要写出的批次序号
+
+        try:
+            while total_generated < request.total_count and not server_should_exit:
+                # 补足并发：已写出 + 待写出 + 进行中的条数不足目标时继续发起批次
+                in_flight = sum(requested for _, requested in pending.values())
+                buffered = sum(len(items) for items in completed.values())
+                while len(pending) < parallelism:
+                    remaining = request.total_count - total_generated - buffered - in_flight
+                    if remaining <= 0:
+                        break
+                    # 检查是否应该退出
+                    check_exit()
+                    batch_size = min(request.batch_size, remaining)
+                    task = asyncio.create_task(generate_batch(batch_size))
+                    pending[task] = (next_batch, batch_size)
+                    next_batch += 1
+                    in_flight += batch_size
+
+                if not pending:
+                    break
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    batch_index, _ = pending.pop(task)
+                    completed[batch_index] = task.result()
+
+                # 按批次顺序写出，保证输出顺序与发起顺序一致
+                while next_to_write in completed and total_generated < request.total_count:
+                    valid_data = completed.pop(next_to_write)[:request.total_count - total_generated]
+                    next_to_write += 1
+                    if not valid_data:
                         continue
-                
-                if invalid_count > 0:
-                    logger.debug(f"本批次有 {invalid_count} 条无效数据被过滤（包括前两条示例数据）")
-                
-                if valid_data:
+
                     all_data.extend(valid_data)
                     total_generated += len(valid_data)
-                    
+
                     # 保存到文件
-                    if request.save_file:
-                        save_path = os.path.join(current_dir, "generated_data", request.save_file)
-                        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                    if save_path:
                         with open(save_path, 'a', encoding='utf-8') as f:
                             for item in valid_data:
                                 json.dump(item, f, ensure_ascii=False)
                                 f.write('\n')
-                    
+
                     logger.info(f"已生成 {total_generated}/{request.total_count} 条数据")
-                else:
-                    logger.warning("本批次所有数据都无效")
-                    
-            except json.JSONDecodeError as e:
-                logger.warning(f"JSON解析错误: {e}, 响应内容: {json_string[:200]}...")
-                continue
-            except Exception as e:
-                logger.warning(f"处理本批次数据时出错: {e}")
-                continue
+                    await ctx.checkpoint({"generated": total_generated, "samples": all_data[:3]},
+                                         progress=total_generated, total=request.total_count)
+        finally:
+            for task in pending:
+                task.cancel()
 
         if not all_data:
             raise ValueError("未能生成任何有效数据")
@@ -2315,55 +2039,23 @@ async def generate_activity_post(request: ContentGenerationRequest):
         ContentGenerationResponse: 包含生成的动态文本。
     """
     try:
-        prompt_template = """你是一位专业的社团活动总结撰写专家，擅长将活动的实际开展情况转化为引人入胜的社交媒体动态。
-请根据我提供的活动总结内容{content}，以{style}的文风进行改写，确保改写后的内容能达到{expection}的效果。
-
-要求：
-1. 突出活动的实际效果和价值
-2. 展现参与者的收获和感受
-3. 总结活动的精彩瞬间和亮点
-4. 适当引用参与者的反馈或感言
-5. 体现社团的专业性和影响力
-6. 为后续活动预热（如有类似活动计划）
-7. 增加适当的emoji表情增强表现力
-8. 适当添加图片位置提示（如：[此处可插入活动现场照片]）
-9. 添加合适的话题标签
-
-重点描述：
-- 活动实际效果
-- 参与者反馈
-- 精彩瞬间
-- 社团价值
-- 未来展望"""
-        
-        # 格式化Prompt
-        full_prompt = prompt_template.format(
-            content=request.content,
-            style=request.style,
-            expection=request.expection
+        template = prompt_registry.get("activity_post")
+        messages, max_tokens = token_budget.prepare(
+            template, truncate=("content",), content=request.content, style=request.style, expection=request.expection
         )
-        
-        logger.info(f"生成社团动态总结Prompt: {full_prompt[:200]}...") # 增加日志长度
+        logger.info(f"生成社团动态总结Prompt: {messages[-1]['content'][:200]}...")
 
-        generated_text = ""
-        # Construct messages for the chat function
-        messages = [
-            Message(role="system", content="你是一位专业的社团活动总结撰写专家，擅长将活动的实际开展情况转化为引人入胜的社交媒体动态。"),
-            Message(role="user", content=full_prompt)
-        ]
-        
-        chat_request = ChatRequest(
-            messages=messages,
-            model=config.default_model, # Use default model
-            max_tokens=2048, # Adjust max tokens as needed for post length
-            temperature=0.7,
-            top_p=0.95,
-            stream=False # We need a complete response
-        )
-
-        chat_response = await chat(chat_request) # Call the local chat function
+        payload = {
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "top_p": 0.95
+        }
+        with template.timed():
+            result = await llm_router.chat_completion(template.name, payload)
+        token_budget.record(template.name, result.get("usage"), max_tokens)
 
-        generated_text = chat_response.response
+        generated_text = llm_router.message_content(result)
 
         if not generated_text.strip():
             raise ValueError("AI未返回有效的生成内容。")
@@ -2376,34 +2068,78 @@ async def generate_activity_post(request: ContentGenerationRequest):
 
 @app.post("/generate_ml_data", response_model=MLDataGenerationResponse)
 async def generate_ml_data(request: MLDataGenerationRequest):
+    return await run_ml_data_generation(request)
+
+async def run_ml_data_generation(request: MLDataGenerationRequest, ctx: Optional[JobContext] = None):
     """
     根据机器学习需求，使用AI生成模拟的社团、用户和互动数据。
     生成过程分为三个阶段：社团信息、个人偏好、以及基于前两者的互动信息。
+    社团和用户阶段并发执行，互动阶段在二者达到一定数量后即开始；每个阶段内最多
+    parallelism 个批次同时请求 LLM。
     
     Args:
         request: 包含生成数量（社团、用户、互动）的请求体。
+        ctx: 后台任务上下文，每个批次完成后保存检查点，重启后从已生成的数据继续。
         
     Returns:
         MLDataGenerationResponse: 包含生成的社团、用户和互动数据。
     """
+    ctx = ctx or NullJobContext()
     try:
         # 固定每个批次LLM调用生成数量（为了多样性）
         LLM_BATCH_SIZE = 10 # 统一批次大小，LLM返回的实际数量会是这个值减2
 
-        all_communities = []
-        all_users = []
-        all_interactions = []
+        all_communities = [CommunityItem(**c) for c in ctx.state.get("communities", [])]
+        all_users = [UserItem(**u) for u in ctx.state.get("users", [])]
+        all_interactions = [InteractionItem(**i) for i in ctx.state.get("interactions", [])]
+        total_requested = request.num_communities + request.num_users + request.num_interactions
+
+        # 已生成数据的去重索引：prompt 中只放有限的样例，生成后再拒绝重复/高度相似的条目
+        sample_size = config.ml_prompt_sample_size
+        community_index = DedupIndex(threshold=config.ml_dedup_threshold)
+        for c in all_communities:
+            community_index.add(c.community_id, f"{c.community_name}|{c.tags}",
+                                f"- Name: {c.community_name}, Tags: {c.tags}")
+        # 兴趣标签相近的用户是正常数据，用户只拒绝标签完全相同的重复条目
+        user_index = DedupIndex(threshold=None)
+        for u in all_users:
+            user_index.add(u.user_id, u.user_tags, f"- Tags: {u.user_tags}")
+        # 模型只生成内容字段，条目被接受后由服务器分配 ID
+        community_ids = IdAllocator(c.community_id for c in all_communities)
+        user_ids = IdAllocator(u.user_id for u in all_users)
+        # 已接受的社团/用户 ID 和互动，用于校验模型生成的互动条目
+        known_community_ids = {c.community_id for c in all_communities}
+        known_user_ids = {u.user_id for u in all_users}
+        interaction_keys = {(i.user_id, i.community_id, i.timestamp) for i in all_interactions}
+        usage_totals: Dict[str, int] = {}
+        generated_items = 0
+        rejected = dict.fromkeys(
+            ["discarded_examples", "invalid", "near_duplicates", "duplicate_users", "duplicate_interactions", "invalid_references"], 0)
+
+        checkpoint_lock = asyncio.Lock()  # 三个阶段并发执行，检查点依次写入
+
+        async def save_checkpoint(stage: str):
+            async with checkpoint_lock:
+                await ctx.checkpoint(
+                    {
+                        "communities": [c.dict() for c in all_communities],
+                        "users": [u.dict() for u in all_users],
+                        "interactions": [i.dict() for i in all_interactions]
+                    },
+                    progress=len(all_communities) + len(all_users) + len(all_interactions),
+                    total=total_requested,
+                    message=stage
+                )
 
         # 定义三个独立的Prompt模板
         community_prompt_template = """
 你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟社团数据。
 你的任务是根据以下数据模型和要求，一次性生成指定数量的模拟社团数据，并以JSON格式返回。
 
-**重要：你必须生成与已提供数据不重复的全新数据。生成的 community_id 必须是未出现过的新ID。**
+**重要：你必须生成与已提供数据不重复的全新数据。社团 ID 由系统分配，无需生成。**
 
 **数据模型:**
 1.  **社团数据 (communities):**
-    -   `community_id`: 整型，社团的唯一ID。
     -   `community_name`: 字符串，社团的名称。
     -   `tags`: 字符串，社团的标签，使用 '|' 分隔。可以是中文，数量不定，也可以没有（空字符串）。例如: '摄影|艺术|风景' 或 ''。
 
@@ -2417,8 +2153,8 @@ async def generate_ml_data(request: MLDataGenerationRequest):
 请**直接**按照以下JSON格式返回结果，**不要包含任何Markdown代码块或其他文本**：
 {{
   "communities": [
-    {{"community_id": 1, "community_name": "摄影社", "tags": "摄影|艺术|风景"}},
-    {{"community_id": 2, "community_name": "篮球社", "tags": "篮球|运动|团队"}},
+    {{"community_name": "摄影社", "tags": "摄影|艺术|风景"}},
+    {{"community_name": "篮球社", "tags": "篮球|运动|团队"}},
     // ... 其他社团数据 ...
   ]
 }}
@@ -2430,11 +2166,10 @@ async def generate_ml_data(request: MLDataGenerationRequest):
 你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟用户数据。
 你的任务是根据以下数据模型和要求，一次性生成指定数量的模拟用户数据，并以JSON格式返回。
 
-**重要：你必须生成与已提供数据不重复的全新数据。生成的 user_id 必须是未出现过的新ID。**
+**重要：你必须生成与已提供数据不重复的全新数据。用户 ID 由系统分配，无需生成。**
 
 **数据模型:**
 1.  **用户数据 (users):**
-    -   `user_id`: 整型，用户的唯一ID。
     -   `user_tags`: 字符串，用户的兴趣标签，使用 '|' 分隔（可以是自定义的中文标签）。例如: '喜欢拍照|艺术创作|风景'。
 
 **生成数量要求:**
@@ -2447,8 +2182,8 @@ async def generate_ml_data(request: MLDataGenerationRequest):
 请**直接**按照以下JSON格式返回结果，**不要包含任何Markdown代码块或其他文本**：
 {{
   "users": [
-    {{"user_id": 1, "user_tags": "喜欢拍照|艺术创作|风景"}},
-    {{"user_id": 2, "user_tags": "运动健身|编程开发|团队协作"}},
+    {{"user_tags": "喜欢拍照|艺术创作|风景"}},
+    {{"user_tags": "运动健身|编程开发|团队协作"}},
     // ... 其他用户数据 ...
   ]
 }}
@@ -2494,293 +2229,257 @@ async def generate_ml_data(request: MLDataGenerationRequest):
 请开始生成数据。
 """
 
-        max_iterations = 100  # Adjust as needed, safety break
-
-        # --- Stage 1: Generate Communities ---
-        current_iteration = 0
-        while len(all_communities) < request.num_communities and current_iteration < max_iterations:
-            current_iteration += 1
-            communities_to_request = min(LLM_BATCH_SIZE, request.num_communities - len(all_communities))
-
-            if communities_to_request <= 0:
-                break
+        parallelism = max(1, request.parallelism or config.generation_parallelism)
+        max_iterations = 100  # 每个阶段最多发起的批次数, safety break
+        # 社团和用户各自达到该数量（或各自的目标数量）后即开始生成互动，不必等前两个阶段全部完成
+        interaction_min_entities = config.ml_interaction_min_entities
+        entities_changed = asyncio.Event()  # 有新的社团/用户加入或前两个阶段结束时触发
+        entities_done = asyncio.Event()  # 社团和用户阶段均已结束
+
+        async def run_stage(stage: str, target: int, produced, run_batch, ready=None):
+            """
+            以有限并发执行一个生成阶段：最多 parallelism 个批次同时请求 LLM，
+            已生成条数加上进行中批次的请求条数达到 target 后不再发起新批次。
+            ready 返回 False 时暂不发起新批次，等待社团/用户数据增加。
+            """
+            pending: Dict[asyncio.Task, int] = {}  # 进行中的批次 -> 请求条数
+            iteration = 0
+            try:
+                while True:
+                    in_flight = sum(pending.values())
+                    while len(pending) < parallelism and iteration < max_iterations and (ready is None or ready()):
+                        to_request = min(LLM_BATCH_SIZE, target - produced() - in_flight)
+                        if to_request <= 0:
+                            break
+                        iteration += 1
+                        pending[asyncio.create_task(run_batch(iteration, to_request))] = to_request
+                        in_flight += to_request
+
+                    if not pending:
+                        if ready is None or ready() or entities_done.is_set():
+                            break
+                        entities_changed.clear()
+                        await entities_changed.wait()
+                        continue
 
-            existing_communities_str = "\n".join([f"- ID: {c.community_id}, Name: {c.community_name}, Tags: {c.tags}" for c in all_communities]) if all_communities else "无"
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        pending.pop(task)
+                        task.result()
+                    await save_checkpoint(stage)
+            finally:
+                for task in pending:
+                    task.cancel()
+
+        def interactions_ready() -> bool:
+            if not all_communities or not all_users:
+                return False
+            if entities_done.is_set():
+                return True
+            return len(all_communities) >= min(request.num_communities, interaction_min_entities) and \
+                len(all_users) >= min(request.num_users, interaction_min_entities)
+
+        async def stream_batch(payload: Dict[str, Any], key: str, label: str, iteration: int,
+                               accept, wanted: int) -> int:
+            """
+            流式请求一批数据：数组中每条数据闭合后立即交给 accept 校验并加入结果（返回是否接受），
+            接受 wanted 条后停止读取。格式有误的条目单独跳过，请求中途失败时保留已接受的条目。
+            返回本批次接受的条数。
+            """
+            nonlocal generated_items
+            budget_name = f"ml_{key}"
+            payload["max_tokens"] = token_budget.items_max_tokens(budget_name, wanted + 2, payload["messages"])
+            parser = JsonArrayStream(key)
+            usage: Dict[str, Any] = {}
+            completion_estimate = 0
+            index = accepted = 0
+            deltas = llm_router.stream_chat("data_generation", payload, usage=usage, timeout=config.request_timeout)
+            try:
+                async for content in deltas:
+                    completion_estimate += estimate_tokens(content)
+                    for item in parser.feed(content):
+                        generated_items += 1
+                        index += 1
+                        if index <= 2:  # 前两条示例数据丢弃
+                            rejected["discarded_examples"] += 1
+                            continue
+                        if accept(item):
+                            accepted += 1
+                    if parser.done or accepted >= wanted:
+                        break
+            except httpx.HTTPError as e:
+                logger.warning(f"LLM调用失败 ({label} Iteration {iteration}): {e}")
+            except Exception as e:
+                logger.warning(f"LLM调用发生未知错误 ({label} Iteration {iteration}): {e}")
+            finally:
+                await deltas.aclose()
+                if not usage:
+                    # 提前停止读取时 vLLM 不会返回 usage，按文本长度估算
+                    usage = {
+                        "prompt_tokens": sum(estimate_tokens(m["content"]) for m in payload["messages"]),
+                        "completion_tokens": completion_estimate
+                    }
+                accumulate_usage(usage_totals, usage)
+                token_budget.record(budget_name, usage, payload["max_tokens"], items=index + parser.errors)
+
+            generated_items += parser.errors
+            rejected["invalid"] += parser.errors
+            if parser.errors:
+                logger.warning(f"{label} Iteration {iteration}: 跳过 {parser.errors} 条格式有误的条目")
+            if index == 0 and not parser.errors:
+                logger.warning(f"AI响应中未找到有效的{key} JSON结构 ({label} Iteration {iteration})")
+            return accepted
+
+        def generation_payload(system_prompt: str, prompt: str) -> Dict[str, Any]:
+            return {
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": 0.7,
+                "top_p": 0.95
+            }
 
+        # --- Stage 1: Generate Communities ---
+        async def community_batch(iteration: int, to_request: int):
             current_prompt_formatted = community_prompt_template.format(
-                num_communities=communities_to_request + 2, # +2 for example discarding
-                existing_data_str=existing_communities_str
+                num_communities=to_request + 2, # +2 for example discarding
+                existing_data_str=community_index.prompt_hint(sample_size)
             )
-            
-            logger.info(f"AI机器学习数据生成Prompt (Communities Iteration {current_iteration}): {current_prompt_formatted[:200]}...")
+            logger.info(f"AI机器学习数据生成Prompt (Communities Iteration {iteration}): {current_prompt_formatted[:200]}...")
 
-            messages = [
-                Message(role="system", content="你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟社团数据。请严格按照要求的JSON格式返回数据。请确保生成的数据是全新的，并且ID不与提供的已有数据重复。"),
-                Message(role="user", content=current_prompt_formatted)
-            ]
-            
-            chat_request = ChatRequest(
-                messages=messages,
-                model=config.default_model,
-                max_tokens=8000,
-                temperature=0.7,
-                top_p=0.95,
-                stream=False
+            def accept(item) -> bool:
+                try:
+                    community = CommunityItem(**dict(item, community_id=0))  # 模型给出的 ID 一律忽略
+                except Exception as e:
+                    rejected["invalid"] += 1
+                    logger.warning(f"解析单个社团条目时出错: {item}, 错误: {e} (Communities Iteration {iteration})")
+                    return False
+                community_text = f"{community.community_name}|{community.tags}"
+                if community_index.find_duplicate(community_text) is not None:
+                    rejected["near_duplicates"] += 1
+                    logger.warning(f"Skipping near-duplicate community: {community.community_name} (Communities Iteration {iteration})")
+                    return False
+                community.community_id = community_ids.next_id()
+                community_index.add(community.community_id, community_text,
+                                    f"- Name: {community.community_name}, Tags: {community.tags}")
+                all_communities.append(community)
+                known_community_ids.add(community.community_id)
+                entities_changed.set()
+                return True
+
+            payload = generation_payload(
+                "你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟社团数据。请严格按照要求的JSON格式返回数据。请确保生成的数据是全新的，不与提供的已有数据重复。",
+                current_prompt_formatted
             )
+            added = await stream_batch(payload, "communities", "Communities", iteration, accept, to_request)
+            logger.info(f"Communities Iteration {iteration}: Added {added} new communities. Total so far: {len(all_communities)}")
 
-            llm_response_content = ""
-            try:
-                chat_response = await chat(chat_request)
-                llm_response_content = chat_response.response
-            except HTTPException as e:
-                logger.warning(f"LLM调用失败 (Communities Iteration {current_iteration}): {e.detail}")
-                continue
-            except Exception as e:
-                logger.warning(f"LLM调用发生未知错误 (Communities Iteration {current_iteration}): {e}")
-                continue
-
-            if not llm_response_content.strip():
-                logger.warning(f"AI未返回有效的响应内容 (Communities Iteration {current_iteration})。")
-                continue
-
-            json_string = llm_response_content.strip()
-            if json_string.startswith("```json") and json_string.endswith("```"):
-                json_string = json_string[len("```json"): -len("```")].strip()
-            
-            match = re.search(r'"communities":\s*\[.*?\]', json_string, re.DOTALL) # More specific regex for communities list
-            if not match:
-                logger.warning(f"AI响应中未找到有效的communities JSON结构 (Communities Iteration {current_iteration}): {llm_response_content[:200]}...")
-                continue
-            
-            try:
-                # Extract only the communities array for parsing
-                communities_array_str = "{\"communities\": " + match.group(0).split(':', 1)[1] + "}"
-                parsed_response = json.loads(communities_array_str)
-                communities_data = parsed_response.get("communities", [])
-
-                existing_community_ids = {c.community_id for c in all_communities}
-                new_communities_batch = []
-                for item in communities_data[2:]:
-                    try:
-                        community = CommunityItem(**item)
-                        if community.community_id not in existing_community_ids:
-                            new_communities_batch.append(community)
-                            existing_community_ids.add(community.community_id)
-                        else:
-                            logger.warning(f"Skipping duplicate community ID: {community.community_id} (Communities Iteration {current_iteration})")
-                    except Exception as e:
-                        logger.warning(f"解析单个社团条目时出错: {item}, 错误: {e} (Communities Iteration {current_iteration})")
-
-                all_communities.extend(new_communities_batch)
-                logger.info(f"Communities Iteration {current_iteration}: Added {len(new_communities_batch)} new communities. Total so far: {len(all_communities)}")
-
-            except json.JSONDecodeError as e:
-                logger.warning(f"AI响应不是有效的JSON (Communities Iteration {current_iteration}): {e}, 响应内容: {json_string[:200]}...")
-                continue
-            except Exception as e:
-                logger.warning(f"处理本批次社团数据时出错 (Communities Iteration {current_iteration}): {e}")
-                continue
-        
-        if not all_communities and request.num_communities > 0:
-            raise ValueError("未能生成任何社团数据")
-        
         # --- Stage 2: Generate Users ---
-        current_iteration = 0
-        while len(all_users) < request.num_users and current_iteration < max_iterations:
-            current_iteration += 1
-            users_to_request = min(LLM_BATCH_SIZE, request.num_users - len(all_users))
-
-            if users_to_request <= 0:
-                break
-
-            existing_users_str = "\n".join([f"- ID: {u.user_id}, Tags: {u.user_tags}" for u in all_users]) if all_users else "无"
-
+        async def user_batch(iteration: int, to_request: int):
             current_prompt_formatted = user_prompt_template.format(
-                num_users=users_to_request + 2, # +2 for example discarding
-                existing_data_str=existing_users_str
+                num_users=to_request + 2, # +2 for example discarding
+                existing_data_str=user_index.prompt_hint(sample_size)
             )
-            
-            logger.info(f"AI机器学习数据生成Prompt (Users Iteration {current_iteration}): {current_prompt_formatted[:200]}...")
+            logger.info(f"AI机器学习数据生成Prompt (Users Iteration {iteration}): {current_prompt_formatted[:200]}...")
 
-            messages = [
-                Message(role="system", content="你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟用户数据。请严格按照要求的JSON格式返回数据。请确保生成的数据是全新的，并且ID不与提供的已有数据重复。"),
-                Message(role="user", content=current_prompt_formatted)
-            ]
-            
-            chat_request = ChatRequest(
-                messages=messages,
-                model=config.default_model,
-                max_tokens=8000,
-                temperature=0.7,
-                top_p=0.95,
-                stream=False
+            def accept(item) -> bool:
+                try:
+                    user = UserItem(**dict(item, user_id=0))  # 模型给出的 ID 一律忽略
+                except Exception as e:
+                    rejected["invalid"] += 1
+                    logger.warning(f"解析单个用户条目时出错: {item}, 错误: {e} (Users Iteration {iteration})")
+                    return False
+                if user_index.find_duplicate(user.user_tags) is not None:
+                    rejected["duplicate_users"] += 1
+                    logger.warning(f"Skipping duplicate user tags: {user.user_tags} (Users Iteration {iteration})")
+                    return False
+                user.user_id = user_ids.next_id()
+                user_index.add(user.user_id, user.user_tags, f"- Tags: {user.user_tags}")
+                all_users.append(user)
+                known_user_ids.add(user.user_id)
+                entities_changed.set()
+                return True
+
+            payload = generation_payload(
+                "你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟用户数据。请严格按照要求的JSON格式返回数据。请确保生成的数据是全新的，不与提供的已有数据重复。",
+                current_prompt_formatted
             )
-
-            llm_response_content = ""
-            try:
-                chat_response = await chat(chat_request)
-                llm_response_content = chat_response.response
-            except HTTPException as e:
-                logger.warning(f"LLM调用失败 (Users Iteration {current_iteration}): {e.detail}")
-                continue
-            except Exception as e:
-                logger.warning(f"LLM调用发生未知错误 (Users Iteration {current_iteration}): {e}")
-                continue
-
-            if not llm_response_content.strip():
-                logger.warning(f"AI未返回有效的响应内容 (Users Iteration {current_iteration})。")
-                continue
-
-            json_string = llm_response_content.strip()
-            if json_string.startswith("```json") and json_string.endswith("```"):
-                json_string = json_string[len("```json"): -len("```")].strip()
-            
-            match = re.search(r'"users":\s*\[.*?\]', json_string, re.DOTALL) # More specific regex for users list
-            if not match:
-                logger.warning(f"AI响应中未找到有效的users JSON结构 (Users Iteration {current_iteration}): {llm_response_content[:200]}...")
-                continue
-            
-            try:
-                # Extract only the users array for parsing
-                users_array_str = "{\"users\": " + match.group(0).split(':', 1)[1] + "}"
-                parsed_response = json.loads(users_array_str)
-                users_data = parsed_response.get("users", [])
-
-                existing_user_ids = {u.user_id for u in all_users}
-                new_users_batch = []
-                for item in users_data[2:]:
-                    try:
-                        user = UserItem(**item)
-                        if user.user_id not in existing_user_ids:
-                            new_users_batch.append(user)
-                            existing_user_ids.add(user.user_id)
-                        else:
-                            logger.warning(f"Skipping duplicate user ID: {user.user_id} (Users Iteration {current_iteration})")
-                    except Exception as e:
-                        logger.warning(f"解析单个用户条目时出错: {item}, 错误: {e} (Users Iteration {current_iteration})")
-
-                all_users.extend(new_users_batch)
-                logger.info(f"Users Iteration {current_iteration}: Added {len(new_users_batch)} new users. Total so far: {len(all_users)}")
-
-            except json.JSONDecodeError as e:
-                logger.warning(f"AI响应不是有效的JSON (Users Iteration {current_iteration}): {e}, 响应内容: {json_string[:200]}...")
-                continue
-            except Exception as e:
-                logger.warning(f"处理本批次用户数据时出错 (Users Iteration {current_iteration}): {e}")
-                continue
-        
-        if not all_users and request.num_users > 0:
-            raise ValueError("未能生成任何用户数据")
+            added = await stream_batch(payload, "users", "Users", iteration, accept, to_request)
+            logger.info(f"Users Iteration {iteration}: Added {added} new users. Total so far: {len(all_users)}")
 
         # --- Stage 3: Generate Interactions ---
-        current_iteration = 0
-        # Collect all existing community and user IDs for the LLM to use
-        available_community_ids = [c.community_id for c in all_communities]
-        available_user_ids = [u.user_id for u in all_users]
-
-        if not available_community_ids or not available_user_ids:
-            logger.warning("没有足够的社团或用户数据来生成互动，跳过互动生成阶段。")
-            # If interactions are requested but no communities/users, we should still return what we have.
-            # raise ValueError("没有足够的社团或用户数据来生成互动") # Removed to allow partial generation
-
-        while len(all_interactions) < request.num_interactions and current_iteration < max_iterations and available_community_ids and available_user_ids:
-            current_iteration += 1
-            interactions_to_request = min(LLM_BATCH_SIZE, request.num_interactions - len(all_interactions))
-
-            if interactions_to_request <= 0:
-                break
-
-            existing_interactions_str = "\n".join([f"- UserID: {i.user_id}, CommunityID: {i.community_id}, Timestamp: {i.timestamp}" for i in all_interactions]) if all_interactions else "无"
-            existing_communities_str_for_interactions = "\n".join([f"- ID: {c}" for c in available_community_ids])
-            existing_users_str_for_interactions = "\n".join([f"- ID: {u}" for u in available_user_ids])
-
+        async def interaction_batch(iteration: int, to_request: int):
+            existing_interactions_str = "无"
+            if all_interactions:
+                sampled_interactions = random.sample(all_interactions, min(sample_size, len(all_interactions)))
+                existing_interactions_str = f"已生成 {len(all_interactions)} 条，以下为部分示例：\n" + "\n".join(
+                    [f"- UserID: {i.user_id}, CommunityID: {i.community_id}, Timestamp: {i.timestamp}" for i in sampled_interactions])
+
+            # prompt 中列出当前已有的社团/用户 ID（社团和用户阶段可能仍在进行，后续批次会看到更多 ID）
             current_prompt_formatted = interaction_prompt_template.format(
-                num_interactions=interactions_to_request + 2, # +2 for example discarding
-                existing_communities_str=existing_communities_str_for_interactions,
-                existing_users_str=existing_users_str_for_interactions,
+                num_interactions=to_request + 2, # +2 for example discarding
+                existing_communities_str="\n".join([f"- ID: {c.community_id}" for c in all_communities]),
+                existing_users_str="\n".join([f"- ID: {u.user_id}" for u in all_users]),
                 existing_interactions_str=existing_interactions_str
             )
-            
-            logger.info(f"AI机器学习数据生成Prompt (Interactions Iteration {current_iteration}): {current_prompt_formatted[:200]}...")
+            logger.info(f"AI机器学习数据生成Prompt (Interactions Iteration {iteration}): {current_prompt_formatted[:200]}...")
 
-            messages = [
-                Message(role="system", content="你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟用户-社团互动数据。请严格按照要求的JSON格式返回数据。请确保生成的数据是全新的，并且互动关系必须基于提供的社团和用户ID来创建。"),
-                Message(role="user", content=current_prompt_formatted)
-            ]
-            
-            chat_request = ChatRequest(
-                messages=messages,
-                model=config.default_model,
-                max_tokens=8000,
-                temperature=0.7,
-                top_p=0.95,
-                stream=False
+            def accept(item) -> bool:
+                try:
+                    interaction = InteractionItem(**item)
+                except Exception as e:
+                    rejected["invalid"] += 1
+                    logger.warning(f"解析单个互动条目时出错: {item}, 错误: {e} (Interactions Iteration {iteration})")
+                    return False
+                interaction_tuple = (interaction.user_id, interaction.community_id, interaction.timestamp)
+                if interaction_tuple in interaction_keys:
+                    rejected["duplicate_interactions"] += 1
+                    logger.warning(f"Skipping duplicate interaction: {interaction_tuple} (Interactions Iteration {iteration})")
+                    return False
+                # Validate if the user_id and community_id exist in our *already generated* communities and users
+                if interaction.user_id not in known_user_ids or interaction.community_id not in known_community_ids:
+                    rejected["invalid_references"] += 1
+                    logger.warning(f"Skipping interaction with invalid user_id ({interaction.user_id}) or community_id ({interaction.community_id}) not found in available IDs. (Interactions Iteration {iteration})")
+                    return False
+                all_interactions.append(interaction)
+                interaction_keys.add(interaction_tuple)
+                return True
+
+            payload = generation_payload(
+                "你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟用户-社团互动数据。请严格按照要求的JSON格式返回数据。请确保生成的数据是全新的，并且互动关系必须基于提供的社团和用户ID来创建。",
+                current_prompt_formatted
             )
+            added = await stream_batch(payload, "interactions", "Interactions", iteration, accept, to_request)
+            logger.info(f"Interactions Iteration {iteration}: Added {added} new interactions. Total so far: {len(all_interactions)}")
 
-            llm_response_content = ""
-            try:
-                chat_response = await chat(chat_request)
-                llm_response_content = chat_response.response
-            except HTTPException as e:
-                logger.warning(f"LLM调用失败 (Interactions Iteration {current_iteration}): {e.detail}")
-                continue
-            except Exception as e:
-                logger.warning(f"LLM调用发生未知错误 (Interactions Iteration {current_iteration}): {e}")
-                continue
-
-            if not llm_response_content.strip():
-                logger.warning(f"AI未返回有效的响应内容 (Interactions Iteration {current_iteration})。")
-                continue
-
-            json_string = llm_response_content.strip()
-            if json_string.startswith("```json") and json_string.endswith("```"):
-                json_string = json_string[len("```json"): -len("```")].strip()
-            
-            match = re.search(r'"interactions":\s*\[.*?\]', json_string, re.DOTALL) # More specific regex for interactions list
-            if not match:
-                logger.warning(f"AI响应中未找到有效的interactions JSON结构 (Interactions Iteration {current_iteration}): {llm_response_content[:200]}...")
-                continue
-            
+        # 社团和用户两个阶段互不依赖，并发执行；互动阶段在二者达到最低数量后即开始
+        entity_tasks = [
+            asyncio.create_task(run_stage("communities", request.num_communities, lambda: len(all_communities), community_batch)),
+            asyncio.create_task(run_stage("users", request.num_users, lambda: len(all_users), user_batch)),
+        ]
+        interaction_task = asyncio.create_task(run_stage(
+            "interactions", request.num_interactions, lambda: len(all_interactions), interaction_batch,
+            ready=interactions_ready))
+        try:
             try:
-                # Extract only the interactions array for parsing
-                interactions_array_str = "{\"interactions\": " + match.group(0).split(':', 1)[1] + "}"
-                parsed_response = json.loads(interactions_array_str)
-                interactions_data = parsed_response.get("interactions", [])
-
-                # For interactions, we need a way to check if an identical interaction (user_id, community_id, timestamp) already exists
-                existing_interaction_tuples = {(i.user_id, i.community_id, i.timestamp) for i in all_interactions}
-                
-                new_interactions_batch = []
-                for item in interactions_data[2:]:
-                    try:
-                        interaction = InteractionItem(**item)
-                        interaction_tuple = (interaction.user_id, interaction.community_id, interaction.timestamp)
-
-                        # Validate if the user_id and community_id exist in our *already generated and available* lists
-                        if interaction.user_id in available_user_ids and \
-                           interaction.community_id in available_community_ids and \
-                           interaction_tuple not in existing_interaction_tuples:
-                            new_interactions_batch.append(interaction)
-                            existing_interaction_tuples.add(interaction_tuple)
-                        else:
-                            # Log why an interaction was skipped (e.g., invalid ID or duplicate)
-                            if interaction_tuple in existing_interaction_tuples:
-                                logger.warning(f"Skipping duplicate interaction: {interaction_tuple} (Interactions Iteration {current_iteration})")
-                            else:
-                                logger.warning(f"Skipping interaction with invalid user_id ({interaction.user_id}) or community_id ({interaction.community_id}) not found in available IDs. (Interactions Iteration {current_iteration})")
-                    except Exception as e:
-                        logger.warning(f"解析单个互动条目时出错: {item}, 错误: {e} (Interactions Iteration {current_iteration})")
-                        continue
-                
-                all_interactions.extend(new_interactions_batch)
-                logger.info(f"Interactions Iteration {current_iteration}: Added {len(new_interactions_batch)} new interactions. Total so far: {len(all_interactions)}")
-
-            except json.JSONDecodeError as e:
-                logger.warning(f"AI响应不是有效的JSON (Interactions Iteration {current_iteration}): {e}, 响应内容: {json_string[:200]}...")
-                continue
-            except Exception as e:
-                logger.warning(f"处理本批次互动数据时出错 (Interactions Iteration {current_iteration}): {e}")
-                continue
+                await asyncio.gather(*entity_tasks)
+            finally:
+                entities_done.set()
+                entities_changed.set()
+
+            if not all_communities and request.num_communities > 0:
+                raise ValueError("未能生成任何社团数据")
+            if not all_users and request.num_users > 0:
+                raise ValueError("未能生成任何用户数据")
+            if request.num_interactions > 0 and (not all_communities or not all_users):
+                # If interactions are requested but no communities/users, we should still return what we have.
+                logger.warning("没有足够的社团或用户数据来生成互动，跳过互动生成阶段。")
+
+            await interaction_task
+        finally:
+            for task in entity_tasks + [interaction_task]:
+                task.cancel()
 
         # Final truncation to exact requested quantities
         final_communities = all_communities[:request.num_communities]
@@ -2818,7 +2517,13 @@ async def generate_ml_data(request: MLDataGenerationRequest):
             users=final_users,
             interactions=final_interactions,
             message=f"成功生成 {len(final_communities)} 条社团数据, {len(final_users)} 条用户数据, {len(final_interactions)} 条互动数据",
-            file_path=save_path
+            file_path=save_path,
+            stats=generation_stats(
+                usage_totals,
+                accepted=len(final_communities) + len(final_users) + len(final_interactions),
+                generated=generated_items,
+                rejected=rejected
+            )
         )
             
     except Exception as e:
@@ -2827,21 +2532,36 @@ async def generate_ml_data(request: MLDataGenerationRequest):
 
 @app.post("/generate_user_data", response_model=MLDataGenerationResponse)
 async def generate_user_data(request: MLDataGenerationRequest):
+    return await run_user_data_generation(request)
+
+async def run_user_data_generation(request: MLDataGenerationRequest, ctx: Optional[JobContext] = None):
     """
     根据机器学习需求，使用AI生成模拟的社团、用户和互动数据。
     生成过程分为三个阶段：社团信息、个人偏好、以及基于前两者的互动信息。
     
     Args:
         request: 包含生成数量（社团、用户、互动）的请求体。
+        ctx: 后台任务上下文，每轮生成前保存检查点，重启后从已生成的数据继续。
         
     Returns:
         MLDataGenerationResponse: 包含生成的社团、用户和互动数据。
     """
+    ctx = ctx or NullJobContext()
     try:
         # 固定每个批次LLM调用生成数量（为了多样性）
         LLM_BATCH_SIZE = 10 # 统一批次大小，LLM返回的实际数量会是这个值减2
 
-        all_users = []
+        all_users = [UserItem(**u) for u in ctx.state.get("users", [])]
+
+        # 已生成用户的去重索引：prompt 中只放有限的样例，生成后再拒绝重复/高度相似的用户
+        user_index = DedupIndex(threshold=config.ml_dedup_threshold)
+        for u in all_users:
+            user_index.add(u.user_id, f"{u.username}|{u.email}", f"- Username: {u.username}, Email: {u.email}")
+        # 模型只生成内容字段，条目被接受后由服务器分配 ID
+        user_ids = IdAllocator(u.user_id for u in all_users)
+        usage_totals: Dict[str, int] = {}
+        generated_items = 0
+        rejected = dict.fromkeys(["invalid", "near_duplicates"], 0)
 
         user_prompt_template = """
 你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟用户数据。
@@ -2850,14 +2570,12 @@ async def generate_user_data(request: MLDataGenerationRequest):
 
 
 
-**重要：你必须生成与已提供数据不重复的全新数据。生成的 user_id 必须是未出现过的新ID。**
+**重要：你必须生成与已提供数据不重复的全新数据。用户 ID 由系统分配，无需生成。**
 
 
 
 **数据模型:**
 
--   `user_id`: 整型，用户的唯一ID。
-
 -   `username`: 字符串，用户名，例如 "user_001", "admin_test"。
 
 -   `email`: 字符串，电子邮件地址，例如 "user001@example.com"。
@@ -2878,8 +2596,6 @@ async def generate_user_data(request: MLDataGenerationRequest):
 
 -   `password` 和 `avatar_url` 字段无需生成，它们将由其他系统处理。
 
--   `user_id` 应从 1 开始递增，确保在当前批次中唯一。
-
 
 
 **生成数量要求:**
@@ -2896,9 +2612,9 @@ async def generate_user_data(request: MLDataGenerationRequest):
 
   "users": [
 
-    {{\"user_id\": 1, \"username\": \"testadmin\", \"email\": \"aabb@cc.com\", \"role\": \"admin\", \"created_at\": \"2025-06-24T16:04:30.705418\", \"updated_at\": \"2025-07-04T09:22:57.908024\", \"last_active_at\": \"2025-06-25T19:44:11.12609\", \"extension\": {{\"realName\":\"张三\",\"studentId\":\"20230001\",\"major\":\"计算机学院\",\"bio\":\"热爱编程和篮球\",\"preferences\":{{\"interestedCategories\":[\"科技\",\"运动\"],\"emailNotifications\":true,\"applicationNotifications\":true,\"activityNotifications\":false,\"profilePublic\":true,\"showJoinedClubs\":true}},\"tags\":[\"开朗外向\",\"逻辑清晰\"],\"phone\":\"138xxxx1234\"}}}},
+    {{\"username\": \"testadmin\", \"email\": \"aabb@cc.com\", \"role\": \"admin\", \"created_at\": \"2025-06-24T16:04:30.705418\", \"updated_at\": \"2025-07-04T09:22:57.908024\", \"last_active_at\": \"2025-06-25T19:44:11.12609\", \"extension\": {{\"realName\":\"张三\",\"studentId\":\"20230001\",\"major\":\"计算机学院\",\"bio\":\"热爱编程和篮球\",\"preferences\":{{\"interestedCategories\":[\"科技\",\"运动\"],\"emailNotifications\":true,\"applicationNotifications\":true,\"activityNotifications\":false,\"profilePublic\":true,\"showJoinedClubs\":true}},\"tags\":[\"开朗外向\",\"逻辑清晰\"],\"phone\":\"138xxxx1234\"}}}},
 
-    {{\"user_id\": 2, \"username\": \"normaluser\", \"email\": \"user@example.com\", \"role\": \"user\", \"created_at\": \"2025-06-25T10:00:00.000000\", \"updated_at\": \"2025-07-05T10:30:00.000000\", \"last_active_at\": \"2025-07-05T11:00:00.000000\", \"extension\": {{\"realName\":\"李四\",\"studentId\":\"20230002\",\"major\":\"软件工程\",\"bio\":\"喜欢户外活动\",\"preferences\":{{\"interestedCategories\":[\"户外\",\"音乐\"],\"emailNotifications\":true,\"applicationNotifications\":false,\"activityNotifications\":true,\"profilePublic\":true,\"showJoinedClubs\":false}},\"tags\":[\"活泼开朗\",\"乐于助人\"],\"phone\":\"139xxxx5678\"}}}}
+    {{\"username\": \"normaluser\", \"email\": \"user@example.com\", \"role\": \"user\", \"created_at\": \"2025-06-25T10:00:00.000000\", \"updated_at\": \"2025-07-05T10:30:00.000000\", \"last_active_at\": \"2025-07-05T11:00:00.000000\", \"extension\": {{\"realName\":\"李四\",\"studentId\":\"20230002\",\"major\":\"软件工程\",\"bio\":\"喜欢户外活动\",\"preferences\":{{\"interestedCategories\":[\"户外\",\"音乐\"],\"emailNotifications\":true,\"applicationNotifications\":false,\"activityNotifications\":true,\"profilePublic\":true,\"showJoinedClubs\":false}},\"tags\":[\"活泼开朗\",\"乐于助人\"],\"phone\":\"139xxxx5678\"}}}}
 
     // ... 其他用户数据 ...
 
@@ -2916,6 +2632,8 @@ async def generate_user_data(request: MLDataGenerationRequest):
         # --- Stage 2: Generate Users ---
         current_iteration = 0
         while len(all_users) < request.num_users and current_iteration < max_iterations:
+            await ctx.checkpoint({"users": [u.dict() for u in all_users]},
+                                 progress=len(all_users), total=request.num_users)
             current_iteration += 1
             users_to_request = min(LLM_BATCH_SIZE, request.num_users - len(all_users))
 
@@ -2924,13 +2642,9 @@ async def generate_user_data(request: MLDataGenerationRequest):
 
             existing_users_str = "" # We'll let LLM handle uniqueness within batch and start from 1
             if all_users:
-                # Pass existing user IDs and maybe a few other details to help LLM avoid duplicates/generate new ones
-                existing_users_str = "\n".join([
-                    f"- ID: {u.user_id}, Username: {u.username}, Email: {u.email}"
-                    for u in all_users
-                ])
+                # 只传数量、ID 范围和少量样例，prompt 长度不随已生成数量增长
+                existing_users_str = user_index.prompt_hint(config.ml_prompt_sample_size)
                 existing_users_str = f"**已有用户数据 (请在此基础上生成新的、不重复的用户):**\n{existing_users_str}\n"
-            
 
             current_prompt_formatted = user_prompt_template.format(
                 num_users=users_to_request + 2, # +2 for example discarding
@@ -2940,14 +2654,15 @@ async def generate_user_data(request: MLDataGenerationRequest):
             logger.info(f"AI用户数据生成Prompt (Users Iteration {current_iteration}): {current_prompt_formatted[:200]}...")
 
             messages = [
-                Message(role="system", content="你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟用户数据。请严格按照要求的JSON格式返回数据。请确保生成的数据是全新的，并且ID不与提供的已有数据重复。"),
+                Message(role="system", content="你是一个顶尖的数据生成AI，专注于为机器学习任务生成高质量、结构化的模拟用户数据。请严格按照要求的JSON格式返回数据。请确保生成的数据是全新的，不与提供的已有数据重复。"),
                 Message(role="user", content=current_prompt_formatted)
             ]
             
+            max_tokens = token_budget.items_max_tokens("ml_users", users_to_request + 2, [m.dict() for m in messages])
             chat_request = ChatRequest(
                 messages=messages,
                 model=config.default_model,
-                max_tokens=8000,
+                max_tokens=max_tokens,
                 temperature=0.7,
                 top_p=0.95,
                 stream=False
@@ -2957,6 +2672,8 @@ async def generate_user_data(request: MLDataGenerationRequest):
             try:
                 chat_response = await chat(chat_request)
                 llm_response_content = chat_response.response
+                accumulate_usage(usage_totals, chat_response.usage)
+                token_budget.record("ml_users", chat_response.usage, max_tokens, items=users_to_request + 2)
             except HTTPException as e:
                 logger.warning(f"LLM调用失败 (Users Iteration {current_iteration}): {e.detail}")
                 continue
@@ -2983,7 +2700,7 @@ async def generate_user_data(request: MLDataGenerationRequest):
                 parsed_response = json.loads(users_array_str)
                 users_data = parsed_response.get("users", [])
 
-                existing_user_ids = {u.user_id for u in all_users}
+                generated_items += len(users_data)
                 new_users_batch = []
                 for item in users_data:
                     try:
@@ -2992,16 +2709,21 @@ async def generate_user_data(request: MLDataGenerationRequest):
                             try:
                                 item['extension'] = json.loads(item['extension'])
                             except json.JSONDecodeError as json_err:
-                                logger.warning(f"Error decoding extension JSON string for user item: {item.get('user_id', 'N/A')}, Error: {json_err}. Original string: {item['extension'][:100]}...")
+                                rejected["invalid"] += 1
+                                logger.warning(f"Error decoding extension JSON string for user item: {item.get('username', 'N/A')}, Error: {json_err}. Original string: {item['extension'][:100]}...")
                                 continue # Skip this item if extension is malformed
                             
-                        user = UserItem(**item)
-                        if user.user_id not in existing_user_ids:
-                            new_users_batch.append(user)
-                            existing_user_ids.add(user.user_id)
-                        else:
-                            logger.warning(f"Skipping duplicate user ID: {user.user_id} (Users Iteration {current_iteration})")
+                        user = UserItem(**dict(item, user_id=0))  # 模型给出的 ID 一律忽略
+                        user_text = f"{user.username}|{user.email}"
+                        if user_index.find_duplicate(user_text) is not None:
+                            rejected["near_duplicates"] += 1
+                            logger.warning(f"Skipping near-duplicate user: {user.username} (Users Iteration {current_iteration})")
+                            continue
+                        user.user_id = user_ids.next_id()
+                        user_index.add(user.user_id, user_text, f"- Username: {user.username}, Email: {user.email}")
+                        new_users_batch.append(user)
                     except Exception as e:
+                        rejected["invalid"] += 1
                         logger.warning(f"解析单个用户条目时出错: {item}, 错误: {e} (Users Iteration {current_iteration})")
 
                 all_users.extend(new_users_batch)
@@ -3047,7 +2769,9 @@ async def generate_user_data(request: MLDataGenerationRequest):
         return MLDataGenerationResponse(
             users=final_users,
             message=f"成功生成 {len(final_users)} 条用户数据",
-            file_path=save_path
+            file_path=save_path,
+            stats=generation_stats(usage_totals, accepted=len(final_users),
+                                   generated=generated_items, rejected=rejected)
         )
             
     except Exception as e:
@@ -3055,6 +2779,106 @@ async def generate_user_data(request: MLDataGenerationRequest):
         raise HTTPException(status_code=500, detail=f"AI机器学习数据生成失败: {e}")
 
 
+# ---- 后台任务 ----
+async def training_data_job(params: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    request = TrainingDataGenerationRequest(**params)
+    response = await run_training_data_generation(request, ctx)
+    if server_should_exit and response.generated_count < request.total_count:
+        raise JobInterrupted("服务器正在关闭，任务将在重启后继续")
+    result = response.dict()
+    if request.save_file:
+        result["file_path"] = os.path.join(current_dir, "generated_data", request.save_file)
+    return result
+
+async def ml_data_job(params: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    response = await run_ml_data_generation(MLDataGenerationRequest(**params), ctx)
+    return response.dict()
+
+async def user_data_job(params: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    response = await run_user_data_generation(MLDataGenerationRequest(**params), ctx)
+    return response.dict()
+
+# 任务类型 -> (请求模型, 处理函数)
+JOB_KINDS = {
+    "training_data": (TrainingDataGenerationRequest, training_data_job),
+    "ml_data": (MLDataGenerationRequest, ml_data_job),
+    "user_data": (MLDataGenerationRequest, user_data_job),
+}
+for _kind, (_, _handler) in JOB_KINDS.items():
+    job_manager.register(_kind, _handler)
+
+def get_job_or_404(job_id: str) -> Dict[str, Any]:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+@app.post("/jobs/{kind}")
+async def submit_job(kind: str, params: Dict[str, Any] = Body(default={})):
+    """
+    提交后台生成任务，立即返回任务 ID。
+    kind 可选值: training_data, ml_data, user_data；请求体与对应的同步接口相同。
+    """
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=404, detail=f"未知的任务类型: {kind}，可选值: {list(JOB_KINDS)}")
+    request_model, _ = JOB_KINDS[kind]
+    try:
+        validated = request_model(**params).dict()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"任务参数无效: {e}")
+    job = await job_manager.submit(kind, validated)
+    return job_manager.summary(job)
+
+@app.get("/jobs")
+async def list_jobs():
+    return [job_manager.summary(job) for job in job_manager.list()]
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return job_manager.summary(get_job_or_404(job_id))
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """以 SSE 推送任务进度，任务结束后关闭连接"""
+    get_job_or_404(job_id)
+
+    async def event_stream():
+        async for snapshot in job_manager.events(job_id):
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    get_job_or_404(job_id)
+    job = await job_manager.cancel(job_id)
+    return job_manager.summary(job)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = get_job_or_404(job_id)
+    if job["status"] != JOB_COMPLETED:
+        raise HTTPException(status_code=409, detail=f"任务尚未完成，当前状态: {job['status']}")
+    result = job_manager.load_result(job_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="任务结果文件不存在")
+    return JSONResponse(content=result)
+
+@app.get("/jobs/{job_id}/result/file")
+async def download_job_output(job_id: str):
+    """下载任务生成的数据文件"""
+    job = get_job_or_404(job_id)
+    if job["status"] != JOB_COMPLETED:
+        raise HTTPException(status_code=409, detail=f"任务尚未完成，当前状态: {job['status']}")
+    output_file = job.get("output_file")
+    if not output_file or not os.path.exists(output_file):
+        raise HTTPException(status_code=404, detail="任务没有生成数据文件")
+    return FileResponse(output_file, filename=os.path.basename(output_file))
+
+
 if __name__ == "__main__":
     print(f"启动vLLM代理服务器...")
     print(f"服务器地址: http://{config.server_host}:{config.server_port}")
@@ -3081,6 +2905,7 @@ if __name__ == "__main__":
     print(f"训练数据生成接口: http://{config.server_host}:{config.server_port}/generate_training_data")
     print(f"机器学习数据生成接口: http://{config.server_host}:{config.server_port}/generate_ml_data")
     print(f"用户数据生成接口: http://{config.server_host}:{config.server_port}/generate_user_data")
+    print(f"后台任务接口: http://{config.server_host}:{config.server_port}/jobs/{{training_data|ml_data|user_data}}")
     
     # 使用自定义的uvicorn配置类来支持优雅停机
     class UvicornServer(uvicorn.Server):
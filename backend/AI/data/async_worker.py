@@ -0,0 +1,307 @@
+"""
+基于 asyncio 的 Redis Stream 同步 worker（standalone.run_sync_worker 的异步版本）。
+
+读取、解码、写入、确认四个阶段各自是一个协程，阶段之间用有界队列连接：
+写盘慢时写入队列被填满，解码阶段随之阻塞，读取阶段也就不再拉取新消息（背压），
+而不会像同步版本那样让一次慢写盘卡住整个循环。文件写入通过 asyncio.to_thread
+交给线程执行，复用 standalone 中的长期写入器。
+
+收到 SIGTERM/SIGINT 后停止拉取新消息，已经读到的消息全部写入并确认后才退出。
+每个阶段记录处理耗时，定期输出 p50/p95。
+
+命令行:
+    python async_worker.py           # 连接 standalone 中配置的 Redis
+    python async_worker.py --fake    # 使用 fakeredis（需要安装 fakeredis）在本地试运行
+"""
+import argparse
+import asyncio
+import logging
+import signal
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from redis import asyncio as aioredis
+from redis import exceptions
+
+import standalone
+from compactor import BackgroundCompactor
+from extract_club_data import extract_club_data
+
+logger = logging.getLogger(__name__)
+
+# 配置
+QUEUE_MAXSIZE: int = 8  # 每个阶段间队列最多缓存的批次数
+BLOCK_TIMEOUT_MS: int = 2000  # XREADGROUP 阻塞时间，决定停止请求的最长响应延迟
+RECONNECT_BACKOFF_MIN: float = 0.5  # Redis 连接失败后的初始退避时间（秒）
+RECONNECT_BACKOFF_MAX: float = 30.0
+EXTRACT_INTERVAL_SECONDS: float = 5.0  # 有新数据时重新提取社团数据的最小间隔
+METRICS_REPORT_SECONDS: float = 60.0  # 阶段耗时报告间隔
+
+_STOP = object()  # 队列中的结束标记
+
+
+class StageMetrics:
+    """记录单个阶段最近若干批次的处理耗时"""
+
+    def __init__(self, name: str, window: int = 1024):
+        self.name = name
+        self.count = 0
+        self.items = 0
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float, items: int = 0):
+        self.count += 1
+        self.items += items
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "batches": self.count,
+            "items": self.items,
+            "p50_ms": round(self.percentile(0.50) * 1000, 2),
+            "p95_ms": round(self.percentile(0.95) * 1000, 2),
+            "max_ms": round(max(self.samples, default=0.0) * 1000, 2),
+        }
+
+
+class AsyncSyncWorker:
+    """
+    异步同步 worker。redis_client 为 redis.asyncio 客户端（decode_responses=False），
+    也可以是 fakeredis 的异步客户端。
+    """
+
+    def __init__(self, redis_client, output_file: str = standalone.LOCAL_OUTPUT_FILE,
+                 stream: str = standalone.REDIS_STREAM_NAME,
+                 group: str = standalone.REDIS_CONSUMER_GROUP_NAME,
+                 consumer: str = standalone.REDIS_CONSUMER_NAME,
+                 batch_count: int = standalone.REDIS_MESSAGES_PER_PULL,
+                 block_ms: int = BLOCK_TIMEOUT_MS, queue_maxsize: int = QUEUE_MAXSIZE):
+        self.redis = redis_client
+        self.output_file = output_file
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.batch_count = batch_count
+        self.block_ms = block_ms
+        self.decode_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_maxsize)
+        self.write_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_maxsize)
+        self.ack_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_maxsize)
+        self.metrics = {name: StageMetrics(name) for name in ("read", "decode", "write", "ack")}
+        self._stopping = asyncio.Event()
+        self._data_changed = asyncio.Event()
+
+    def stop(self):
+        """请求停止：不再拉取新消息，已读取的消息处理完后退出"""
+        if not self._stopping.is_set():
+            logger.info("收到停止请求，正在排空队列...")
+            self._stopping.set()
+
+    async def ensure_consumer_group(self):
+        """与同步版本一致：创建消费者组，已存在时重置到流的开头"""
+        try:
+            await self.redis.xgroup_create(name=self.stream, groupname=self.group, id='0', mkstream=True)
+        except exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+            try:
+                await self.redis.xgroup_destroy(self.stream, self.group)
+                await self.redis.xgroup_create(name=self.stream, groupname=self.group, id='0', mkstream=True)
+            except Exception as e:
+                logger.error(f"重置消费者组失败: {e}")
+                raise
+
+    async def _sleep_unless_stopping(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def read_stage(self):
+        backoff = RECONNECT_BACKOFF_MIN
+        try:
+            while not self._stopping.is_set():
+                start = time.perf_counter()
+                try:
+                    messages = await self.redis.xreadgroup(
+                        groupname=self.group,
+                        consumername=self.consumer,
+                        streams={self.stream: '>'},
+                        count=self.batch_count,
+                        block=self.block_ms
+                    )
+                except exceptions.ConnectionError as e:
+                    logger.error(f"Redis 连接错误: {e}. {backoff:.1f} 秒后重试...")
+                    await self._sleep_unless_stopping(backoff)
+                    backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                    continue
+                backoff = RECONNECT_BACKOFF_MIN
+
+                if not messages:
+                    # interval 策略下空闲时也要按时落盘
+                    await asyncio.to_thread(standalone.get_output_writer(self.output_file).tick)
+                    continue
+
+                # messages[0][0] 是 stream name, messages[0][1] 是消息列表
+                message_list = messages[0][1]
+                self.metrics["read"].record(time.perf_counter() - start, len(message_list))
+                await self.decode_queue.put(message_list)  # 下游处理不过来时在这里等待
+        finally:
+            await self.decode_queue.put(_STOP)
+
+    async def decode_stage(self):
+        while True:
+            message_list = await self.decode_queue.get()
+            if message_list is _STOP:
+                await self.write_queue.put(_STOP)
+                return
+            start = time.perf_counter()
+            msg_ids, records = standalone.parse_messages(message_list)
+            self.metrics["decode"].record(time.perf_counter() - start, len(message_list))
+            await self.write_queue.put((msg_ids, records))
+
+    async def write_stage(self):
+        while True:
+            item = await self.write_queue.get()
+            if item is _STOP:
+                await self.ack_queue.put(_STOP)
+                return
+            msg_ids, records = item
+            if records:
+                start = time.perf_counter()
+                try:
+                    await asyncio.to_thread(standalone.commit_records, self.output_file, records)
+                except Exception as e:
+                    logger.error(f"写入本地文件失败: {str(e)}", extra={"msg_id": "batch_operation"})
+                    continue  # 不 ACK，以便重试
+                self.metrics["write"].record(time.perf_counter() - start, len(records))
+                self._data_changed.set()
+            await self.ack_queue.put(msg_ids)
+
+    async def ack_stage(self):
+        while True:
+            msg_ids = await self.ack_queue.get()
+            if msg_ids is _STOP:
+                return
+            if not msg_ids:
+                continue
+            start = time.perf_counter()
+            try:
+                await self.redis.xack(self.stream, self.group, *msg_ids)
+            except exceptions.RedisError as e:
+                # 未确认的消息留在 pending 列表中，不影响后续批次
+                logger.error(f"确认消息失败: {e}")
+                continue
+            self.metrics["ack"].record(time.perf_counter() - start, len(msg_ids))
+
+    async def extract_stage(self):
+        """有新数据时定期重新提取社团数据，而不是每批都提取一次"""
+        while True:
+            await self._data_changed.wait()
+            self._data_changed.clear()
+            try:
+                await asyncio.to_thread(extract_club_data)
+                logger.info("社团数据已提取并保存")
+            except Exception as e:
+                logger.error(f"提取社团数据失败: {e}")
+            await asyncio.sleep(EXTRACT_INTERVAL_SECONDS)
+
+    async def report_stage(self):
+        while True:
+            await asyncio.sleep(METRICS_REPORT_SECONDS)
+            self.log_metrics()
+
+    def log_metrics(self):
+        for name, stage in self.metrics.items():
+            snap = stage.snapshot()
+            logger.info(
+                f"[{name}] 批次 {snap['batches']}，条目 {snap['items']}，"
+                f"p50 {snap['p50_ms']} ms，p95 {snap['p95_ms']} ms，最大 {snap['max_ms']} ms")
+        logger.info(
+            f"队列深度: decode {self.decode_queue.qsize()}，write {self.write_queue.qsize()}，"
+            f"ack {self.ack_queue.qsize()}")
+
+    async def run(self):
+        # 加载已存在的 ID（与同步版本共用 seen_ids；解码阶段预留 id，写入失败时释放，见 standalone.commit_records）
+        await asyncio.to_thread(standalone.load_existing_ids, self.output_file)
+        await self.ensure_consumer_group()
+
+        background = [
+            asyncio.create_task(self.extract_stage(), name="extract"),
+            asyncio.create_task(self.report_stage(), name="report"),
+        ]
+        pipeline = [
+            asyncio.create_task(self.read_stage(), name="read"),
+            asyncio.create_task(self.decode_stage(), name="decode"),
+            asyncio.create_task(self.write_stage(), name="write"),
+            asyncio.create_task(self.ack_stage(), name="ack"),
+        ]
+        try:
+            await asyncio.gather(*pipeline)
+        finally:
+            for task in pipeline + background:
+                task.cancel()
+            await asyncio.gather(*pipeline, *background, return_exceptions=True)
+            if self._data_changed.is_set():
+                try:
+                    await asyncio.to_thread(extract_club_data)
+                except Exception as e:
+                    logger.error(f"提取社团数据失败: {e}")
+            self.log_metrics()
+
+
+def create_redis_client(fake: bool = False):
+    if fake:
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit("--fake 需要先安装 fakeredis: pip install fakeredis")
+        return fakeredis.aioredis.FakeRedis(decode_responses=False)
+    return aioredis.Redis(
+        host=standalone.REDIS_HOST,
+        port=standalone.REDIS_PORT,
+        password=standalone.REDIS_PASSWORD,
+        decode_responses=False  # 禁用自动解码功能
+    )
+
+
+async def main(fake: bool = False):
+    redis_client = create_redis_client(fake)
+    worker = AsyncSyncWorker(redis_client)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    compactor: Optional[BackgroundCompactor] = None
+    if standalone.COMPACTION_INTERVAL_SECONDS > 0:
+        compactor = BackgroundCompactor(
+            worker.output_file,
+            writer=standalone.get_output_writer(worker.output_file),
+            interval_seconds=standalone.COMPACTION_INTERVAL_SECONDS,
+            min_growth_bytes=standalone.COMPACTION_MIN_GROWTH_BYTES
+        )
+        compactor.start()
+
+    try:
+        await worker.run()
+    finally:
+        if compactor is not None:
+            compactor.stop()
+        standalone.close_output_writers()
+        close = getattr(redis_client, 'aclose', None) or redis_client.close
+        await close()
+        logger.info("异步同步 worker 已退出")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="异步 Redis Stream 同步 worker")
+    parser.add_argument('--fake', action='store_true', help="使用 fakeredis 代替真实 Redis")
+    args = parser.parse_args()
+    asyncio.run(main(fake=args.fake))
@@ -0,0 +1,224 @@
+"""
+同步日志（local_synced_data.jsonl）的最新版本压缩。
+
+同步日志只追加写入，同一个 id 的文档更新后旧版本仍留在文件中，删除则以
+墓碑记录 {"id": ..., "deleted": true} 表示。压缩会把当前文件及已轮转的分段
+重写为一个文件：每个 id 只保留最新版本（位置保持首次出现的位置，保证帖子仍排在
+所属社团之后），被墓碑删除的 id 连同墓碑一起移除，最后原子替换原文件。
+
+压缩期间同步进程可以继续写入：先在不持锁的情况下处理快照，替换前再在写入器锁内
+把快照之后追加的数据原样拷贝到新文件末尾。
+
+命令行:
+    python compactor.py local_synced_data.jsonl
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Dict, Iterable, List, Optional
+
+from jsonl_writer import rotated_files
+
+logger = logging.getLogger(__name__)
+
+
+def is_tombstone(record: Dict[str, Any]) -> bool:
+    return bool(record.get('deleted'))
+
+
+def make_tombstone(doc_id: str) -> Dict[str, Any]:
+    return {"id": doc_id, "deleted": True}
+
+
+def latest_records(records: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    在读取端做与压缩相同的合并：每个 id 只保留最新版本（位置为首次出现的位置），
+    被墓碑删除的 id 不返回。用于在压缩之前读取同步日志。
+    """
+    latest: Dict[str, Dict[str, Any]] = {}
+    for record in records:
+        doc_id = record.get('id')
+        if doc_id is None:
+            continue
+        if is_tombstone(record):
+            latest.pop(doc_id, None)
+        else:
+            latest[doc_id] = record
+    return list(latest.values())
+
+
+def _read_latest(files, current_path: str, current_limit: int):
+    """
+    读取所有分段（当前文件只读到 current_limit），返回 (id -> 原始行, 行数, 解析耗时)。
+    """
+    latest: Dict[str, bytes] = {}
+    passthrough = []  # 无法解析或没有 id 的行原样保留
+    line_count = 0
+    start = time.perf_counter()
+    for path in files:
+        with open(path, 'rb') as f:
+            remaining = current_limit if path == current_path else None
+            for line in f:
+                if remaining is not None:
+                    if remaining <= 0:
+                        break
+                    if len(line) > remaining:
+                        break  # 快照边界上的半行留给尾部拷贝处理
+                    remaining -= len(line)
+                if not line.strip():
+                    continue
+                line_count += 1
+                try:
+                    record = json.loads(line)
+                    doc_id = record['id']
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    passthrough.append(line)
+                    continue
+                if is_tombstone(record):
+                    latest.pop(doc_id, None)
+                else:
+                    # 覆盖值时 dict 保留首次出现的位置
+                    latest[doc_id] = line if line.endswith(b'\n') else line + b'\n'
+    return latest, passthrough, line_count, time.perf_counter() - start
+
+
+def _timed_parse(path: str) -> float:
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                try:
+                    json.loads(line)
+                except json.JSONDecodeError:
+                    pass
+    return time.perf_counter() - start
+
+
+def compact_jsonl(path: str, writer=None) -> Optional[Dict[str, Any]]:
+    """
+    压缩同步日志。writer 为正在写入该文件的 JsonlAppendWriter（可选），
+    用于在替换前后加锁、刷新和重新打开文件。返回压缩报告；无需压缩或被中止时返回 None。
+    """
+    if not os.path.exists(path):
+        return None
+
+    lock = writer.lock if writer is not None else nullcontext()
+    with lock:
+        if writer is not None:
+            writer.flush()
+        snapshot_size = os.path.getsize(path)
+        snapshot_rotated = rotated_files(path)
+    files = snapshot_rotated + [path]
+    size_before = sum(os.path.getsize(f) for f in snapshot_rotated) + snapshot_size
+
+    latest, passthrough, lines_before, read_before = _read_latest(files, path, snapshot_size)
+
+    tmp_path = path + '.compact.tmp'
+    with open(tmp_path, 'wb') as out:
+        for line in passthrough:
+            out.write(line if line.endswith(b'\n') else line + b'\n')
+        for line in latest.values():
+            out.write(line)
+        written_size = out.tell()
+
+        with lock:
+            if writer is not None:
+                writer.flush()
+            if rotated_files(path) != snapshot_rotated:
+                logger.warning("压缩期间发生了文件轮转，本次压缩中止")
+                out.close()
+                os.remove(tmp_path)
+                return None
+            # 拷贝快照之后追加的数据（可能以快照边界上的半行开头，按行边界对齐）
+            with open(path, 'rb') as src:
+                src.seek(snapshot_size)
+                tail = src.read()
+            if snapshot_size > 0:
+                with open(path, 'rb') as src:
+                    src.seek(snapshot_size - 1)
+                    if src.read(1) != b'\n':
+                        # 快照在行中间截断：_read_latest 已跳过该半行，这里从其行首补齐
+                        src.seek(0)
+                        head = src.read(snapshot_size)
+                        line_start = head.rfind(b'\n') + 1
+                        tail = head[line_start:] + tail
+            out.write(tail)
+            out.flush()
+            os.fsync(out.fileno())
+            out.close()
+
+            os.replace(tmp_path, path)
+            for rotated in snapshot_rotated:
+                os.remove(rotated)
+            if writer is not None:
+                writer.reopen()
+
+    size_after = os.path.getsize(path)
+    read_after = _timed_parse(path)
+    report = {
+        "lines_before": lines_before,
+        "lines_after": len(latest) + len(passthrough),
+        "tail_bytes": size_after - written_size,
+        "size_before": size_before,
+        "size_after": size_after,
+        "read_seconds_before": read_before,
+        "read_seconds_after": read_after,
+    }
+    logger.info(
+        f"同步日志压缩完成: {lines_before} 行 -> {report['lines_after']} 行，"
+        f"{size_before / 1024:.1f} KB -> {size_after / 1024:.1f} KB，"
+        f"全量读取 {read_before * 1000:.1f} ms -> {read_after * 1000:.1f} ms")
+    return report
+
+
+class BackgroundCompactor(threading.Thread):
+    """
+    后台定时压缩线程。每隔 interval_seconds 检查一次，
+    只有日志自上次压缩后增长超过 min_growth_bytes 时才执行压缩。
+    """
+
+    def __init__(self, path: str, writer=None, interval_seconds: float = 3600, min_growth_bytes: int = 1 << 20):
+        super().__init__(name="jsonl-compactor", daemon=True)
+        self.path = path
+        self.writer = writer
+        self.interval_seconds = interval_seconds
+        self.min_growth_bytes = min_growth_bytes
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._stop_event = threading.Event()
+        self._last_size = 0
+
+    def _current_size(self) -> int:
+        files = rotated_files(self.path) + ([self.path] if os.path.exists(self.path) else [])
+        return sum(os.path.getsize(f) for f in files)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                if self._current_size() - self._last_size < self.min_growth_bytes:
+                    continue
+                report = compact_jsonl(self.path, self.writer)
+                if report is not None:
+                    self.last_report = report
+                self._last_size = self._current_size()
+            except Exception as e:
+                logger.error(f"后台压缩同步日志失败: {e}")
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        self.join(timeout)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) != 2:
+        print("用法: python compactor.py <jsonl文件>")
+        sys.exit(1)
+    backup = sys.argv[1] + '.bak_' + str(int(time.time()))
+    shutil.copyfile(sys.argv[1], backup)
+    print(f"已备份原文件到 {backup}")
+    print(compact_jsonl(sys.argv[1]))
@@ -1,10 +1,35 @@
 import json
 import csv
+import os
 from collections import defaultdict
+from compactor import latest_records
+from jsonl_writer import iter_segment_files
+from segment_store import SegmentReader, sync_segment_dir
 
 input_file = 'local_synced_data.jsonl'
+segment_dir = sync_segment_dir()  # 同步进程启用了分段存储时从中读取（LOCAL_SEGMENT_DIR）
 output_file = 'recommend_system/extracted_clubs.csv'
 
+def iter_jsonl_records():
+    for segment in iter_segment_files(input_file):
+        with open(segment, 'r', encoding='utf-8') as infile:
+            for line in infile:
+                try:
+                    yield json.loads(line.strip())
+                except json.JSONDecodeError:
+                    print(f"Skipping malformed JSON line: {line.strip()}")
+
+def iter_synced_records():
+    """
+    返回每个文档的最新有效版本（已删除的文档不返回），启用了分段存储时从中读取
+    （mmap，可按前缀跳过无关记录）。同步日志中同一文档的多次更新只算一条。
+    """
+    if segment_dir and os.path.isdir(segment_dir):
+        with SegmentReader(segment_dir) as reader:
+            yield from reader.iter_records(prefix='dynamic::', latest_only=True)
+        return
+    yield from latest_records(iter_jsonl_records())
+
 def extract_club_data():
     # 使用字典存储每个社团的信息
     clubs = defaultdict(lambda: {
@@ -16,46 +41,41 @@ def extract_club_data():
     })
     
     # 第一次遍历：收集所有社团基本信息和帖子信息
-    with open(input_file, 'r', encoding='utf-8') as infile:
-        for line in infile:
-            try:
-                data = json.loads(line.strip())
-                
-                # 处理社团信息
-                if data['id'].startswith('dynamic::club_id::'):
-                    club_id = data['id'].split('::')[-1]
-                    metadata = data.get('metadata', {})
-                    clubs[club_id]['club_name'] = metadata.get('name', data.get('document', ''))
-                    
-                    # 处理标签
-                    tags_str = metadata.get('tags', '[]')
-                    try:
-                        if isinstance(tags_str, str):
-                            tags_list = json.loads(tags_str)
-                        else:
-                            tags_list = tags_str
-                        if isinstance(tags_list, list):
-                            clubs[club_id]['tags'] = tags_list
-                    except json.JSONDecodeError:
-                        clubs[club_id]['tags'] = []
-                
-                # 处理帖子信息
-                elif data['id'].startswith('dynamic::post_id::'):
-                    metadata = data.get('metadata', {})
-                    club_id = str(metadata.get('club_id', ''))
-                    if club_id:
-                        # 增加帖子计数
-                        clubs[club_id]['posts'] += 1
-                        
-                        # 如果是置顶帖子，添加到置顶帖子列表
-                        if metadata.get('is_pinned', False):
-                            clubs[club_id]['pinned_posts'].append(metadata.get('title', ''))
+    for data in iter_synced_records():
+        try:
+            # 处理社团信息
+            if data['id'].startswith('dynamic::club_id::'):
+                club_id = data['id'].split('::')[-1]
+                metadata = data.get('metadata', {})
+                clubs[club_id]['club_name'] = metadata.get('name', data.get('document', ''))
+            
+                # 处理标签
+                tags_str = metadata.get('tags', '[]')
+                try:
+                    if isinstance(tags_str, str):
+                        tags_list = json.loads(tags_str)
+                    else:
+                        tags_list = tags_str
+                    if isinstance(tags_list, list):
+                        clubs[club_id]['tags'] = tags_list
+                except json.JSONDecodeError:
+                    clubs[club_id]['tags'] = []
+        
+            # 处理帖子信息
+            elif data['id'].startswith('dynamic::post_id::'):
+                metadata = data.get('metadata', {})
+                club_id = str(metadata.get('club_id', ''))
+                if club_id:
+                    # 增加帖子计数
+                    clubs[club_id]['posts'] += 1
                 
-            except json.JSONDecodeError:
-                print(f"Skipping malformed JSON line: {line.strip()}")
-            except KeyError as e:
-                print(f"Skipping line due to missing key {e}: {line.strip()}")
-    
+                    # 如果是置顶帖子，添加到置顶帖子列表
+                    if metadata.get('is_pinned', False):
+                        clubs[club_id]['pinned_posts'].append(metadata.get('title', ''))
+        
+        except KeyError as e:
+            print(f"Skipping record due to missing key {e}: {data}")
+
     # 写入CSV文件
     with open(output_file, 'w', newline='', encoding='utf-8') as outfile:
         csv_writer = csv.writer(outfile)
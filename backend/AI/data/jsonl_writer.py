@@ -0,0 +1,177 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List
+
+try:
+    import orjson  # 可选依赖，序列化速度明显快于标准库 json
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# 落盘（fsync）策略
+FSYNC_EVERY_BATCH = "batch"  # 每写完一批就 flush + fsync
+FSYNC_INTERVAL = "interval"  # 距上次 fsync 超过 fsync_interval_ms 时才 fsync
+FSYNC_ON_SHUTDOWN = "shutdown"  # 只在缓冲区满时写出，关闭时 fsync
+FSYNC_POLICIES = (FSYNC_EVERY_BATCH, FSYNC_INTERVAL, FSYNC_ON_SHUTDOWN)
+
+
+def dumps_line(data: Dict[str, Any]) -> bytes:
+    """
+    将一条记录序列化为以换行结尾的 UTF-8 字节串。
+    优先使用 orjson，遇到其不支持的类型时退回标准库 json。
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+        except TypeError:
+            pass
+    return (json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def rotated_files(path: str) -> List[str]:
+    """返回已轮转出去的分段文件（path.1, path.2, ...），按编号从旧到新排序"""
+    segments = []
+    for candidate in glob.glob(glob.escape(path) + '.*'):
+        suffix = candidate[len(path) + 1:]
+        if suffix.isdigit():
+            segments.append((int(suffix), candidate))
+    return [name for _, name in sorted(segments)]
+
+
+def iter_segment_files(path: str) -> List[str]:
+    """按写入顺序返回需要读取的所有文件：先是轮转出去的分段，最后是当前文件"""
+    files = rotated_files(path)
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+class JsonlAppendWriter:
+    """
+    长期持有文件句柄的 JSONL 追加写入器。
+
+    - buffer_size: 用户态写缓冲区大小（字节），满了才真正 write 到内核
+    - fsync_policy: 见 FSYNC_POLICIES
+    - fsync_interval_ms: interval 策略下两次 fsync 的最小间隔
+    - max_bytes: 当前文件超过该大小时轮转为 path.N，0 表示不轮转
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1 << 20, fsync_policy: str = FSYNC_EVERY_BATCH,
+                 fsync_interval_ms: int = 1000, max_bytes: int = 0):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"未知的 fsync 策略: {fsync_policy}，可选值: {FSYNC_POLICIES}")
+        self.path = path
+        self.buffer_size = buffer_size
+        self.fsync_policy = fsync_policy
+        self.fsync_interval_ms = fsync_interval_ms
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self._file = None
+        self._size = 0
+        self._dirty = False  # 是否有尚未 fsync 的数据
+        self._last_sync = time.monotonic()
+        self.open()
+
+    def open(self):
+        """打开（或重新打开）目标文件用于追加"""
+        with self.lock:
+            if self._file is not None:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._file = open(self.path, 'ab', buffering=self.buffer_size)
+            self._size = self._file.tell()
+
+    def reopen(self):
+        """关闭并重新打开文件，用于文件被外部替换（如压缩）之后"""
+        with self.lock:
+            self._close_file()
+            self.open()
+
+    def write(self, record: Dict[str, Any]):
+        """写入一条记录（不触发 fsync 策略，适合逐条写入后再调用 commit）"""
+        with self.lock:
+            line = dumps_line(record)
+            if self.max_bytes and self._size > 0 and self._size + len(line) > self.max_bytes:
+                self.rotate()
+            self._file.write(line)
+            self._size += len(line)
+            self._dirty = True
+
+    def write_batch(self, records: Iterable[Dict[str, Any]]):
+        """写入一批记录，然后按 fsync 策略决定是否落盘"""
+        with self.lock:
+            for record in records:
+                self.write(record)
+            self.commit()
+
+    def commit(self):
+        """一批写入结束时调用，按策略执行 flush/fsync"""
+        with self.lock:
+            if self.fsync_policy == FSYNC_EVERY_BATCH:
+                self.sync()
+            elif self.fsync_policy == FSYNC_INTERVAL:
+                self.tick()
+
+    def tick(self):
+        """
+        interval 策略的定时检查。空闲循环中也应调用，
+        避免没有新数据时缓冲区里的数据一直不落盘。
+        """
+        with self.lock:
+            if self.fsync_policy != FSYNC_INTERVAL or not self._dirty:
+                return
+            if (time.monotonic() - self._last_sync) * 1000 >= self.fsync_interval_ms:
+                self.sync()
+
+    def flush(self):
+        """把用户态缓冲区写入内核（不保证落盘）"""
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def sync(self):
+        """flush 并 fsync，确保数据落盘"""
+        with self.lock:
+            if self._file is None:
+                return
+            self._file.flush()
+            if self._dirty:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+            self._last_sync = time.monotonic()
+
+    def rotate(self):
+        """将当前文件轮转为 path.N（N 为递增编号）并开启新文件"""
+        with self.lock:
+            self._close_file()
+            existing = rotated_files(self.path)
+            next_index = int(existing[-1].rsplit('.', 1)[1]) + 1 if existing else 1
+            rotated_name = f"{self.path}.{next_index}"
+            os.replace(self.path, rotated_name)
+            logger.info(f"JSONL 文件已轮转: {self.path} -> {rotated_name}")
+            self.open()
+
+    def close(self):
+        """关闭前总是 flush + fsync"""
+        with self.lock:
+            self._close_file()
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        try:
+            self.sync()
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
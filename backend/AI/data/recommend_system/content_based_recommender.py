@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from typing import List, Dict, Any
@@ -10,6 +11,9 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 增量计算的社团数累计超过社团总数的这个比例时重新全量拟合（增量更新沿用已拟合的词表与 IDF）
+REFIT_RATIO = 0.3
+
 class ContentBasedRecommender:
     def __init__(self):
         # 初始化向量化器
@@ -28,6 +32,8 @@ class ContentBasedRecommender:
         # 缓存
         self.club_features = {}  # 存储社团特征向量
         self.user_features = {}  # 存储用户特征向量
+        self._fitted_clubs = None  # 当前特征对应的社团列表
+        self._incremental_rows = 0  # 上次全量拟合之后增量计算过的社团数
         
     def _tokenize_text(self, text: str) -> List[str]:
         """使用结巴分词处理中文文本"""
@@ -54,22 +60,80 @@ class ContentBasedRecommender:
             self.tag_features = self.tag_vectorizer.fit_transform(tags)
             
             # 提取数值特征（如活跃度、成员数等）
-            self.numeric_features = np.array([
-                [
-                    float(club.get('activity_level', 0.5)),
-                    float(club.get('member_count', 0))
-                ]
-                for club in clubs_data
-            ])
-            
-            # 标准化数值特征
-            if len(self.numeric_features) > 0:
-                self.numeric_features = (self.numeric_features - self.numeric_features.mean(axis=0)) / (self.numeric_features.std(axis=0) + 1e-8)
+            self.numeric_features = self._numeric_features(clubs_data)
             
         except Exception as e:
             logger.error(f"Error processing club features: {str(e)}")
             raise
     
+    def _numeric_features(self, clubs_data: List[Dict[str, Any]]) -> np.ndarray:
+        """标准化的数值特征（计算量很小，每次都用全部社团重新计算）"""
+        numeric_features = np.array([
+            [
+                float(club.get('activity_level', 0.5)),
+                float(club.get('member_count', 0))
+            ]
+            for club in clubs_data
+        ])
+        
+        # 标准化数值特征
+        if len(numeric_features) > 0:
+            numeric_features = (numeric_features - numeric_features.mean(axis=0)) / (numeric_features.std(axis=0) + 1e-8)
+        return numeric_features
+    
+    def fit(self, clubs_data: List[Dict[str, Any]]):
+        """全量计算社团特征（重新拟合词表与 IDF）"""
+        self._fitted_clubs = None  # 中途失败时下次请求重新拟合
+        self._process_club_features(clubs_data)
+        self._fitted_clubs = clubs_data
+        self._incremental_rows = 0
+    
+    def update_features(self, previous: List[Dict[str, Any]], clubs_data: List[Dict[str, Any]],
+                        reuse: Dict[int, int]) -> bool:
+        """
+        社团数据从 previous 增量变化为 clubs_data 后更新特征。
+        reuse 为新列表中的位置 -> previous 中的位置（内容未变化的社团，沿用其特征），
+        其余社团用已拟合的向量化器单独计算，不重新拟合词表与 IDF（新出现的词在下次全量拟合前被忽略）。
+        增量计算的社团数累计超过 REFIT_RATIO 时改为全量拟合。返回是否进行了全量拟合。
+        """
+        if not clubs_data:
+            self._fitted_clubs = None
+            return False
+        changed = [i for i in range(len(clubs_data)) if i not in reuse]
+        # 当前特征不是按 previous 计算的（尚未拟合或数据被整体替换过）时行号对不上，只能全量拟合
+        if (self._fitted_clubs is None or self._fitted_clubs is not previous
+                or self._incremental_rows + len(changed) > REFIT_RATIO * len(clubs_data)):
+            self.fit(clubs_data)
+            return True
+        
+        try:
+            # 旧特征之后追加变化社团的特征，再按新列表的顺序取出各行
+            old_rows = len(self._fitted_clubs)
+            new_row = {i: old_rows + k for k, i in enumerate(changed)}
+            order = [reuse[i] if i in reuse else new_row[i] for i in range(len(clubs_data))]
+            text_features, tag_features = self.text_features, self.tag_features
+            if changed:
+                text_features = sp.vstack([
+                    text_features,
+                    self.text_vectorizer.transform([clubs_data[i].get('desc', '') for i in changed])
+                ])
+                tag_features = sp.vstack([
+                    tag_features,
+                    self.tag_vectorizer.transform([clubs_data[i].get('tags', '') for i in changed])
+                ])
+            text_features = sp.csr_matrix(text_features)[order]
+            tag_features = sp.csr_matrix(tag_features)[order]
+            numeric_features = self._numeric_features(clubs_data)
+        except Exception as e:
+            logger.error(f"Error updating club features: {str(e)}")
+            raise
+        
+        self.text_features, self.tag_features = text_features, tag_features
+        self.numeric_features = numeric_features
+        self._fitted_clubs = clubs_data
+        self._incremental_rows += len(changed)
+        return False
+    
     def _calculate_similarity(self, user_data: Dict[str, Any], clubs_data: List[Dict[str, Any]]) -> np.ndarray:
         """计算用户与社团的相似度"""
         try:
@@ -118,8 +182,9 @@ class ContentBasedRecommender:
             if not clubs_data:
                 raise ValueError("No clubs data provided")
             
-            # 处理社团特征
-            self._process_club_features(clubs_data)
+            # 社团特征在数据变化时才重新计算（见 update_features）
+            if clubs_data is not self._fitted_clubs:
+                self.fit(clubs_data)
             
             # 计算相似度
             similarities = self._calculate_similarity(user_data, clubs_data)
@@ -32,6 +32,13 @@ class RecommendationResponse(BaseModel):
     total_clubs_considered: int
     profile_completeness: float
 
+class ClubSyncRequest(BaseModel):
+    mode: str = "delta"  # "replace": upserts 为全部社团；"delta": 只包含变化的社团
+    from_seq: Optional[int] = None  # delta 基于的变更序号，应与上次同步的 seq 相同
+    seq: int
+    upserts: List[Dict[str, Any]] = []
+    deletes: List[int] = []
+
 @app.on_event("startup")
 async def startup_event():
     """启动时加载数据"""
@@ -72,5 +79,26 @@ async def reload_data():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/clubs/sync")
+async def sync_clubs(request: ClubSyncRequest):
+    """接收代理服务器推送的社团变更（见 AIserver/club_refresh.py），只重新计算变化社团的特征"""
+    if request.mode not in ("replace", "delta"):
+        raise HTTPException(status_code=400, detail=f"Unknown sync mode: {request.mode}")
+    if request.mode == "delta" and request.from_seq != recommendation_service.synced_seq:
+        # 服务重启或重新加载过 CSV，增量无法应用，由代理服务器改为全量同步
+        raise HTTPException(
+            status_code=409,
+            detail=f"Sync sequence mismatch: expected {recommendation_service.synced_seq}, got {request.from_seq}"
+        )
+    try:
+        result = recommendation_service.apply_changes(
+            request.upserts, request.deletes, replace=request.mode == "replace"
+        )
+        recommendation_service.synced_seq = request.seq
+        return {"status": "success", "seq": request.seq, **result}
+    except Exception as e:
+        logger.error(f"Error syncing club data: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8001)  # 使用8001端口，避免与主服务器冲突 
\ No newline at end of file
@@ -10,6 +10,7 @@ class RecommendationService:
     def __init__(self):
         self.content_recommender = ContentBasedRecommender()
         self.clubs_data = None
+        self.synced_seq = None  # 最近一次从代理服务器同步的社团变更序号（见 apply_changes）
         
     def load_data(self, clubs_file: str = 'extracted_clubs.csv'):
         """加载社团数据"""
@@ -17,6 +18,7 @@ class RecommendationService:
             # 读取社团数据
             clubs_df = pd.read_csv(clubs_file)
             self.clubs_data = clubs_df.to_dict('records')
+            self.synced_seq = None  # 重新从 CSV 加载后，之前同步的增量已不适用
             logger.info(f"Successfully loaded {len(self.clubs_data)} clubs")
             
         except Exception as e:
@@ -69,25 +71,43 @@ class RecommendationService:
         filled_fields = sum(1 for field in total_fields if user_profile.get(field))
         return filled_fields / len(total_fields)
     
+    def apply_changes(self, upserts: List[Dict[str, Any]], deletes: List[Any] = (),
+                      replace: bool = False) -> Dict[str, Any]:
+        """
+        按 club_id 新增/更新/删除社团，只重新计算变化社团的特征。
+        replace 为 True 时 upserts 是全部社团，不在其中的社团被删除（内容未变化的社团仍沿用已有特征）。
+        """
+        old_data = self.clubs_data or []
+        incoming = {str(club['club_id']): club for club in upserts}
+        removed = {str(club_id) for club_id in deletes}
+        clubs_data, reuse = [], {}
+        dropped = 0
+        for row, club in enumerate(old_data):
+            key = str(club['club_id'])
+            if key in removed or (replace and key not in incoming):
+                dropped += 1
+                continue
+            updated = incoming.pop(key, club)
+            if updated == club:
+                reuse[len(clubs_data)] = row
+            clubs_data.append(updated)
+        clubs_data.extend(incoming.values())  # 新增的社团
+        
+        full_refit = self.content_recommender.update_features(old_data, clubs_data, reuse)
+        self.clubs_data = clubs_data
+        result = {
+            "clubs": len(clubs_data),
+            "reindexed": len(clubs_data) if full_refit else len(clubs_data) - len(reuse),
+            "removed": dropped,
+            "full_refit": full_refit
+        }
+        logger.info(f"Applied club changes: {result}")
+        return result
+    
     def update_club_data(self, new_club_data: Dict[str, Any]) -> bool:
         """更新社团数据"""
         try:
-            if not self.clubs_data:
-                self.clubs_data = []
-            
-            # 检查是否存在相同ID的社团
-            existing_club = next(
-                (club for club in self.clubs_data if club['club_id'] == new_club_data['club_id']), 
-                None
-            )
-            
-            if existing_club:
-                # 更新现有社团数据
-                existing_club.update(new_club_data)
-            else:
-                # 添加新社团
-                self.clubs_data.append(new_club_data)
-            
+            self.apply_changes([new_club_data])
             logger.info(f"Successfully updated club data for club_id: {new_club_data['club_id']}")
             return True
             
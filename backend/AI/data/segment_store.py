@@ -0,0 +1,434 @@
+"""
+同步文档的二进制分段存储。
+
+local_synced_data.jsonl 的替代格式：目录下按顺序排列的 seg-NNNNNN.dat 分段文件，
+每条记录使用长度前缀编码，读取时通过 mmap 访问，并维护 id -> 偏移量索引，
+按 id 查找或按前缀过滤时无需解析其他记录的 JSON。
+
+记录格式（小端）:
+    u16 id_len | u32 doc_len | u32 meta_len | id (utf-8) | document (utf-8) | metadata (JSON)
+document 为 None 时 doc_len 记为 0xFFFFFFFF；墓碑记录（删除）的 doc_len 和 meta_len 都记为 0xFFFFFFFF。
+
+分段封存（写满或关闭）时生成同名 .idx 索引文件:
+    magic | u64 覆盖的数据长度 | u32 条目数 | 条目 (u16 id_len | u64 offset | id)
+索引缺失或过期（数据文件比索引覆盖的长）时，读取端会扫描记录头重建索引。
+
+同步进程（standalone.py）只在设置了环境变量 LOCAL_SEGMENT_DIR 时写入分段存储，读取端
+（extract_club_data.py、AIserver 的社团推荐）通过 sync_segment_dir() 读取同一个设置，
+未启用时一律读取 JSONL，不会读到同步进程已不再更新的旧目录。
+
+命令行（转换/测试请输出到临时目录；启用分段存储时先把已有数据转换到目标目录，
+再以 LOCAL_SEGMENT_DIR 指向该目录启动同步进程）:
+    python segment_store.py convert local_synced_data.jsonl /tmp/synced_bench.seg
+    python segment_store.py bench local_synced_data.jsonl /tmp/synced_bench.seg
+"""
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import orjson  # 可选依赖，用于更快地序列化/解析 metadata
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b'WCSG\x01\x00'
+INDEX_MAGIC = b'WCSI\x01\x00'
+RECORD_HEADER = struct.Struct('<HII')
+INDEX_HEADER = struct.Struct('<QI')
+INDEX_ENTRY = struct.Struct('<HQ')
+NULL_LENGTH = 0xFFFFFFFF
+DEFAULT_MAX_SEGMENT_BYTES = 64 * 1024 * 1024
+SEGMENT_DIR_ENV = 'LOCAL_SEGMENT_DIR'
+
+
+def sync_segment_dir() -> Optional[str]:
+    """
+    同步进程写入的分段存储目录（环境变量 LOCAL_SEGMENT_DIR，相对路径相对于本文件所在目录），
+    未启用时返回 None。写入端和读取端都以此为准。
+    """
+    path = os.environ.get(SEGMENT_DIR_ENV, '')
+    if not path:
+        return None
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    return path
+
+
+def _dumps(value) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except TypeError:
+            pass
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data))
+
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    """将 {id, document, metadata} 或墓碑 {id, deleted: true} 编码为一条二进制记录"""
+    doc_id = record['id'].encode('utf-8')
+    if record.get('deleted'):
+        return RECORD_HEADER.pack(len(doc_id), NULL_LENGTH, NULL_LENGTH) + doc_id
+    document = record.get('document')
+    doc_bytes = b'' if document is None else str(document).encode('utf-8')
+    meta_bytes = _dumps(record.get('metadata') or {})
+    doc_len = NULL_LENGTH if document is None else len(doc_bytes)
+    return RECORD_HEADER.pack(len(doc_id), doc_len, len(meta_bytes)) + doc_id + doc_bytes + meta_bytes
+
+
+def _record_end(buf, offset: int) -> int:
+    """返回 offset 处记录的结束位置"""
+    id_len, doc_len, meta_len = RECORD_HEADER.unpack_from(buf, offset)
+    return (offset + RECORD_HEADER.size + id_len
+            + (0 if doc_len == NULL_LENGTH else doc_len)
+            + (0 if meta_len == NULL_LENGTH else meta_len))
+
+
+def segment_files(directory: str) -> List[str]:
+    """按编号返回目录中的所有分段数据文件"""
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(n for n in os.listdir(directory) if n.startswith('seg-') and n.endswith('.dat'))
+    return [os.path.join(directory, n) for n in names]
+
+
+def _index_path(segment_path: str) -> str:
+    return segment_path[:-len('.dat')] + '.idx'
+
+
+def write_index(segment_path: str, index: Dict[str, int], covered_bytes: int):
+    """原子地写出分段的 id -> offset 索引"""
+    parts = [INDEX_MAGIC, INDEX_HEADER.pack(covered_bytes, len(index))]
+    for doc_id, offset in index.items():
+        encoded = doc_id.encode('utf-8')
+        parts.append(INDEX_ENTRY.pack(len(encoded), offset))
+        parts.append(encoded)
+    tmp_path = _index_path(segment_path) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b''.join(parts))
+    os.replace(tmp_path, _index_path(segment_path))
+
+
+def read_index(segment_path: str) -> Optional[Tuple[Dict[str, int], int]]:
+    """读取分段索引，返回 (index, 覆盖的数据长度)；不存在或损坏时返回 None"""
+    path = _index_path(segment_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(INDEX_MAGIC):
+        logger.warning(f"索引文件格式错误，将重建: {path}")
+        return None
+    pos = len(INDEX_MAGIC)
+    covered_bytes, count = INDEX_HEADER.unpack_from(data, pos)
+    pos += INDEX_HEADER.size
+    index = {}
+    for _ in range(count):
+        id_len, offset = INDEX_ENTRY.unpack_from(data, pos)
+        pos += INDEX_ENTRY.size
+        index[data[pos:pos + id_len].decode('utf-8')] = offset
+        pos += id_len
+    return index, covered_bytes
+
+
+class Segment:
+    """单个通过 mmap 打开的只读分段"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._file = open(path, 'rb')
+        # 空文件无法 mmap
+        self.buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        if self.size and self.buf[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f"不是有效的分段文件: {path}")
+        self.index = self._load_index()
+
+    def _load_index(self) -> Dict[str, int]:
+        loaded = read_index(self.path)
+        if loaded is not None:
+            index, covered_bytes = loaded
+            if covered_bytes == self.size:
+                return index
+            # 分段在索引写出后又有追加（活动分段），只扫描新增部分
+            for offset, doc_id in self.scan_headers(covered_bytes):
+                index[doc_id] = offset
+            return index
+        return {doc_id: offset for offset, doc_id in self.scan_headers()}
+
+    def scan_headers(self, start: int = 0) -> Iterator[Tuple[int, str]]:
+        """只读记录头和 id，逐条返回 (offset, id)"""
+        pos = max(start, len(SEGMENT_MAGIC))
+        buf = self.buf
+        while pos + RECORD_HEADER.size <= self.size:
+            id_len = RECORD_HEADER.unpack_from(buf, pos)[0]
+            body = pos + RECORD_HEADER.size
+            end = _record_end(buf, pos)
+            if end > self.size:
+                logger.warning(f"分段 {self.path} 在偏移 {pos} 处存在不完整记录，已忽略")
+                break
+            yield pos, buf[body:body + id_len].decode('utf-8')
+            pos = end
+
+    def is_tombstone(self, offset: int) -> bool:
+        return RECORD_HEADER.unpack_from(self.buf, offset)[2] == NULL_LENGTH
+
+    def read_at(self, offset: int) -> Dict[str, Any]:
+        """解码指定偏移处的完整记录"""
+        buf = self.buf
+        id_len, doc_len, meta_len = RECORD_HEADER.unpack_from(buf, offset)
+        pos = offset + RECORD_HEADER.size
+        doc_id = buf[pos:pos + id_len].decode('utf-8')
+        pos += id_len
+        if meta_len == NULL_LENGTH:
+            return {"id": doc_id, "deleted": True}
+        document = None
+        if doc_len != NULL_LENGTH:
+            document = buf[pos:pos + doc_len].decode('utf-8')
+            pos += doc_len
+        metadata = _loads(buf[pos:pos + meta_len]) if meta_len else {}
+        return {"id": doc_id, "document": document, "metadata": metadata}
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        self._file.close()
+
+
+class SegmentReader:
+    """
+    只读访问整个分段目录。
+    get() 按 id 返回最新版本；iter_records() 按写入顺序返回记录，可按 id 前缀过滤，
+    不匹配的记录只读头部，不解析 JSON。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.segments = [Segment(path) for path in segment_files(directory)]
+        self.index: Dict[str, Tuple[int, int]] = {}
+        for seg_no, segment in enumerate(self.segments):
+            for doc_id, offset in segment.index.items():
+                self.index[doc_id] = (seg_no, offset)
+
+    def _is_live(self, location: Tuple[int, int]) -> bool:
+        seg_no, offset = location
+        return not self.segments[seg_no].is_tombstone(offset)
+
+    def __len__(self):
+        return sum(1 for location in self.index.values() if self._is_live(location))
+
+    def __contains__(self, doc_id):
+        location = self.index.get(doc_id)
+        return location is not None and self._is_live(location)
+
+    def ids(self, prefix: str = '') -> List[str]:
+        return [doc_id for doc_id, location in self.index.items()
+                if doc_id.startswith(prefix) and self._is_live(location)]
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """返回 id 的最新版本，已删除或不存在时返回 None"""
+        location = self.index.get(doc_id)
+        if location is None or not self._is_live(location):
+            return None
+        seg_no, offset = location
+        return self.segments[seg_no].read_at(offset)
+
+    def iter_records(self, prefix: str = '', latest_only: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        按写入顺序返回记录（包括墓碑）；latest_only 时只返回每个 id 仍然有效的最新版本。
+        """
+        for seg_no, segment in enumerate(self.segments):
+            for offset, doc_id in segment.scan_headers():
+                if prefix and not doc_id.startswith(prefix):
+                    continue
+                if latest_only and (self.index.get(doc_id) != (seg_no, offset) or segment.is_tombstone(offset)):
+                    continue
+                yield segment.read_at(offset)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SegmentWriter:
+    """
+    追加写入分段目录。活动分段超过 max_segment_bytes 时封存（写出 .idx）并开启新分段；
+    重新打开目录时继续追加到最后一个分段。
+    """
+
+    def __init__(self, directory: str, max_segment_bytes: int = DEFAULT_MAX_SEGMENT_BYTES):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._path = None
+        self._index: Dict[str, int] = {}
+        existing = segment_files(directory)
+        if existing:
+            self._open_segment(existing[-1])
+        else:
+            self._open_segment(self._segment_path(1))
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"seg-{number:06d}.dat")
+
+    def _open_segment(self, path: str):
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            # 重建活动分段的索引，并截断可能存在的半条记录
+            segment = Segment(path)
+            self._index = dict(segment.index)
+            valid_end = len(SEGMENT_MAGIC)
+            for offset, _ in segment.scan_headers():
+                valid_end = _record_end(segment.buf, offset)
+            segment.close()
+            if valid_end < os.path.getsize(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(valid_end)
+        else:
+            self._index = {}
+        self._path = path
+        self._file = open(path, 'ab')
+        if is_new:
+            self._file.write(SEGMENT_MAGIC)
+
+    def append(self, record: Dict[str, Any]):
+        data = encode_record(record)
+        offset = self._file.tell()
+        if offset > len(SEGMENT_MAGIC) and offset + len(data) > self.max_segment_bytes:
+            self.seal()
+            number = int(os.path.basename(self._path)[4:10]) + 1
+            self._open_segment(self._segment_path(number))
+            offset = self._file.tell()
+        self._file.write(data)
+        self._index[record['id']] = offset
+
+    def append_batch(self, records):
+        for record in records:
+            self.append(record)
+        self._file.flush()
+
+    def seal(self):
+        """刷新活动分段并写出其索引"""
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        write_index(self._path, self._index, self._file.tell())
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        self.seal()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def convert_jsonl(jsonl_path: str, directory: str, max_segment_bytes: int = DEFAULT_MAX_SEGMENT_BYTES) -> int:
+    """把现有 JSONL 文件转换为分段存储，返回转换的记录数"""
+    count = 0
+    with open(jsonl_path, 'r', encoding='utf-8') as f, SegmentWriter(directory, max_segment_bytes) as writer:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"跳过无法解析的行: {line.strip()[:100]} - {e}")
+                continue
+            if not isinstance(record, dict) or 'id' not in record:
+                continue
+            writer.append(record)
+            count += 1
+    return count
+
+
+def benchmark(jsonl_path: str, directory: str, lookups: int = 1000) -> Dict[str, float]:
+    """对比 JSONL 逐行解析与分段存储的读取耗时"""
+    results = {}
+
+    start = time.perf_counter()
+    jsonl_records = []
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                jsonl_records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    results['jsonl_full_scan_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        clubs = [r for r in (json.loads(line) for line in f if line.strip())
+                 if r.get('id', '').startswith('dynamic::club_id::')]
+    results['jsonl_club_scan_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reader = SegmentReader(directory)
+    results['segment_open_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    segment_records = list(reader.iter_records())
+    results['segment_full_scan_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    segment_clubs = list(reader.iter_records(prefix='dynamic::club_id::'))
+    results['segment_club_scan_s'] = time.perf_counter() - start
+
+    ids = reader.ids()
+    sample = [random.choice(ids) for _ in range(lookups)] if ids else []
+    start = time.perf_counter()
+    for doc_id in sample:
+        reader.get(doc_id)
+    results['segment_lookup_us'] = (time.perf_counter() - start) * 1e6 / len(sample) if sample else 0.0
+    reader.close()
+
+    results['records'] = len(jsonl_records)
+    if len(segment_records) != len(jsonl_records) or len(segment_clubs) != len(clubs):
+        logger.warning(f"记录数不一致: JSONL {len(jsonl_records)}/{len(clubs)}，分段 {len(segment_records)}/{len(segment_clubs)}")
+    return results
+
+
+def main(argv: List[str]):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(argv) != 3 or argv[0] not in ('convert', 'bench'):
+        print("用法: python segment_store.py convert|bench <jsonl文件> <分段目录>")
+        return 1
+    command, jsonl_path, directory = argv
+    if command == 'convert':
+        start = time.perf_counter()
+        count = convert_jsonl(jsonl_path, directory)
+        print(f"已转换 {count} 条记录到 {directory}，耗时 {time.perf_counter() - start:.3f} 秒")
+    else:
+        results = benchmark(jsonl_path, directory)
+        print(f"记录数: {results['records']}")
+        print(f"全量读取  JSONL: {results['jsonl_full_scan_s'] * 1000:.1f} ms  分段: {results['segment_full_scan_s'] * 1000:.1f} ms (打开 {results['segment_open_s'] * 1000:.1f} ms)")
+        print(f"社团过滤  JSONL: {results['jsonl_club_scan_s'] * 1000:.1f} ms  分段: {results['segment_club_scan_s'] * 1000:.1f} ms")
+        print(f"按 id 查找 平均: {results['segment_lookup_us']:.1f} us")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
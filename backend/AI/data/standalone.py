@@ -1,16 +1,21 @@
+import hashlib
 import json
 import signal
 import time
 import logging
-from typing import List, Dict, Tuple
+from typing import Any, List, Dict, Optional, Tuple
 import chromadb
 import os
 from redis import Redis, exceptions
 import threading
 import redis
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from extract_club_data import extract_club_data
+from jsonl_writer import JsonlAppendWriter, FSYNC_EVERY_BATCH, iter_segment_files
+from segment_store import SegmentWriter, DEFAULT_MAX_SEGMENT_BYTES, sync_segment_dir
+from compactor import BackgroundCompactor, is_tombstone, make_tombstone
 
 # 配置
 # Redis 连接配置
@@ -25,6 +30,25 @@ REDIS_BLOCK_TIMEOUT_MS: int = 10000
 
 # 本地数据存储配置
 LOCAL_OUTPUT_FILE: str = "local_synced_data.jsonl"
+OUTPUT_BUFFER_SIZE: int = 1 << 20  # 写缓冲区大小（字节）
+OUTPUT_FSYNC_POLICY: str = FSYNC_EVERY_BATCH  # batch / interval / shutdown
+OUTPUT_FSYNC_INTERVAL_MS: int = 1000  # interval 策略下的 fsync 间隔
+OUTPUT_MAX_BYTES: int = 0  # 单个文件超过该大小时轮转，0 表示不轮转
+# 二进制分段存储目录（见 segment_store.py），由环境变量 LOCAL_SEGMENT_DIR 设置，为空表示只写 JSONL。
+# 读取端使用同一个设置；启用前请先用 `python segment_store.py convert` 把已有的 JSONL 数据转换到该目录。
+LOCAL_SEGMENT_DIR: str = sync_segment_dir() or ""
+LOCAL_SEGMENT_MAX_BYTES: int = DEFAULT_MAX_SEGMENT_BYTES
+# 同步日志后台压缩（只保留每个 id 的最新版本并移除已删除的 id），0 表示不启用
+COMPACTION_INTERVAL_SECONDS: int = 3600
+COMPACTION_MIN_GROWTH_BYTES: int = 1 << 20  # 自上次压缩后至少增长这么多才再次压缩
+
+# 批量快照配置（sync_redis_data 的 bulk 模式）
+SNAPSHOT_KEY_PATTERN: str = "dynamic::*"  # SCAN 时在服务端过滤的键模式
+SNAPSHOT_SCAN_COUNT: int = 1000  # 每次 SCAN 迭代建议返回的键数量
+SNAPSHOT_PIPELINE_BATCH: int = 500  # 每个 pipeline 批次包含的键数量
+SNAPSHOT_WORKERS: int = 4  # 解码文档的工作线程数
+SNAPSHOT_WRITE_CHUNK: int = 1000  # 缓冲多少行后写入一次文件
+SNAPSHOT_REPORT_EVERY: int = 1000  # 每处理多少个键报告一次吞吐量
 
 # 日志配置
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -32,27 +56,120 @@ logger = logging.getLogger(__name__)
 
 # 全局变量
 SHUTDOWN_REQUESTED = False
-seen_ids = set() # 用于存储已同步的文档ID
+# 已同步的文档ID -> 最近写入版本的内容指纹；内容相同的重复消息跳过，内容变化的更新照常追加，
+# 由压缩器只保留每个 id 的最新版本
+seen_ids: Dict[str, str] = {}
+# 已解码、尚未写入的记录（id -> 内容指纹，删除为 None）。解码时预留，写入成功后并入 seen_ids，
+# 写入失败时释放，避免并发批次（异步版 worker 的解码与写入是不同阶段）重复写入同一版本
+pending_ids: Dict[str, Optional[str]] = {}
+_seen_lock = threading.Lock()
 
 # Redis 连接池（独立版本，直接创建）
 redis_pool = None # 稍后在 run_sync_worker 中初始化
 
+# 按文件路径复用的长期写入器
+output_writers: Dict[str, JsonlAppendWriter] = {}
+segment_writer = None
+
+def get_output_writer(filename):
+    """获取（必要时创建）指定文件的追加写入器"""
+    path = os.path.abspath(filename)
+    writer = output_writers.get(path)
+    if writer is None:
+        writer = JsonlAppendWriter(
+            path,
+            buffer_size=OUTPUT_BUFFER_SIZE,
+            fsync_policy=OUTPUT_FSYNC_POLICY,
+            fsync_interval_ms=OUTPUT_FSYNC_INTERVAL_MS,
+            max_bytes=OUTPUT_MAX_BYTES
+        )
+        output_writers[path] = writer
+    return writer
+
+def get_segment_writer():
+    """获取分段存储写入器，未启用时返回 None"""
+    global segment_writer
+    if not LOCAL_SEGMENT_DIR:
+        return None
+    if segment_writer is None:
+        segment_writer = SegmentWriter(LOCAL_SEGMENT_DIR, max_segment_bytes=LOCAL_SEGMENT_MAX_BYTES)
+    return segment_writer
+
+def write_documents(filename, records):
+    """将一批文档写入 JSONL，启用时同时写入分段存储"""
+    records = list(records)
+    get_output_writer(filename).write_batch(records)
+    seg_writer = get_segment_writer()
+    if seg_writer is not None:
+        seg_writer.append_batch(records)
+
+def record_fingerprint(record: Dict[str, Any]) -> str:
+    """文档内容（document 与 metadata）的指纹，用于区分重复消息和内容更新"""
+    payload = json.dumps([record.get('document'), record.get('metadata')],
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+def is_synced(record: Dict[str, Any]) -> bool:
+    """该 id 的最新已同步（或已预留待写入）版本与 record 内容相同时返回 True"""
+    fingerprint = record_fingerprint(record)
+    with _seen_lock:
+        if record['id'] in pending_ids:
+            return pending_ids[record['id']] == fingerprint
+        return seen_ids.get(record['id']) == fingerprint
+
+def _record_key(record: Dict[str, Any]) -> Optional[str]:
+    return None if is_tombstone(record) else record_fingerprint(record)
+
+def reserve_record(record: Dict[str, Any]):
+    """解码出待写入的记录时预留其版本，后续批次中内容相同的消息不再重复写入"""
+    key = _record_key(record)
+    with _seen_lock:
+        pending_ids[record['id']] = key
+
+def release_records(records: List[Dict[str, Any]]):
+    """写入失败时释放预留，消息重新投递后可以再次写入"""
+    with _seen_lock:
+        for record in records:
+            if record['id'] in pending_ids and pending_ids[record['id']] == _record_key(record):
+                del pending_ids[record['id']]
+
+def close_output_writers():
+    """关闭所有写入器，确保缓冲数据落盘"""
+    global segment_writer
+    for writer in output_writers.values():
+        try:
+            writer.close()
+        except Exception as e:
+            logger.error(f"关闭写入器 {writer.path} 失败: {e}")
+    output_writers.clear()
+    if segment_writer is not None:
+        try:
+            segment_writer.close()
+        except Exception as e:
+            logger.error(f"关闭分段存储写入器失败: {e}")
+        segment_writer = None
+
 def load_existing_ids(filename):
     """
     加载已同步的 dynamic 文档 ID 到内存中，用于去重。
     """
-    if not os.path.exists(filename):
+    files = iter_segment_files(filename)
+    if not files:
         return
 
     logger.info(f"正在加载现有文档ID进行去重: {filename}")
-    with open(filename, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                data = json.loads(line)
-                if 'id' in data and data['id'].startswith('dynamic::'):
-                    seen_ids.add(data['id'])
-            except json.JSONDecodeError as e:
-                logger.warning(f"解析现有文件行时出错: {line.strip()} - {e}")
+    for segment in files:
+        with open(segment, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                    if 'id' in data and data['id'].startswith('dynamic::'):
+                        if is_tombstone(data):
+                            seen_ids.pop(data['id'], None)
+                        else:
+                            seen_ids[data['id']] = record_fingerprint(data)
+                except json.JSONDecodeError as e:
+                    logger.warning(f"解析现有文件行时出错: {line.strip()} - {e}")
     logger.info(f"已加载 {len(seen_ids)} 个现有文档ID。")
 
 def handle_shutdown(signum, frame):
@@ -239,17 +356,21 @@ def process_metric_data(key, value, data_type):
 
 def save_to_jsonl(data, filename):
     """
-    将数据保存到 JSONL 文件
+    将数据保存到 JSONL 文件（复用长期打开的写入器，按 fsync 策略落盘）
     """
     if data:
-        with open(filename, 'a', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False)
-            f.write('\n')
+        write_documents(filename, [data])
 
-def sync_redis_data(output_file='local_synced_data.jsonl'):
+def sync_redis_data(output_file='local_synced_data.jsonl', bulk=True):
     """
     同步 Redis 数据到本地文件
+
+    bulk=True 时使用批量快照模式（见 snapshot_redis_data），
+    否则逐个键查询，每个文档至少两次往返。
     """
+    if bulk:
+        return snapshot_redis_data(output_file)
+
     r = connect_redis()
     
     # 确保输出目录存在
@@ -277,140 +398,296 @@ def sync_redis_data(output_file='local_synced_data.jsonl'):
                 logger.warning(f"跳过无法处理的动态数据键: {key.decode('utf-8', errors='replace')}")
                 continue
 
-            # 检查 ID 是否已存在，如果存在则跳过
-            if data['id'] in seen_ids:
-                logger.debug(f"跳过重复的 dynamic ID: {data['id']}")
+            # 已同步过相同内容则跳过，内容有变化时追加新版本
+            if is_synced(data):
+                logger.debug(f"跳过未变化的 dynamic ID: {data['id']}")
                 continue
             
             # 保存到文件
             save_to_jsonl(data, output_file)
-            seen_ids.add(data['id']) # 将新的 ID 添加到已同步集合
+            seen_ids[data['id']] = record_fingerprint(data) # 记录已同步的版本
 
         except Exception as e:
             logger.error(f"处理键 {key} 时出错: {str(e)}")
             continue
 
-# 批量消息处理
-def process_messages_batch(messages: List[Tuple[str, Dict[str, str]]]):
+def fetch_dynamic_batch(r, keys):
     """
-    一次性处理一批消息，将大文档直接存储。
+    使用两次 pipeline 往返批量获取一批键的类型和值。
+    返回 (key, key_type, value) 列表；单个键的错误以异常对象形式放在 value 中。
     """
-    first_msg_id = messages[0][0].decode('utf-8', errors='replace') if isinstance(messages[0][0], bytes) else messages[0][0]
-    last_msg_id = messages[-1][0].decode('utf-8', errors='replace') if isinstance(messages[-1][0], bytes) else messages[-1][0]
-    logger.debug(f"Parsing batch of {len(messages)} messages from {first_msg_id} to {last_msg_id}.")
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+    key_types = pipe.execute(raise_on_error=False)
+
+    pipe = r.pipeline(transaction=False)
+    for key, key_type in zip(keys, key_types):
+        if key_type == b'hash':
+            pipe.hgetall(key)
+        else:
+            pipe.get(key)
+    values = pipe.execute(raise_on_error=False)
 
-    batch_ids, batch_metadatas, batch_documents = [], [], []
-    processed_msg_ids = []
+    return list(zip(keys, key_types, values))
 
-    for msg_id, msg_data in messages:
+def decode_dynamic_batch(entries):
+    """
+    在工作线程中解码一批 (key, key_type, value)，返回可写入的文档列表。
+    """
+    results = []
+    for key, key_type, value in entries:
         try:
-            # 解码消息 ID
-            msg_id = msg_id.decode('utf-8', errors='replace') if isinstance(msg_id, bytes) else msg_id
-            
-            # 处理消息数据
-            if isinstance(msg_data, bytes):
-                msg_data = process_redis_value(msg_data)
-            elif isinstance(msg_data, dict):
-                msg_data = {
-                    k.decode('utf-8', errors='replace') if isinstance(k, bytes) else k: 
-                    process_redis_value(v) for k, v in msg_data.items()
-                }
-
-            # 直接以字符串形式获取 source_id 和 content
-            source_id_base = msg_data.get('source_id')
-            if isinstance(source_id_base, dict) and source_id_base.get('_type') == 'binary':
-                source_id_base = source_id_base.get('data', '')
-            content = msg_data.get('content')
-            if isinstance(content, dict) and content.get('_type') == 'binary':
-                content = content.get('data', '')
-
-            # 检查必要字段是否存在且不为空
-            if not source_id_base or not content:
-                raise ValueError("Message is missing 'source_id' or 'content', or they are empty.")
-
-            source_id = "dynamic::" + str(source_id_base)
-            
-            # 跳过来自Stream的测试键 (pcp:)
-            if source_id.startswith("dynamic::pcp:"):
-                logger.debug(f"跳过来自Stream的测试键: {source_id}")
-                processed_msg_ids.append(msg_id) # 即使跳过，也要确认消息，防止毒丸消息
-                continue # 跳过处理和保存此消息
-
-            # 检查 ID 是否已存在，如果存在则跳过
-            if source_id in seen_ids:
-                logger.debug(f"跳过重复的 dynamic::Stream ID: {source_id}")
-                processed_msg_ids.append(msg_id) # 即使跳过，也要确认消息
-                continue # 跳过处理和保存此消息
-
-            # 安全地处理 metadata
-            metadata_str = msg_data.get('metadata', '')
-            try:
-                if isinstance(metadata_str, bytes):
-                    metadata_str = metadata_str.decode('utf-8', errors='replace')
-                elif isinstance(metadata_str, dict):
-                    if metadata_str.get('_type') == 'binary':
-                        metadata_str = metadata_str.get('data', '')
-                    else:
-                        # 如果是普通字典，直接使用
-                        raw_metadata = metadata_str
-                        metadata_str = None  # 标记已经处理为字典
-
-                if metadata_str is not None:  # 如果还没有处理为字典
-                    if metadata_str.strip():
-                        try:
-                            raw_metadata = json.loads(metadata_str)
-                        except json.JSONDecodeError:
-                            # 如果不是有效的JSON，将其作为纯文本处理
-                            raw_metadata = {"text": metadata_str}
-                    else:
-                        raw_metadata = {}
+            if isinstance(key_type, Exception) or isinstance(value, Exception):
+                error = value if isinstance(value, Exception) else key_type
+                logger.error(f"获取键 {key} 时出错: {error}")
+                continue
 
-                sanitized_metadata = {
-                    str(key): sanitize_metadata_value(value) 
-                    for key, value in raw_metadata.items()
-                }
+            if key_type == b'hash':
+                data = process_dynamic_data(key, value)
+            else:
+                data = process_dynamic_data(key, {'document': value})
 
-                if not sanitized_metadata:
-                    sanitized_metadata['source'] = str(source_id_base)
+            if data is None:
+                logger.warning(f"跳过无法处理的动态数据键: {key.decode('utf-8', errors='replace')}")
+                continue
+            results.append(data)
+        except Exception as e:
+            logger.error(f"处理键 {key} 时出错: {str(e)}")
+    return results
 
-                # 为每个切分出的文本块准备数据
-                batch_ids.append(source_id)
-                batch_documents.append(content)
-                batch_metadatas.append(sanitized_metadata)
+def snapshot_redis_data(output_file='local_synced_data.jsonl'):
+    """
+    批量快照模式：以 dynamic::* MATCH 和较大的 COUNT 在服务端过滤键，
+    按批次用 pipeline 获取 TYPE/HGETALL，在线程池中解码，并分块缓冲写入文件。
+    解码当前批次的同时会去 Redis 拉取下一批次。
+    """
+    r = connect_redis()
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
 
-                processed_msg_ids.append(msg_id)
+    total_keys = 0
+    total_written = 0
+    start_time = time.time()
+    window_start = start_time
+    window_keys = 0
+    write_buffer = []
+
+    def flush_writes():
+        # 写入成功后才记录为已同步，失败时释放预留（见 commit_records），以便 Stream worker 或下次快照重新写入
+        nonlocal total_written
+        commit_records(output_file, write_buffer)
+        total_written += len(write_buffer)
+        write_buffer.clear()
+
+    def collect(documents):
+        for data in documents:
+            # 已同步（或已预留待写入）过相同内容则跳过，内容有变化时追加新版本
+            if is_synced(data):
+                logger.debug(f"跳过未变化的 dynamic ID: {data['id']}")
+                continue
+            reserve_record(data)
+            write_buffer.append(data)
+        if len(write_buffer) >= SNAPSHOT_WRITE_CHUNK:
+            flush_writes()
 
-            except Exception as e:
-                logger.error(f"处理 metadata 时出错: {str(e)}", extra={"msg_id": msg_id})
-                # 使用默认的 metadata
-                sanitized_metadata = {'source': str(source_id_base)}
-                batch_ids.append(source_id)
-                batch_documents.append(content)
-                batch_metadatas.append(sanitized_metadata)
-                processed_msg_ids.append(msg_id)
+    try:
+        with ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS) as executor:
+            pending = []  # 正在解码的批次，保持提交顺序以便按顺序写入
+            batch = []
+
+            def flush_batch():
+                nonlocal total_keys, window_start, window_keys
+                entries = fetch_dynamic_batch(r, batch)
+                pending.append(executor.submit(decode_dynamic_batch, entries))
+                total_keys += len(batch)
+                window_keys += len(batch)
+                batch.clear()
+
+                # 只保留有限数量的在途批次，已完成的批次按顺序写出
+                while pending and (len(pending) > SNAPSHOT_WORKERS or pending[0].done()):
+                    collect(pending.pop(0).result())
+
+                if window_keys >= SNAPSHOT_REPORT_EVERY:
+                    now = time.time()
+                    elapsed = now - window_start
+                    rate = window_keys / elapsed if elapsed > 0 else float('inf')
+                    logger.info(
+                        f"快照进度: 已扫描 {total_keys} 个键，已写入 {total_written} 个文档，"
+                        f"每千键耗时 {elapsed * 1e6 / window_keys:.0f} ms ({rate:.0f} keys/s)")
+                    window_start = now
+                    window_keys = 0
+
+            for key in r.scan_iter(match=SNAPSHOT_KEY_PATTERN, count=SNAPSHOT_SCAN_COUNT):
+                batch.append(key)
+                if len(batch) >= SNAPSHOT_PIPELINE_BATCH:
+                    flush_batch()
+            if batch:
+                flush_batch()
+
+            for future in pending:
+                collect(future.result())
+            if write_buffer:
+                flush_writes()
+    finally:
+        # 异常中止时缓冲区中尚未写入的记录同样释放预留
+        release_records(write_buffer)
+    get_output_writer(output_file).sync()
+
+    elapsed = time.time() - start_time
+    per_thousand = elapsed * 1000 / total_keys if total_keys else 0.0
+    logger.info(
+        f"快照完成: 扫描 {total_keys} 个键，写入 {total_written} 个新文档，总耗时 {elapsed:.2f} 秒，"
+        f"平均每千键 {per_thousand:.2f} 秒")
+    return {"keys_scanned": total_keys, "documents_written": total_written, "elapsed_seconds": elapsed}
+
+# 单条消息解析（同步版与异步版 worker 共用）
+def parse_stream_message(msg_id, msg_data) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    解析一条 Stream 消息，返回 (消息 ID, 待写入记录)。
+    待写入记录为文档或墓碑；为 None 表示无需写入（测试键、内容未变化的重复消息）但仍应确认。
+    消息格式错误时抛出异常。
+    """
+    # 解码消息 ID
+    msg_id = msg_id.decode('utf-8', errors='replace') if isinstance(msg_id, bytes) else msg_id
+
+    # 处理消息数据
+    if isinstance(msg_data, bytes):
+        msg_data = process_redis_value(msg_data)
+    elif isinstance(msg_data, dict):
+        msg_data = {
+            k.decode('utf-8', errors='replace') if isinstance(k, bytes) else k: 
+            process_redis_value(v) for k, v in msg_data.items()
+        }
+
+    # 直接以字符串形式获取 source_id 和 content
+    source_id_base = msg_data.get('source_id')
+    if isinstance(source_id_base, dict) and source_id_base.get('_type') == 'binary':
+        source_id_base = source_id_base.get('data', '')
+    content = msg_data.get('content')
+    if isinstance(content, dict) and content.get('_type') == 'binary':
+        content = content.get('data', '')
 
+    # 删除消息：写入墓碑记录，由压缩器移除该 id 的所有历史版本
+    if msg_data.get('op') == 'delete' and source_id_base:
+        return msg_id, make_tombstone("dynamic::" + str(source_id_base))
+
+    # 检查必要字段是否存在且不为空
+    if not source_id_base or not content:
+        raise ValueError("Message is missing 'source_id' or 'content', or they are empty.")
+
+    source_id = "dynamic::" + str(source_id_base)
+    
+    # 跳过来自Stream的测试键 (pcp:)
+    if source_id.startswith("dynamic::pcp:"):
+        logger.debug(f"跳过来自Stream的测试键: {source_id}")
+        return msg_id, None # 即使跳过，也要确认消息，防止毒丸消息
+
+    # 安全地处理 metadata
+    metadata_str = msg_data.get('metadata', '')
+    try:
+        if isinstance(metadata_str, bytes):
+            metadata_str = metadata_str.decode('utf-8', errors='replace')
+        elif isinstance(metadata_str, dict):
+            if metadata_str.get('_type') == 'binary':
+                metadata_str = metadata_str.get('data', '')
+            else:
+                # 如果是普通字典，直接使用
+                raw_metadata = metadata_str
+                metadata_str = None  # 标记已经处理为字典
+
+        if metadata_str is not None:  # 如果还没有处理为字典
+            if metadata_str.strip():
+                try:
+                    raw_metadata = json.loads(metadata_str)
+                except json.JSONDecodeError:
+                    # 如果不是有效的JSON，将其作为纯文本处理
+                    raw_metadata = {"text": metadata_str}
+            else:
+                raw_metadata = {}
+
+        sanitized_metadata = {
+            str(key): sanitize_metadata_value(value) 
+            for key, value in raw_metadata.items()
+        }
+
+        if not sanitized_metadata:
+            sanitized_metadata['source'] = str(source_id_base)
+
+    except Exception as e:
+        logger.error(f"处理 metadata 时出错: {str(e)}", extra={"msg_id": msg_id})
+        # 使用默认的 metadata
+        sanitized_metadata = {'source': str(source_id_base)}
+
+    record = {"id": source_id, "document": content, "metadata": sanitized_metadata}
+    # 已同步过相同内容（重复投递）则跳过，内容有变化时作为更新写入
+    if is_synced(record):
+        logger.debug(f"跳过未变化的 dynamic::Stream ID: {source_id}")
+        return msg_id, None # 即使跳过，也要确认消息
+    return msg_id, record
+
+def parse_messages(messages) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    解析一批消息，返回 (需要确认的消息 ID, 待写入记录)。
+    如果没有任何记录需要写入，返回整批消息的 ID 以便 ACK，防止毒丸消息。
+    """
+    records = []
+    processed_msg_ids = []
+
+    for msg_id, msg_data in messages:
+        try:
+            msg_id, record = parse_stream_message(msg_id, msg_data)
+            processed_msg_ids.append(msg_id)
+            if record is not None:
+                reserve_record(record)
+                records.append(record)
         except Exception as e:
             logger.error(f"Failed to parse or process message. Error: {str(e)}", extra={"msg_id": msg_id})
 
-    if not batch_documents:
+    if not records:
         # 如果所有消息都解析失败，也要返回ID以便ACK，防止毒丸消息
         return [msg_id.decode('utf-8', errors='replace') if isinstance(msg_id, bytes) else msg_id 
-                for msg_id, _ in messages] if messages else []
+                for msg_id, _ in messages], []
+    return processed_msg_ids, records
+
+def commit_records(filename, records: List[Dict[str, Any]]):
+    """将解析后的记录写入本地文件，并记录已同步的版本；写入失败时释放预留后重新抛出异常"""
+    # 长期打开的写入器，一批只做一次落盘
+    try:
+        write_documents(filename, records)
+    except Exception:
+        release_records(records)
+        raise
+    deleted_ids = [record['id'] for record in records if is_tombstone(record)]
+    with _seen_lock:
+        for record in records:
+            key = _record_key(record)
+            if key is None:
+                seen_ids.pop(record['id'], None) # 删除后重新创建的文档需要再次同步
+            else:
+                seen_ids[record['id']] = key
+            # 之后的批次可能已经预留了更新的版本，只移除本批的预留
+            if record['id'] in pending_ids and pending_ids[record['id']] == key:
+                del pending_ids[record['id']]
+    logger.info(
+        f"成功处理 {len(records) - len(deleted_ids)} 个文档、{len(deleted_ids)} 个删除，并将数据写入本地文件：{filename}")
+
+# 批量消息处理
+def process_messages_batch(messages: List[Tuple[str, Dict[str, str]]]):
+    """
+    一次性处理一批消息，将大文档直接存储。
+    """
+    if not messages:
+        return []
+    first_msg_id = messages[0][0].decode('utf-8', errors='replace') if isinstance(messages[0][0], bytes) else messages[0][0]
+    last_msg_id = messages[-1][0].decode('utf-8', errors='replace') if isinstance(messages[-1][0], bytes) else messages[-1][0]
+    logger.debug(f"Parsing batch of {len(messages)} messages from {first_msg_id} to {last_msg_id}.")
+
+    processed_msg_ids, records = parse_messages(messages)
+    if not records:
+        return processed_msg_ids
 
     try:
-        # 将数据写入本地文件
-        with open(LOCAL_OUTPUT_FILE, 'a', encoding='utf-8') as f:
-            for i in range(len(batch_ids)):
-                data_to_save = {
-                    "id": batch_ids[i],
-                    "document": batch_documents[i],
-                    "metadata": batch_metadatas[i]
-                }
-                f.write(json.dumps(data_to_save, ensure_ascii=False) + '\n')
-                seen_ids.add(batch_ids[i]) # 将新的 ID 添加到已同步集合
-
-        logger.info(
-            f"成功处理 {len(batch_ids)} 个文档，并将数据写入本地文件：{LOCAL_OUTPUT_FILE}")
+        commit_records(LOCAL_OUTPUT_FILE, records)
         return processed_msg_ids
 
     except Exception as e:
@@ -460,6 +737,16 @@ def run_sync_worker():
                 logger.error(f"重置消费者组失败: {e}")
                 raise
 
+    compactor = None
+    if COMPACTION_INTERVAL_SECONDS > 0:
+        compactor = BackgroundCompactor(
+            LOCAL_OUTPUT_FILE,
+            writer=get_output_writer(LOCAL_OUTPUT_FILE),
+            interval_seconds=COMPACTION_INTERVAL_SECONDS,
+            min_growth_bytes=COMPACTION_MIN_GROWTH_BYTES
+        )
+        compactor.start()
+
     while not SHUTDOWN_REQUESTED:
         logger.info("开始同步数据库...")
         try:
@@ -473,6 +760,7 @@ def run_sync_worker():
             )
             
             if not messages:
+                get_output_writer(LOCAL_OUTPUT_FILE).tick()  # interval 策略下空闲时也要按时落盘
                 continue
 
             # messages[0][0] 是 stream name, messages[0][1] 是消息列表
@@ -494,6 +782,10 @@ def run_sync_worker():
             logger.error(f"主循环中发生未知错误: {e}", extra={'msg_id': 'N/A'})
             time.sleep(5)
 
+    if compactor is not None:
+        compactor.stop()
+    close_output_writers()
+
 def main():
     """
     主函数
@@ -501,6 +793,7 @@ def main():
     output_file = 'local_synced_data.jsonl'
     print(f"开始同步数据到 {output_file}")
     sync_redis_data(output_file)
+    close_output_writers()
     print("同步完成")
 
 if __name__ == "__main__":